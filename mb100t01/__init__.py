@@ -0,0 +1,14 @@
+"""Helper code for the Advanced Image Analysis (MB100T01) course.
+
+The notebooks of the book stay self-contained and readable; this package
+collects the pieces that would clutter them, mostly scalable variants of
+plots and measurements used in the course. From a notebook inside the book
+add the repository root to ``sys.path`` first::
+
+    import sys
+    sys.path.append("../..")
+
+    from mb100t01.plotting import hist_pairplot
+"""
+
+__version__ = "0.1.0"
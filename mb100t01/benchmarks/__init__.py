@@ -0,0 +1,9 @@
+"""Benchmarks of the course's table, statistics and plotting workloads.
+
+The suites in the ``bench_*`` modules follow the conventions of asv
+(airspeed velocity): classes with ``params``, ``param_names``, a
+``setup`` that may raise ``NotImplementedError`` to skip a combination,
+and ``time_*`` methods. ``python -m mb100t01.benchmarks`` runs them,
+appends the timings to a history file and reports regressions against
+earlier runs; see :mod:`mb100t01.benchmarks.runner`.
+"""
@@ -0,0 +1,125 @@
+"""Object measurements on dense label images, against skimage."""
+
+from __future__ import annotations
+
+import numpy as np
+
+# objects per image; each gets about 160 pixels
+LABEL_COUNTS = [10**2, 10**3, 10**4, 10**5]
+
+
+def dense_labels(n_labels: int, pixels_per_label: int = 160, seed: int = 0):
+    """Return a label image of ``n_labels`` touching cells and an intensity image.
+
+    Cells are the Voronoi regions of random seeds, with a one pixel gap of
+    background where some of them meet, like a crowded segmentation.
+    """
+    from scipy.ndimage import distance_transform_edt
+
+    rng = np.random.default_rng(seed)
+    side = int(np.sqrt(n_labels * pixels_per_label))
+    seeds = np.ones((side, side), dtype=bool)
+    positions = rng.choice(side * side, size=n_labels, replace=False)
+    seeds.flat[positions] = False
+    indices = distance_transform_edt(seeds, return_distances=False, return_indices=True)
+    numbers = np.zeros(side * side, dtype=np.int32)
+    numbers[positions] = np.arange(1, n_labels + 1)
+    labels = numbers[indices[0] * side + indices[1]]
+    labels[1:][labels[1:] != labels[:-1]] = 0
+    intensity = rng.integers(0, 256, labels.shape).astype(np.uint16)
+    return labels, intensity
+
+
+class RegionProps:
+    """The ``BBBC007_analysis.csv`` / ``blobs_statistics.csv`` columns for every label."""
+
+    params = [LABEL_COUNTS]
+    param_names = ["n_labels"]
+    timeout = 300
+    properties = (
+        "label", "area", "bbox", "centroid", "axis_major_length", "axis_minor_length",
+        "eccentricity", "extent", "equivalent_diameter_area", "intensity_mean",
+    )
+
+    def setup(self, n_labels):
+        self.labels, self.intensity = dense_labels(n_labels)
+
+    def time_bincount_moments(self, n_labels):
+        from ..measure import regionprops_table
+
+        regionprops_table(self.labels, self.intensity, properties=self.properties)
+
+    def time_skimage(self, n_labels):
+        from skimage.measure import regionprops_table
+
+        regionprops_table(self.labels, self.intensity, properties=self.properties)
+
+
+class Feret:
+    """``feret_diameter_max`` of ``blobs_statistics.csv`` for every label."""
+
+    params = [LABEL_COUNTS[:3]]
+    param_names = ["n_labels"]
+    timeout = 300
+
+    def setup(self, n_labels):
+        self.labels, _ = dense_labels(n_labels)
+
+    def time_rotating_calipers(self, n_labels):
+        from ..measure import feret_table
+
+        feret_table(self.labels)
+
+    def time_skimage(self, n_labels):
+        from skimage.measure import regionprops_table
+
+        regionprops_table(self.labels, properties=("feret_diameter_max",))
+
+
+class Neighborhood:
+    """Nearest neighbour distances and neighbour counts, 1000 objects per image."""
+
+    params = [[10**4, 10**5, 10**6]]
+    param_names = ["n_objects"]
+    timeout = 300
+
+    def setup(self, n_objects):
+        import pandas as pd
+
+        rng = np.random.default_rng(0)
+        self.table = pd.DataFrame({
+            "X": rng.uniform(0, 1000, n_objects),
+            "Y": rng.uniform(0, 1000, n_objects),
+            "file_name": np.arange(n_objects) // 1000,
+        })
+
+    def time_neighborhood_features(self, n_objects):
+        from ..measure.neighbors import _CACHE, neighborhood_features
+
+        _CACHE.clear()
+        neighborhood_features(self.table, k=(1, 6), radii=(50,), image_column="file_name")
+
+
+class Crops:
+    """Every object crop of a label image, with its mask."""
+
+    params = [LABEL_COUNTS[:3]]
+    param_names = ["n_labels"]
+
+    def setup(self, n_labels):
+        import pandas as pd
+
+        from ..measure import regionprops_table
+
+        self.labels, self.intensity = dense_labels(n_labels)
+        self.table = pd.DataFrame(regionprops_table(self.labels, properties=("label", "bbox")))
+
+    def time_pack_crops(self, n_labels):
+        from ..images import pack_crops
+
+        pack_crops(self.table, self.intensity, margin=2, labels=self.labels)
+
+    def time_copy_loop(self, n_labels):
+        for label, top, left, bottom, right in self.table.itertuples(index=False):
+            self.intensity[max(top - 2, 0):bottom + 2, max(left - 2, 0):right + 2].copy()
+            self.labels[max(top - 2, 0):bottom + 2, max(left - 2, 0):right + 2] == label
@@ -0,0 +1,83 @@
+"""seaborn figures of the ``02_plotting`` notebooks, drawn to an Agg canvas."""
+
+from __future__ import annotations
+
+from .data import GROUP_COLUMNS, ROW_COUNTS, TABLES, synthetic_table
+
+# seaborn draws one artist per point or kernel evaluation; above these row
+# counts a single render takes minutes and the combination is skipped
+MAX_ROWS = {"histplot": 10**7, "violinplot": 10**6, "pairplot": 10**4, "heatmap": 10**7}
+
+
+class _Figure:
+    params = [ROW_COUNTS, list(GROUP_COLUMNS)]
+    param_names = ["n_rows", "table"]
+    timeout = 600
+    kind = ""
+
+    def setup(self, n_rows, table):
+        if n_rows > MAX_ROWS[self.kind]:
+            raise NotImplementedError
+        import matplotlib
+
+        matplotlib.use("Agg")
+        self.df = synthetic_table(table, n_rows)
+        self.by = GROUP_COLUMNS.get(table)
+        self.value = self.df.select_dtypes("number").columns[0]
+
+    def teardown(self, n_rows, table):
+        import matplotlib.pyplot as plt
+
+        plt.close("all")
+
+    def _render(self, draw):
+        # a fresh figure per call, so repeated calls do not pile up artists
+        import matplotlib.pyplot as plt
+
+        fig, ax = plt.subplots()
+        draw(ax)
+        fig.canvas.draw()
+        plt.close(fig)
+
+
+class Histplot(_Figure):
+    kind = "histplot"
+
+    def time_histplot(self, n_rows, table):
+        import seaborn as sns
+
+        self._render(lambda ax: sns.histplot(data=self.df, x=self.value, hue=self.by, kde=True, ax=ax))
+
+
+class Violinplot(_Figure):
+    kind = "violinplot"
+
+    def time_violinplot(self, n_rows, table):
+        import seaborn as sns
+
+        self._render(lambda ax: sns.violinplot(data=self.df, x=self.by, y=self.value, ax=ax))
+
+
+class Pairplot(_Figure):
+    # as in 01_Introduction_to_Seaborn; the 13 columns of Results take 25x longer
+    params = [ROW_COUNTS, ["BBBC007_analysis"]]
+    kind = "pairplot"
+
+    def time_pairplot(self, n_rows, table):
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
+        grid = sns.pairplot(self.df, hue=self.by)
+        grid.figure.canvas.draw()
+        plt.close(grid.figure)
+
+
+class Heatmap(_Figure):
+    params = [ROW_COUNTS, list(TABLES)]
+    kind = "heatmap"
+
+    def time_corr_heatmap(self, n_rows, table):
+        import seaborn as sns
+
+        corr = self.df.select_dtypes("number").corr()
+        self._render(lambda ax: sns.heatmap(corr, cmap="Blues", annot=False, ax=ax))
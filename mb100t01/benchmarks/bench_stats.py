@@ -0,0 +1,49 @@
+"""Hypothesis tests of ``05_Statistic`` and the annotation notebook."""
+
+from __future__ import annotations
+
+from .data import GROUP_COLUMNS, ROW_COUNTS, synthetic_table
+
+# the measurement compared between groups in each table
+VALUE_COLUMNS = {"BBBC007_analysis": "area", "Results": "Area"}
+
+
+class GroupTests:
+    """Tests of one measurement between the groups of a table."""
+
+    params = [ROW_COUNTS, list(GROUP_COLUMNS)]
+    param_names = ["n_rows", "table"]
+    timeout = 300
+
+    def setup(self, n_rows, table):
+        self.by = GROUP_COLUMNS[table]
+        self.value = VALUE_COLUMNS[table]
+        # the notebooks test cleaned tables, as with penguins_cleaned
+        self.df = synthetic_table(table, n_rows).dropna(subset=[self.value])
+        self.groups = [group[self.value].to_numpy() for _, group in self.df.groupby(self.by)]
+
+    def time_normaltest(self, n_rows, table):
+        from scipy.stats import normaltest
+
+        for values in self.groups:
+            normaltest(values)
+
+    def time_mannwhitneyu(self, n_rows, table):
+        from scipy.stats import mannwhitneyu
+
+        mannwhitneyu(self.groups[0], self.groups[1], alternative="two-sided")
+
+    def time_kruskal(self, n_rows, table):
+        from scipy.stats import kruskal
+
+        kruskal(*self.groups)
+
+    def time_pairwise_tukeyhsd(self, n_rows, table):
+        from statsmodels.stats.multicomp import pairwise_tukeyhsd
+
+        pairwise_tukeyhsd(endog=self.df[self.value], groups=self.df[self.by], alpha=0.05)
+
+    def time_posthoc_dunn(self, n_rows, table):
+        import scikit_posthocs as sp
+
+        sp.posthoc_dunn(self.df, p_adjust="bonferroni", group_col=self.by, val_col=self.value)
@@ -0,0 +1,85 @@
+"""pandas operations of the ``01_pandas_statistics`` notebooks."""
+
+from __future__ import annotations
+
+from .data import GROUP_COLUMNS, ROW_COUNTS, TABLES, read_table, synthetic_csv, synthetic_store, synthetic_table
+
+
+class ReadCSV:
+    """``pd.read_csv`` with the arguments the notebooks pass."""
+
+    params = [ROW_COUNTS, list(TABLES)]
+    param_names = ["n_rows", "table"]
+    timeout = 300
+
+    def setup(self, n_rows, table):
+        self.path = synthetic_csv(table, n_rows)
+
+    def time_read_csv(self, n_rows, table):
+        read_table(self.path, table)
+
+
+class GroupBy:
+    """Per-image and per-type summaries as in ``04_Pandas_Bonus`` and ``05_Statistic``."""
+
+    params = [ROW_COUNTS, list(GROUP_COLUMNS)]
+    param_names = ["n_rows", "table"]
+
+    def setup(self, n_rows, table):
+        self.df = synthetic_table(table, n_rows)
+        self.store = synthetic_store(table, n_rows)
+        self.by = GROUP_COLUMNS[table]
+        self.value = self.df.select_dtypes("number").columns[0]
+
+    def time_groupby_mean(self, n_rows, table):
+        self.df.groupby(self.by).mean(numeric_only=True).reset_index()
+
+    def time_chunked_groupby_mean(self, n_rows, table):
+        from ..columnar import groupby_agg
+
+        groupby_agg(self.store, self.by, "mean", workers=1).reset_index()
+
+    def time_groupby_aggregate_unstack(self, n_rows, table):
+        binned = self.df[self.value] > self.df[self.value].median()
+        self.df.groupby([self.by, binned])[self.value].aggregate("mean").unstack()
+
+    def time_pivot_table(self, n_rows, table):
+        self.df.pivot_table(self.value, index=self.by, aggfunc="mean")
+
+    def time_describe(self, n_rows, table):
+        self.df.describe()
+
+
+class Corr:
+    """Correlation matrix of the measurements, as in ``03_Pandas_EDA``."""
+
+    params = [ROW_COUNTS, list(TABLES)]
+    param_names = ["n_rows", "table"]
+
+    def setup(self, n_rows, table):
+        self.df = synthetic_table(table, n_rows)
+
+    def time_corr(self, n_rows, table):
+        self.df.select_dtypes("number").corr()
+
+
+class Filter:
+    """The "round nuclei of one image" selection of ``03_Pandas_EDA``."""
+
+    params = [ROW_COUNTS]
+    param_names = ["n_rows"]
+    timeout = 300
+
+    def setup(self, n_rows):
+        self.df = synthetic_table("BBBC007_analysis", n_rows)
+        self.store = synthetic_store("BBBC007_analysis", n_rows)
+        self.name = self.df["file_name"].iloc[-1]
+
+    def time_boolean_masks(self, n_rows):
+        df = self.df
+        df[(df["aspect_ratio"] < 1.2) & (df["file_name"] == self.name)]
+
+    def time_columnar_query(self, n_rows):
+        from ..columnar import col, query
+
+        query(self.store, (col("aspect_ratio") < 1.2) & (col("file_name") == self.name))
@@ -0,0 +1,76 @@
+"""Synthetic tables with the schemas of the course's CSV files.
+
+Rows are sampled from :class:`mb100t01.synthetic.tables.TableModel` fitted to the
+real table, so column names, dtypes, per-group marginals and group sizes,
+and the correlations between columns match the original at any row
+count. The tables are written to CSV once per row count and reused by
+later runs.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+from typing import Union
+
+import pandas as pd
+
+from ..synthetic.tables import DATA_DIR, GROUP_COLUMNS, TABLES, TableModel
+
+CACHE_DIR = Path(__file__).resolve().parent.parent.parent / ".benchmarks" / "data"
+
+# row counts every suite is parameterized over
+ROW_COUNTS = [10**3, 10**4, 10**5, 10**6, 10**7]
+
+
+@lru_cache(maxsize=None)
+def _model(name: str) -> TableModel:
+    return TableModel.from_reference(name)
+
+
+def synthetic_table(name: str, n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """Return ``n_rows`` rows shaped like table ``name``, deterministic in ``seed``."""
+    return _model(name).sample(n_rows, seed)
+
+
+def synthetic_csv(name: str, n_rows: int, seed: int = 0) -> Path:
+    """Write :func:`synthetic_table` in the original file's format; return its path.
+
+    The file is cached under ``.benchmarks/data`` and regenerated only when
+    the original table changes.
+    """
+    table = TABLES[name]
+    source = DATA_DIR / table["file"]
+    digest = hashlib.sha256(source.read_bytes()).hexdigest()[:12]
+    path = CACHE_DIR / f"{name}-{n_rows}-{seed}-{digest}-copula.csv"
+    if not path.is_file():
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        frame = synthetic_table(name, n_rows, seed)
+        temporary = path.with_suffix(".tmp")
+        frame.to_csv(
+            temporary, sep=table["read_csv"].get("delimiter", ","), index=_model(name).write_index
+        )
+        temporary.replace(path)
+    return path
+
+
+def synthetic_store(name: str, n_rows: int, seed: int = 0):
+    """Write :func:`synthetic_table` as a :class:`~mb100t01.columnar.ColumnStore`; return it.
+
+    Cached under ``.benchmarks/data`` like :func:`synthetic_csv`.
+    """
+    from ..columnar import ColumnStore, write_store
+
+    source = DATA_DIR / TABLES[name]["file"]
+    digest = hashlib.sha256(source.read_bytes()).hexdigest()[:12]
+    path = CACHE_DIR / f"{name}-{n_rows}-{seed}-{digest}.columns"
+    if (path / "store.json").is_file():
+        return ColumnStore(path)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    return write_store(synthetic_table(name, n_rows, seed), path)
+
+
+def read_table(path: Union[str, Path], name: str) -> pd.DataFrame:
+    """Read a file written by :func:`synthetic_csv` the way the notebooks do."""
+    return pd.read_csv(path, **TABLES[name]["read_csv"])
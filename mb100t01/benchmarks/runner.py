@@ -0,0 +1,309 @@
+"""Running the benchmark suites and keeping their history.
+
+Benchmarks are discovered in the ``bench_*`` modules of this package and
+timed the way asv does it: after ``setup``, a warm-up call decides how
+many calls make up one sample of at least ``sample_time`` seconds, then
+``repeat`` samples are taken. Every run appends one JSON line to the
+history file with the median, minimum and quartiles of each benchmark,
+the git commit and the versions of the libraries involved. A benchmark
+whose minimum exceeds ``ratio`` times the median of its minima in earlier
+runs on the same machine is reported as a regression, together with the
+library versions that changed::
+
+    python -m mb100t01.benchmarks                       # up to 10**6 rows
+    python -m mb100t01.benchmarks -b GroupTests --max-rows 10000000
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import importlib
+import itertools
+import json
+import pkgutil
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+HISTORY_FILE = Path(__file__).resolve().parent.parent.parent / ".benchmarks" / "history.jsonl"
+
+# distributions whose upgrades the benchmarks are meant to catch
+PACKAGES = (
+    "numpy", "pandas", "scipy", "statsmodels", "scikit-posthocs", "seaborn", "matplotlib",
+)
+
+# parameters giving the size of a benchmark: table rows, or labels and
+# objects, each of which is one row of the measurement table
+SIZE_PARAMETERS = ("n_rows", "n_labels", "n_objects")
+
+
+@dataclass
+class Benchmark:
+    """One ``time_*`` method of a suite class and its parameter combinations."""
+
+    name: str
+    suite: type
+    method: str
+    param_names: List[str]
+    params: List[tuple]
+    timeout: float = 60.0
+
+    def keys(self) -> List[str]:
+        return [self.key(combination) for combination in self.params]
+
+    def key(self, combination: tuple) -> str:
+        return f"{self.name}({', '.join(map(repr, combination))})"
+
+
+def discover(pattern: Optional[str] = None) -> List[Benchmark]:
+    """Return the benchmarks of the ``bench_*`` modules whose name matches ``pattern``."""
+    from . import __path__ as package_path
+
+    benchmarks = []
+    for module_info in sorted(pkgutil.iter_modules(package_path), key=lambda info: info.name):
+        if not module_info.name.startswith("bench_"):
+            continue
+        module = importlib.import_module(f"{__package__}.{module_info.name}")
+        for class_name, suite in sorted(vars(module).items()):
+            if not isinstance(suite, type) or class_name.startswith("_") or suite.__module__ != module.__name__:
+                continue
+            params = getattr(suite, "params", [])
+            if params and not isinstance(params[0], (list, tuple)):
+                params = [params]
+            combinations = list(itertools.product(*params)) if params else [()]
+            for method in sorted(dir(suite)):
+                if not method.startswith("time_"):
+                    continue
+                name = f"{module_info.name}.{class_name}.{method}"
+                if pattern and not re.search(pattern, name):
+                    continue
+                benchmarks.append(Benchmark(
+                    name=name,
+                    suite=suite,
+                    method=method,
+                    param_names=list(getattr(suite, "param_names", [])),
+                    params=combinations,
+                    timeout=getattr(suite, "timeout", 60.0),
+                ))
+    return benchmarks
+
+
+def time_benchmark(
+    benchmark: Benchmark,
+    combination: tuple,
+    repeat: int = 5,
+    sample_time: float = 0.01,
+) -> Optional[Dict[str, float]]:
+    """Time one parameter combination; ``None`` if its ``setup`` skips it.
+
+    Sampling stops early once the benchmark's ``timeout`` is used up, so
+    slow combinations get fewer samples rather than none.
+    """
+    instance = benchmark.suite()
+    try:
+        if hasattr(instance, "setup"):
+            instance.setup(*combination)
+    except NotImplementedError:
+        return None
+    function = getattr(instance, benchmark.method)
+    try:
+        gc.collect()
+        start = time.perf_counter()
+        function(*combination)
+        warmup = time.perf_counter() - start
+        number = max(1, int(sample_time / warmup)) if warmup > 0 else 1
+        samples = []
+        deadline = time.perf_counter() + benchmark.timeout
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                function(*combination)
+            samples.append((time.perf_counter() - start) / number)
+            if time.perf_counter() > deadline:
+                break
+    finally:
+        if hasattr(instance, "teardown"):
+            instance.teardown(*combination)
+    samples.sort()
+    quartiles = statistics.quantiles(samples, n=4) if len(samples) > 1 else [samples[0]] * 3
+    return {
+        "median": statistics.median(samples),
+        "min": samples[0],
+        "q25": quartiles[0],
+        "q75": quartiles[2],
+        "number": number,
+        "repeat": len(samples),
+    }
+
+
+def environment() -> Dict[str, Optional[str]]:
+    """Versions of Python and of the benchmarked libraries."""
+    from importlib import metadata
+
+    versions: Dict[str, Optional[str]] = {"python": platform.python_version()}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path: Union[str, Path] = HISTORY_FILE) -> List[dict]:
+    """Return the runs stored in ``path``, oldest first."""
+    path = Path(path)
+    if not path.is_file():
+        return []
+    return [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+
+
+def append_history(run: dict, path: Union[str, Path] = HISTORY_FILE) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as handle:
+        handle.write(json.dumps(run) + "\n")
+
+
+def run_benchmarks(
+    benchmarks: Iterable[Benchmark],
+    max_rows: Optional[int] = None,
+    repeat: int = 5,
+    sample_time: float = 0.01,
+    progress: bool = False,
+) -> dict:
+    """Time ``benchmarks`` and return a run record for the history.
+
+    Combinations with a size parameter (see :data:`SIZE_PARAMETERS`) above
+    ``max_rows`` are left out.
+    """
+    results: Dict[str, Dict[str, float]] = {}
+    for benchmark in benchmarks:
+        for combination in benchmark.params:
+            values = dict(zip(benchmark.param_names, combination))
+            rows = max((values[name] for name in SIZE_PARAMETERS if name in values), default=None)
+            if max_rows is not None and rows is not None and rows > max_rows:
+                continue
+            key = benchmark.key(combination)
+            timing = time_benchmark(benchmark, combination, repeat=repeat, sample_time=sample_time)
+            if timing is None:
+                continue
+            results[key] = timing
+            if progress:
+                print(f"{_format_seconds(timing['median'])}  {key}", flush=True)
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "machine": platform.node(),
+        "environment": environment(),
+        "results": results,
+    }
+
+
+@dataclass
+class Regression:
+    """A benchmark that got slower than its history allows."""
+
+    key: str
+    baseline_seconds: float
+    seconds: float
+    changed: List[Tuple[str, Optional[str], Optional[str]]] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        text = (
+            f"{self.key}: {_format_seconds(self.baseline_seconds)} -> "
+            f"{_format_seconds(self.seconds)} ({self.seconds / self.baseline_seconds:.2f}x)"
+        )
+        if self.changed:
+            text += "; " + ", ".join(f"{name} {old} -> {new}" for name, old, new in self.changed)
+        return text
+
+
+def find_regressions(
+    run: dict, history: Sequence[dict], ratio: float = 1.2, window: int = 5
+) -> List[Regression]:
+    """Compare ``run`` with the last ``window`` runs on the same machine.
+
+    The baseline of a benchmark is the median of its minimum times in
+    those runs; the minimum is the least noisy estimate of its cost.
+    Library versions that differ from the most recent of those runs are
+    attached to each regression.
+    """
+    earlier = [entry for entry in history if entry.get("machine") == run.get("machine")]
+    regressions = []
+    for key, timing in run["results"].items():
+        previous = [entry for entry in earlier if key in entry["results"]][-window:]
+        if not previous:
+            continue
+        baseline = statistics.median(entry["results"][key]["min"] for entry in previous)
+        if timing["min"] > ratio * baseline:
+            last = previous[-1]["environment"]
+            changed = [
+                (name, last.get(name), version)
+                for name, version in run["environment"].items()
+                if last.get(name) != version
+            ]
+            regressions.append(Regression(key, baseline, timing["min"], changed))
+    return regressions
+
+
+def _format_seconds(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:7.2f}{unit:>2}"
+    return f"{seconds / 1e-9:7.2f}ns"
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m mb100t01.benchmarks",
+        description="Time the course's table, statistics and plotting workloads.",
+    )
+    parser.add_argument("-b", "--bench", help="regular expression selecting benchmarks")
+    parser.add_argument("--max-rows", type=int, default=10**6,
+                        help="skip parameter combinations with more table rows, labels or "
+                             "objects (default: 10**6)")
+    parser.add_argument("--repeat", type=int, default=5, help="samples per benchmark")
+    parser.add_argument("--history", default=str(HISTORY_FILE), help="JSON lines file of earlier runs")
+    parser.add_argument("--ratio", type=float, default=1.2,
+                        help="report benchmarks slower than this times their baseline")
+    parser.add_argument("--window", type=int, default=5, help="earlier runs forming the baseline")
+    parser.add_argument("--no-save", action="store_true", help="do not append this run to the history")
+    parser.add_argument("--list", action="store_true", help="only list the benchmarks")
+    args = parser.parse_args(argv)
+
+    benchmarks = discover(args.bench)
+    if args.list:
+        for benchmark in benchmarks:
+            print(f"{benchmark.name}  {benchmark.param_names}")
+        return 0
+
+    history = load_history(args.history)
+    run = run_benchmarks(benchmarks, max_rows=args.max_rows, repeat=args.repeat, progress=True)
+    regressions = find_regressions(run, history, ratio=args.ratio, window=args.window)
+    if not args.no_save:
+        append_history(run, args.history)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
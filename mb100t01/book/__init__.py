@@ -0,0 +1 @@
+"""Tooling around building the Jupyter Book: notebook execution and caching."""
@@ -0,0 +1,373 @@
+"""Shrinking executed notebooks and the built HTML.
+
+The notebooks carry large payloads: base64 PNGs of plots, GIFs pasted into
+markdown cells as ``data:`` URIs (``05_Statistic`` embeds 0.66 MB this
+way), and the whole ``pivottablejs.html`` document with the Titanic CSV in
+``04_Pandas_Bonus``. Jupyter Book copies all of it into the pages.
+
+Two passes, both run from the command line:
+
+* ``--notebooks`` moves image outputs and ``data:`` images of markdown
+  cells into a content-addressed store, ``<book_dir>/_assets``, and
+  replaces them with markdown image references. Identical images are
+  stored once, PNGs are recompressed losslessly first, and Jupyter Book
+  picks the images up from the references like any other figure. The
+  notebooks are rewritten in place and no backup is kept, so commit them
+  first.
+* the HTML pass, run after ``jupyter-book build``, does the same for
+  ``_build/html``: inline ``data:`` URIs become files in ``_images``,
+  identical files in ``_images`` are merged, PNGs are recompressed, full
+  HTML documents in outputs are moved into lazily loaded iframes, and
+  tables with many rows are split into pages.
+
+::
+
+    python -m mb100t01.book.compact advanced_image_analysis_mb100t01 --notebooks
+    jupyter-book build advanced_image_analysis_mb100t01/
+    python -m mb100t01.book.compact advanced_image_analysis_mb100t01
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import hashlib
+import html
+import io
+import os
+import re
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Union
+
+import nbformat
+
+from .sources import toc_notebooks
+
+ASSETS_DIR = "_assets"
+
+_SUFFIXES = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/gif": ".gif",
+    "image/svg+xml": ".svg",
+}
+_DATA_URI = re.compile(r"data:(image/(?:png|jpeg|gif|svg\+xml));base64,([A-Za-z0-9+/=\s]+)")
+_MARKDOWN_DATA_IMAGE = re.compile(r"!\[([^\]]*)\]\(\s*" + _DATA_URI.pattern + r"\s*\)")
+_ATTACHMENT_IMAGE = re.compile(r"!\[([^\]]*)\]\(attachment:([^)\s]+)\)")
+_EMBEDDED_DOCUMENT = re.compile(
+    r'(<div class="output text_html">)\s*(<!DOCTYPE html>.*?</html>)', re.S | re.I
+)
+_DATAFRAME = re.compile(r'<table[^>]*class="dataframe"[^>]*>.*?</table>', re.S)
+_ROW = re.compile(r"<tr[ >].*?</tr>", re.S)
+
+
+class AssetStore:
+    """Files named by the hash of their content, so each is stored once."""
+
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+
+    def put(self, data: bytes, suffix: str) -> Path:
+        """Store ``data`` unless an identical file exists; return its path."""
+        path = self.root / (hashlib.sha256(data).hexdigest()[:20] + suffix)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temporary = path.with_suffix(path.suffix + ".tmp")
+            temporary.write_bytes(data)
+            os.replace(temporary, path)
+        return path
+
+
+def recompress_png(data: bytes) -> bytes:
+    """Return the smallest lossless re-encoding of a PNG, or ``data`` itself.
+
+    Fully opaque images lose their alpha channel and images with at most
+    256 colors are stored with an exact palette. Every candidate is decoded
+    again and only kept if its pixels are identical to the original's.
+    """
+    import numpy as np
+    from PIL import Image
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Exception:
+        return data
+    if image.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+        return data
+    reference = np.asarray(image.convert("RGBA"))
+    save_args = {"dpi": image.info["dpi"]} if "dpi" in image.info else {}
+
+    candidates = [image]
+    rgba = image.convert("RGBA")
+    if (reference[..., 3] == 255).all():
+        rgba = rgba.convert("RGB")
+        candidates.append(rgba)
+    pixels = np.asarray(rgba)
+    flat = pixels.reshape(-1, pixels.shape[-1])
+    colors, indices = np.unique(flat, axis=0, return_inverse=True)
+    if len(colors) <= 256:
+        paletted = Image.fromarray(indices.reshape(pixels.shape[:2]).astype(np.uint8), "P")
+        palette = np.zeros((256, 3), np.uint8)
+        palette[: len(colors)] = colors[:, :3]
+        paletted.putpalette(palette.ravel().tolist())
+        if flat.shape[1] == 4:
+            paletted.info["transparency"] = bytes(colors[:, 3].tolist())
+        candidates.append(paletted)
+
+    best = data
+    for candidate in candidates:
+        buffer = io.BytesIO()
+        extra = {}
+        if "transparency" in candidate.info and candidate.mode == "P":
+            extra["transparency"] = candidate.info["transparency"]
+        candidate.save(buffer, format="PNG", optimize=True, **save_args, **extra)
+        encoded = buffer.getvalue()
+        if len(encoded) >= len(best):
+            continue
+        decoded = np.asarray(Image.open(io.BytesIO(encoded)).convert("RGBA"))
+        if decoded.shape == reference.shape and (decoded == reference).all():
+            best = encoded
+    return best
+
+
+def _asset_bytes(mime: str, data: bytes) -> bytes:
+    return recompress_png(data) if mime == "image/png" else data
+
+
+def _relative(path: Path, start: Path) -> str:
+    return Path(os.path.relpath(path, start)).as_posix()
+
+
+def compact_notebook(content: nbformat.NotebookNode, notebook_dir: Path, store: AssetStore) -> int:
+    """Move the images of ``content`` into ``store``, in place.
+
+    Image outputs are replaced by a ``text/markdown`` image reference
+    (their ``text/plain`` fallback is kept); ``data:`` images and image
+    attachments of markdown cells become ordinary image links. Paths are
+    relative to ``notebook_dir``.
+
+    Returns
+    -------
+    int
+        Number of images moved.
+    """
+    moved = 0
+
+    def reference(mime: str, payload: str) -> str:
+        nonlocal moved
+        moved += 1
+        path = store.put(_asset_bytes(mime, base64.b64decode(payload)), _SUFFIXES[mime])
+        return _relative(path, notebook_dir)
+
+    for cell in content.cells:
+        if cell.cell_type == "markdown":
+            attachments = cell.get("attachments", {})
+
+            def from_attachment(match):
+                bundle = attachments.get(match.group(2), {})
+                for mime, payload in bundle.items():
+                    if mime in _SUFFIXES and mime != "image/svg+xml":
+                        return f"![{match.group(1)}]({reference(mime, payload)})"
+                return match.group(0)
+
+            source = _MARKDOWN_DATA_IMAGE.sub(
+                lambda match: f"![{match.group(1)}]({reference(match.group(2), match.group(3))})",
+                cell.source,
+            )
+            source = _ATTACHMENT_IMAGE.sub(from_attachment, source)
+            cell.source = source
+            if attachments and not _ATTACHMENT_IMAGE.search(source):
+                cell.pop("attachments", None)
+        elif cell.cell_type == "code":
+            for output in cell.get("outputs", []):
+                data = output.get("data", {})
+                for mime in ("image/png", "image/jpeg"):
+                    if mime in data:
+                        payload = data.pop(mime)
+                        if isinstance(payload, list):
+                            payload = "".join(payload)
+                        data["text/markdown"] = f"![]({reference(mime, payload)})"
+                        output.get("metadata", {}).pop(mime, None)
+                        break
+    return moved
+
+
+def compact_notebooks(
+    book_dir: Union[str, Path],
+    notebooks: Optional[Sequence[Union[str, Path]]] = None,
+    assets: Optional[Union[str, Path]] = None,
+) -> Dict[Path, int]:
+    """Run :func:`compact_notebook` on the book's notebooks and overwrite them.
+
+    Images go to ``assets``, by default ``<book_dir>/_assets``. Returns the
+    number of images moved per notebook.
+    """
+    book_dir = Path(book_dir)
+    store = AssetStore(Path(assets) if assets is not None else book_dir / ASSETS_DIR)
+    if notebooks is None:
+        notebooks = toc_notebooks(book_dir)
+    moved = {}
+    for notebook in map(Path, notebooks):
+        content = nbformat.read(str(notebook), as_version=4)
+        moved[notebook] = compact_notebook(content, notebook.resolve().parent, store)
+        if moved[notebook]:
+            nbformat.write(content, str(notebook))
+    return moved
+
+
+@dataclass
+class HtmlReport:
+    """Result of :func:`compact_html`; sizes are in bytes."""
+
+    bytes_before: int
+    bytes_after: int
+    inlined_images: int = 0
+    duplicate_images: int = 0
+    recompressed_bytes_saved: int = 0
+    embedded_documents: int = 0
+    paginated_tables: int = 0
+
+
+def _tree_size(root: Path) -> int:
+    return sum(path.stat().st_size for path in root.rglob("*") if path.is_file())
+
+
+def _paginate_table(table: str, max_rows: int, page: Path, store: AssetStore) -> Optional[str]:
+    """Return ``table`` cut to its first ``max_rows`` rows, with links to the rest.
+
+    The remaining rows are written to standalone pages of ``max_rows`` rows
+    each; ``None`` if the table is short enough.
+    """
+    head, separator, body = table.partition("<tbody>")
+    if not separator:
+        return None
+    rows = _ROW.findall(body)
+    if len(rows) <= max_rows:
+        return None
+    pages = [rows[start:start + max_rows] for start in range(0, len(rows), max_rows)]
+    paths = []
+    for number, page_rows in enumerate(pages, start=1):
+        document = (
+            "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">"
+            f"<title>Rows {(number - 1) * max_rows + 1}-{(number - 1) * max_rows + len(page_rows)}</title>"
+            "<style>table{border-collapse:collapse}td,th{padding:0 .5em;text-align:right}</style>"
+            f"</head><body>{head}<tbody>{''.join(page_rows)}</tbody></table></body></html>\n"
+        )
+        # the first page stays inline; stored anyway so the pager can link back
+        paths.append(store.put(document.encode(), ".html"))
+    links = " ".join(
+        f'<a href="{html.escape(_relative(path, page.parent))}">{number}</a>'
+        for number, path in enumerate(paths, start=1)
+    )
+    pager = f'<p class="table-pages">Rows 1-{max_rows} of {len(rows)}. Pages: {links}</p>'
+    return f"{head}<tbody>{''.join(pages[0])}</tbody></table>\n{pager}"
+
+
+def compact_html(html_dir: Union[str, Path], max_rows: int = 50) -> HtmlReport:
+    """Shrink a built Jupyter Book in ``html_dir`` in place; see the module docstring."""
+    html_dir = Path(html_dir)
+    images_dir = html_dir / "_images"
+    store = AssetStore(images_dir)
+    assets = AssetStore(html_dir / ASSETS_DIR)
+    report = HtmlReport(bytes_before=_tree_size(html_dir), bytes_after=0)
+    pages = sorted(path for path in html_dir.rglob("*.html") if ASSETS_DIR not in path.parts)
+
+    # identical images under different names, e.g. a plot repeated on two pages
+    canonical: Dict[str, str] = {}
+    renamed: Dict[str, str] = {}
+    if images_dir.is_dir():
+        for image in sorted(images_dir.iterdir()):
+            if not image.is_file():
+                continue
+            digest = hashlib.sha256(image.read_bytes()).hexdigest()
+            if digest in canonical:
+                renamed[image.name] = canonical[digest]
+                image.unlink()
+                report.duplicate_images += 1
+            else:
+                canonical[digest] = image.name
+
+    for page in pages:
+        text = page.read_text(encoding="utf-8")
+        original = text
+
+        def inline_image(match):
+            data = _asset_bytes(match.group(1), base64.b64decode(match.group(2)))
+            report.inlined_images += 1
+            return _relative(store.put(data, _SUFFIXES[match.group(1)]), page.parent)
+
+        text = _DATA_URI.sub(inline_image, text)
+
+        def embedded(match):
+            report.embedded_documents += 1
+            path = assets.put(match.group(2).encode("utf-8"), ".html")
+            return (
+                f'{match.group(1)}\n<iframe src="{html.escape(_relative(path, page.parent))}" '
+                'loading="lazy" style="width:100%;height:600px;border:none"></iframe>'
+            )
+
+        text = _EMBEDDED_DOCUMENT.sub(embedded, text)
+
+        def table(match):
+            paginated = _paginate_table(match.group(0), max_rows, page, assets)
+            if paginated is None:
+                return match.group(0)
+            report.paginated_tables += 1
+            return paginated
+
+        text = _DATAFRAME.sub(table, text)
+        for old, new in renamed.items():
+            text = text.replace(f"_images/{old}", f"_images/{new}")
+        if text != original:
+            page.write_text(text, encoding="utf-8")
+
+    if images_dir.is_dir():
+        for image in images_dir.glob("*.png"):
+            data = image.read_bytes()
+            smaller = recompress_png(data)
+            if len(smaller) < len(data):
+                image.write_bytes(smaller)
+                report.recompressed_bytes_saved += len(data) - len(smaller)
+
+    report.bytes_after = _tree_size(html_dir)
+    return report
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m mb100t01.book.compact",
+        description="Move images into a content-addressed store and shrink the built HTML.",
+    )
+    parser.add_argument("book_dir", help="directory with _toc.yml")
+    parser.add_argument("--notebooks", action="store_true",
+                        help="compact the toc notebooks instead of _build/html; this overwrites "
+                             "the source notebooks, replacing embedded images with links into the "
+                             "asset store, without a backup")
+    parser.add_argument("--assets", help="asset store for --notebooks (default: <book_dir>/_assets)")
+    parser.add_argument("--max-rows", type=int, default=50, help="table rows per page in the HTML")
+    args = parser.parse_args(argv)
+
+    if args.notebooks:
+        for notebook, moved in compact_notebooks(args.book_dir, assets=args.assets).items():
+            if moved:
+                print(f"{moved:4d} images  {notebook}")
+        return 0
+
+    html_dir = Path(args.book_dir) / "_build" / "html"
+    if not html_dir.is_dir():
+        parser.error(f"{html_dir} does not exist; run jupyter-book build first")
+    report = compact_html(html_dir, max_rows=args.max_rows)
+    print(f"{report.bytes_before / 1e6:.1f} MB -> {report.bytes_after / 1e6:.1f} MB")
+    print(f"  {report.inlined_images} inline images moved to files, "
+          f"{report.duplicate_images} duplicate images merged, "
+          f"{report.recompressed_bytes_saved / 1e3:.0f} kB saved by PNG recompression")
+    print(f"  {report.embedded_documents} embedded documents moved to iframes, "
+          f"{report.paginated_tables} tables paginated")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,336 @@
+"""Dependency graph between the book's notebooks and the files they use.
+
+Several notebooks read ``../../data/*.csv`` and the BBBC007 images,
+``01_Pandas_Intro`` writes ``cities_out.csv`` and the plotting notebooks
+save PNG and SVG figures. :class:`DependencyGraph` records for every
+notebook which files it reads and writes, combining a static scan of its
+code with what the last execution actually opened (see
+:mod:`mb100t01.book.tracking`). A notebook that reads a file another
+notebook writes depends on that notebook.
+
+Given changed files, :func:`rebuild` re-executes only the affected
+notebooks, each as soon as the notebooks it depends on are done, and
+lists the pages that need re-rendering::
+
+    python -m mb100t01.book.depgraph advanced_image_analysis_mb100t01 data/Results.csv
+"""
+
+from __future__ import annotations
+
+import argparse
+import ast
+import os
+import subprocess
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Union
+
+import nbformat
+
+from .execute import (
+    ExecutionResult,
+    _run_notebook,
+    _store_success,
+    environment_fingerprint,
+    io_record_file,
+    notebook_key,
+)
+from .sources import code_sources, referenced_paths, toc_files
+from .tracking import NotebookIO, load_record
+
+# methods and functions whose first argument (or one of these keywords) is
+# a path that gets written
+_WRITE_CALLS = {
+    "to_csv", "to_excel", "to_parquet", "to_feather", "to_json", "to_pickle",
+    "to_hdf", "to_html", "savefig", "imsave", "imwrite", "pivot_ui", "save",
+}
+_PATH_KEYWORDS = {"path", "path_or_buf", "fname", "filename", "outfile_path", "excel_writer"}
+
+
+def _written_literals(source: str) -> Iterable[str]:
+    lines = ["" if line.lstrip().startswith(("%", "!")) else line for line in source.splitlines()]
+    try:
+        tree = ast.parse("\n".join(lines))
+    except SyntaxError:
+        return
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        func = node.func
+        name = func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", None)
+        if name == "open" and len(node.args) >= 2:
+            mode = node.args[1]
+            if isinstance(mode, ast.Constant) and any(char in str(mode.value) for char in "wax+"):
+                if isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str):
+                    yield node.args[0].value
+            continue
+        if name not in _WRITE_CALLS:
+            continue
+        candidates = [node.args[0]] if node.args and name != "pivot_ui" else []
+        candidates += [kw.value for kw in node.keywords if kw.arg in _PATH_KEYWORDS]
+        for candidate in candidates:
+            if isinstance(candidate, ast.Constant) and isinstance(candidate.value, str):
+                yield candidate.value
+
+
+def static_io(notebook: Union[str, Path], repo_root: Union[str, Path]) -> NotebookIO:
+    """Scan the code cells of ``notebook`` for files it reads and writes.
+
+    Paths passed to writers such as ``DataFrame.to_csv``, ``savefig`` or
+    ``pivot_ui(outfile_path=...)`` count as writes whether or not the file
+    exists yet; every other existing file referred to counts as a read.
+    """
+    notebook = Path(notebook).resolve()
+    content = nbformat.read(str(notebook), as_version=4)
+    writes = set()
+    for source in code_sources(content):
+        for literal in _written_literals(source):
+            writes.add((notebook.parent / literal).resolve())
+    reads = referenced_paths(notebook, repo_root) - writes
+    return NotebookIO(reads=reads, writes=writes)
+
+
+@dataclass
+class DependencyGraph:
+    """Notebooks, the files they read and write, and the edges between them.
+
+    Attributes
+    ----------
+    notebooks : list of pathlib.Path
+        Resolved notebook paths in table of contents order.
+    io : dict
+        :class:`~mb100t01.book.tracking.NotebookIO` per notebook.
+    upstream : dict
+        For every notebook, the notebooks that write a file it reads.
+    """
+
+    notebooks: List[Path]
+    io: Dict[Path, NotebookIO]
+    upstream: Dict[Path, Set[Path]] = field(default_factory=dict)
+
+    @classmethod
+    def from_book(
+        cls, book_dir: Union[str, Path], repo_root: Optional[Union[str, Path]] = None
+    ) -> "DependencyGraph":
+        """Build the graph from static scans and the last execution records."""
+        book_dir = Path(book_dir)
+        repo_root = Path(repo_root) if repo_root is not None else book_dir.resolve().parent
+        notebooks = [path.resolve() for path in toc_files(book_dir) if path.suffix == ".ipynb"]
+        io = {}
+        for notebook in notebooks:
+            found = static_io(notebook, repo_root)
+            record = io_record_file(book_dir, notebook)
+            if record.is_file():
+                found = found | load_record(record, repo_root)
+            io[notebook] = found
+        graph = cls(notebooks=notebooks, io=io)
+        graph._link()
+        return graph
+
+    def _link(self) -> None:
+        writers: Dict[Path, Set[Path]] = {}
+        for notebook, found in self.io.items():
+            for path in found.writes:
+                writers.setdefault(path, set()).add(notebook)
+        self.upstream = {
+            notebook: {
+                writer
+                for path in self.io[notebook].reads
+                for writer in writers.get(path, ())
+                if writer != notebook
+            }
+            for notebook in self.notebooks
+        }
+
+    def downstream(self) -> Dict[Path, Set[Path]]:
+        """Invert :attr:`upstream`."""
+        result: Dict[Path, Set[Path]] = {notebook: set() for notebook in self.notebooks}
+        for notebook, parents in self.upstream.items():
+            for parent in parents:
+                result[parent].add(notebook)
+        return result
+
+    def affected(self, changed: Iterable[Union[str, Path]]) -> Set[Path]:
+        """Return the notebooks to re-execute when the ``changed`` files changed.
+
+        These are changed notebooks themselves, notebooks reading a changed
+        file, and, transitively, notebooks reading what those write.
+        """
+        changed = {Path(path).resolve() for path in changed}
+        dirty = {
+            notebook
+            for notebook in self.notebooks
+            if notebook in changed or self.io[notebook].reads & changed
+        }
+        downstream = self.downstream()
+        stack = list(dirty)
+        while stack:
+            for child in downstream[stack.pop()]:
+                if child not in dirty:
+                    dirty.add(child)
+                    stack.append(child)
+        return dirty
+
+    def topological_order(self, subset: Optional[Iterable[Path]] = None) -> List[Path]:
+        """Order notebooks so writers come before readers, ties in toc order.
+
+        Raises
+        ------
+        ValueError
+            If notebooks depend on each other in a cycle.
+        """
+        subset = set(self.notebooks if subset is None else subset)
+        remaining = {notebook: self.upstream[notebook] & subset for notebook in subset}
+        order = []
+        while remaining:
+            ready = [notebook for notebook in self.notebooks
+                     if notebook in remaining and not remaining[notebook]]
+            if not ready:
+                names = ", ".join(sorted(notebook.name for notebook in remaining))
+                raise ValueError(f"Notebooks depend on each other in a cycle: {names}")
+            for notebook in ready:
+                order.append(notebook)
+                del remaining[notebook]
+            for parents in remaining.values():
+                parents.difference_update(ready)
+        return order
+
+    def pages(self, book_dir: Union[str, Path], notebooks: Iterable[Path]) -> List[Path]:
+        """Return the book pages to re-render after ``notebooks`` were re-executed.
+
+        Besides the notebooks themselves, markdown pages referring to a
+        file one of them writes, such as a saved figure, are included.
+        """
+        notebooks = {Path(path).resolve() for path in notebooks}
+        written = set()
+        for notebook in notebooks:
+            written |= self.io[notebook].writes
+        pages = []
+        for page in toc_files(book_dir):
+            page = page.resolve()
+            if page in notebooks:
+                pages.append(page)
+            elif page.suffix == ".md" and written:
+                text = page.read_text(errors="ignore")
+                if any(os.path.relpath(path, page.parent) in text for path in written):
+                    pages.append(page)
+        return pages
+
+
+def rebuild(
+    book_dir: Union[str, Path],
+    changed: Sequence[Union[str, Path]],
+    repo_root: Optional[Union[str, Path]] = None,
+    workers: Optional[int] = None,
+    timeout: int = 600,
+    kernel_name: Optional[str] = None,
+) -> List[ExecutionResult]:
+    """Re-execute the notebooks affected by ``changed`` files.
+
+    A notebook is submitted to the process pool as soon as every affected
+    notebook it depends on has finished; notebooks downstream of a failure
+    are reported as failed without running. Cache keys and I/O records are
+    updated as in :func:`mb100t01.book.execute.execute_book`.
+
+    Returns
+    -------
+    list of ExecutionResult
+        In topological order.
+    """
+    book_dir = Path(book_dir)
+    repo_root = Path(repo_root) if repo_root is not None else book_dir.resolve().parent
+    graph = DependencyGraph.from_book(book_dir, repo_root)
+    order = graph.topological_order(graph.affected(changed))
+    if not order:
+        return []
+    fingerprint = environment_fingerprint()
+    waiting = {notebook: graph.upstream[notebook] & set(order) for notebook in order}
+    downstream = graph.downstream()
+    results: Dict[Path, ExecutionResult] = {}
+    workers = workers or min(len(order), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = {}
+
+        def submit_ready():
+            for notebook in order:
+                if notebook in waiting and not waiting[notebook]:
+                    del waiting[notebook]
+                    future = pool.submit(
+                        _run_notebook, str(notebook), str(notebook), timeout, kernel_name,
+                        str(repo_root), str(io_record_file(book_dir, notebook)),
+                    )
+                    running[future] = notebook
+
+        submit_ready()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                notebook = running.pop(future)
+                try:
+                    seconds = future.result()
+                except Exception as error:
+                    results[notebook] = ExecutionResult(notebook, "failed", error=str(error))
+                    # everything downstream would run on stale or missing inputs
+                    stack = [notebook]
+                    while stack:
+                        for child in downstream[stack.pop()]:
+                            if child in waiting:
+                                del waiting[child]
+                                results[child] = ExecutionResult(
+                                    child, "failed", error=f"upstream {notebook.name} failed"
+                                )
+                                stack.append(child)
+                    continue
+                results[notebook] = ExecutionResult(notebook, "executed", seconds)
+                key = notebook_key(notebook, repo_root, fingerprint, book_dir)
+                _store_success(book_dir, notebook, key, seconds)
+                for parents in waiting.values():
+                    parents.discard(notebook)
+            submit_ready()
+    return [results[notebook] for notebook in order]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m mb100t01.book.depgraph",
+        description="Re-execute and re-render only the notebooks affected by changed files.",
+    )
+    parser.add_argument("book_dir", help="directory with _toc.yml")
+    parser.add_argument("changed", nargs="*", help="changed files (notebooks or data)")
+    parser.add_argument("--repo-root", help="directory containing data/ (default: parent of book_dir)")
+    parser.add_argument("-j", "--workers", type=int, help="number of worker processes")
+    parser.add_argument("--timeout", type=int, default=600, help="per-cell timeout in seconds")
+    parser.add_argument("--kernel", help="kernel name overriding the notebook metadata")
+    parser.add_argument("--dry-run", action="store_true", help="only print what would run")
+    parser.add_argument("--build", action="store_true",
+                        help="run jupyter-book build afterwards; Sphinx re-renders changed pages only")
+    args = parser.parse_args(argv)
+
+    graph = DependencyGraph.from_book(args.book_dir, args.repo_root)
+    affected = graph.topological_order(graph.affected(args.changed))
+    if args.dry_run:
+        for notebook in affected:
+            parents = ", ".join(sorted(parent.name for parent in graph.upstream[notebook]))
+            print(f"{notebook}" + (f"  (after {parents})" if parents else ""))
+        for page in graph.pages(args.book_dir, affected):
+            print(f"render {page}")
+        return 0
+
+    results = rebuild(
+        args.book_dir, args.changed, repo_root=args.repo_root, workers=args.workers,
+        timeout=args.timeout, kernel_name=args.kernel,
+    )
+    for result in results:
+        print(f"{result.status:>8}  {result.seconds:7.1f}s  {result.notebook}")
+        if result.error:
+            print(f"          {result.error.strip().splitlines()[-1]}")
+    failed = any(result.status == "failed" for result in results)
+    if args.build and not failed:
+        return subprocess.call(["jupyter-book", "build", str(args.book_dir)])
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
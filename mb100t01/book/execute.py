@@ -0,0 +1,283 @@
+"""Parallel, cached execution of the book's notebooks.
+
+``_config.yml`` sets ``execute_notebooks: off``, so the book is built from
+the outputs stored in the notebooks and those go stale. Running this module
+before ``jupyter-book build`` re-executes, in a process pool, only the
+notebooks whose inputs changed since their last successful run, and writes
+the fresh outputs back into the notebooks::
+
+    python -m mb100t01.book.execute advanced_image_analysis_mb100t01
+
+A notebook's cache key combines
+
+* the source of its code cells and its kernel name (outputs and markdown
+  do not matter),
+* the content hashes of the files under ``data/`` it refers to or was
+  seen reading during its last run, and
+* an environment fingerprint: the Python version and the versions of all
+  installed distributions.
+
+Keys of successful runs are stored in ``_build/.execute_cache`` of the book.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+import nbformat
+
+from .sources import code_sources, file_digest, referenced_paths, toc_notebooks
+from .tracking import add_tracking, load_record, remove_hidden_cells
+
+CACHE_DIR = Path("_build") / ".execute_cache"
+
+
+@dataclass
+class ExecutionResult:
+    """Outcome of one notebook in :func:`execute_book`.
+
+    ``status`` is ``"cached"``, ``"executed"`` or ``"failed"``.
+    """
+
+    notebook: Path
+    status: str
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+def environment_fingerprint() -> str:
+    """Hash the Python version and the versions of all installed distributions."""
+    from importlib import metadata
+
+    packages = sorted(
+        f"{dist.metadata['Name']}=={dist.version}".lower()
+        for dist in metadata.distributions()
+        if dist.metadata["Name"]
+    )
+    digest = hashlib.sha256(platform.python_version().encode())
+    digest.update("\n".join(packages).encode())
+    return digest.hexdigest()
+
+
+def data_inputs(notebook: Path, repo_root: Path, book_dir: Optional[Path] = None) -> List[Path]:
+    """Return the files under ``repo_root/data`` that ``notebook`` refers to.
+
+    With ``book_dir`` given, files recorded as read during the last
+    execution (see :mod:`mb100t01.book.tracking`) are included as well.
+    """
+    data_dir = (repo_root / "data").resolve()
+    paths = referenced_paths(notebook, repo_root)
+    if book_dir is not None:
+        record = io_record_file(book_dir, notebook)
+        if record.is_file():
+            paths |= load_record(record, repo_root).reads
+    return sorted(path for path in paths if data_dir in path.parents and path.is_file())
+
+
+def notebook_key(
+    notebook: Path, repo_root: Path, fingerprint: str, book_dir: Optional[Path] = None
+) -> str:
+    """Return the cache key of ``notebook``; see the module docstring."""
+    content = nbformat.read(str(notebook), as_version=4)
+    digest = hashlib.sha256()
+    digest.update(content.metadata.get("kernelspec", {}).get("name", "python3").encode())
+    for source in code_sources(content):
+        digest.update(source.encode())
+        digest.update(b"\0")
+    for path in data_inputs(notebook, repo_root, book_dir):
+        digest.update(str(path.relative_to(repo_root.resolve())).encode())
+        digest.update(file_digest(path).encode())
+    digest.update(fingerprint.encode())
+    return digest.hexdigest()
+
+
+def _cache_file(book_dir: Path, notebook: Path) -> Path:
+    relative = notebook.resolve().relative_to(book_dir.resolve())
+    return book_dir / CACHE_DIR / relative.with_suffix(".json")
+
+
+def io_record_file(book_dir: Path, notebook: Path) -> Path:
+    """Return where the files read and written by ``notebook`` are recorded."""
+    return _cache_file(book_dir, notebook).with_suffix(".io.json")
+
+
+def _store_success(book_dir: Path, notebook: Path, key: str, seconds: float) -> None:
+    cache_file = _cache_file(book_dir, notebook)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    cache_file.write_text(json.dumps({"key": key, "seconds": seconds}))
+
+
+def _run_notebook(
+    notebook: str,
+    output: str,
+    timeout: int,
+    kernel_name: Optional[str],
+    repo_root: str,
+    record: str,
+) -> float:
+    """Execute one notebook in its own directory; runs in a worker process.
+
+    The files the notebook opens are recorded to ``record``.
+    """
+    from nbclient import NotebookClient
+
+    start = time.perf_counter()
+    content = nbformat.read(notebook, as_version=4)
+    Path(record).parent.mkdir(parents=True, exist_ok=True)
+    add_tracking(content, repo_root, record)
+    client = NotebookClient(
+        content,
+        timeout=timeout,
+        kernel_name=kernel_name or content.metadata.get("kernelspec", {}).get("name", "python3"),
+        resources={"metadata": {"path": str(Path(notebook).parent)}},
+    )
+    try:
+        client.execute()
+    finally:
+        remove_hidden_cells(content)
+    nbformat.write(content, output)
+    return time.perf_counter() - start
+
+
+def execute_book(
+    book_dir: Union[str, Path],
+    repo_root: Optional[Union[str, Path]] = None,
+    notebooks: Optional[Sequence[Union[str, Path]]] = None,
+    workers: Optional[int] = None,
+    timeout: int = 600,
+    kernel_name: Optional[str] = None,
+    output_dir: Optional[Union[str, Path]] = None,
+    force: bool = False,
+) -> List[ExecutionResult]:
+    """Execute the book's notebooks whose inputs changed, in parallel.
+
+    Parameters
+    ----------
+    book_dir : str or pathlib.Path
+        Directory with ``_toc.yml``.
+    repo_root : str or pathlib.Path, optional
+        Directory containing ``data/``. Defaults to the parent of
+        ``book_dir``.
+    notebooks : sequence of paths, optional
+        Notebooks to consider. Defaults to all notebooks in ``_toc.yml``.
+    workers : int, optional
+        Size of the process pool. Defaults to one worker per notebook to
+        run, capped at the number of CPUs, so a cold build takes about as
+        long as the slowest notebook.
+    timeout : int
+        Per-cell timeout in seconds.
+    kernel_name : str, optional
+        Kernel to use instead of the one in each notebook's metadata.
+    output_dir : str or pathlib.Path, optional
+        Write executed notebooks here, mirroring the book layout, instead
+        of overwriting the sources.
+    force : bool
+        Ignore the cache and execute everything.
+
+    Returns
+    -------
+    list of ExecutionResult
+        One entry per notebook, in table of contents order.
+    """
+    book_dir = Path(book_dir)
+    repo_root = Path(repo_root) if repo_root is not None else book_dir.resolve().parent
+    if notebooks is None:
+        notebooks = toc_notebooks(book_dir)
+    notebooks = [Path(path) for path in notebooks]
+    fingerprint = environment_fingerprint()
+
+    results: Dict[Path, ExecutionResult] = {}
+    keys: Dict[Path, str] = {}
+    pending = []
+    for notebook in notebooks:
+        keys[notebook] = notebook_key(notebook, repo_root, fingerprint, book_dir)
+        cache_file = _cache_file(book_dir, notebook)
+        if not force and cache_file.is_file():
+            if json.loads(cache_file.read_text()).get("key") == keys[notebook]:
+                results[notebook] = ExecutionResult(notebook, "cached")
+                continue
+        pending.append(notebook)
+
+    def output_path(notebook: Path) -> Path:
+        if output_dir is None:
+            return notebook
+        target = Path(output_dir) / notebook.resolve().relative_to(book_dir.resolve())
+        target.parent.mkdir(parents=True, exist_ok=True)
+        return target
+
+    if pending:
+        workers = workers or min(len(pending), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(
+                    _run_notebook,
+                    str(notebook),
+                    str(output_path(notebook)),
+                    timeout,
+                    kernel_name,
+                    str(repo_root),
+                    str(io_record_file(book_dir, notebook)),
+                ): notebook
+                for notebook in pending
+            }
+            for future in as_completed(futures):
+                notebook = futures[future]
+                try:
+                    seconds = future.result()
+                except Exception as error:  # report every failing notebook, not just the first
+                    results[notebook] = ExecutionResult(notebook, "failed", error=str(error))
+                    continue
+                results[notebook] = ExecutionResult(notebook, "executed", seconds)
+                # the run may have recorded reads the static scan missed
+                key = notebook_key(notebook, repo_root, fingerprint, book_dir)
+                _store_success(book_dir, notebook, key, seconds)
+
+    return [results[notebook] for notebook in notebooks]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m mb100t01.book.execute",
+        description="Execute the book's notebooks whose inputs changed, in parallel.",
+    )
+    parser.add_argument("book_dir", help="directory with _toc.yml")
+    parser.add_argument("notebooks", nargs="*", help="notebooks to consider (default: all in the toc)")
+    parser.add_argument("--repo-root", help="directory containing data/ (default: parent of book_dir)")
+    parser.add_argument("-j", "--workers", type=int, help="number of worker processes")
+    parser.add_argument("--timeout", type=int, default=600, help="per-cell timeout in seconds")
+    parser.add_argument("--kernel", help="kernel name overriding the notebook metadata")
+    parser.add_argument("--output-dir", help="write executed notebooks here instead of in place")
+    parser.add_argument("--force", action="store_true", help="ignore the cache")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    results = execute_book(
+        args.book_dir,
+        repo_root=args.repo_root,
+        notebooks=args.notebooks or None,
+        workers=args.workers,
+        timeout=args.timeout,
+        kernel_name=args.kernel,
+        output_dir=args.output_dir,
+        force=args.force,
+    )
+    for result in results:
+        print(f"{result.status:>8}  {result.seconds:7.1f}s  {result.notebook}")
+        if result.error:
+            print(f"          {result.error.strip().splitlines()[-1]}")
+    print(f"total {time.perf_counter() - start:.1f}s")
+    return 1 if any(result.status == "failed" for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+"""Per-cell profiling of notebook runs.
+
+Nothing tells us which cells dominate a notebook's runtime: the remote
+``read_csv``, ``pairplot``, ``pairwise_tukeyhsd``, ``pivot_ui`` or
+``swarmplot``. This module executes notebooks with hidden IPython
+``pre_run_cell``/``post_run_cell`` hooks that measure, for every code
+cell,
+
+* wall time and CPU time of the kernel process,
+* growth of the kernel's peak resident set size, and
+* the net change in allocated memory blocks
+  (``sys.getallocatedblocks``), a cheap proxy for objects allocated and
+  kept alive, plus the number of garbage collections.
+
+The results go to a JSON report and to a Chrome trace file, which can be
+opened in ``chrome://tracing`` or https://ui.perfetto.dev. Given a
+baseline report, the run fails when a cell got slower than allowed::
+
+    python -m mb100t01.book.profiling advanced_image_analysis_mb100t01 \\
+        --report profile.json --trace profile.trace.json --baseline baseline.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+import nbformat
+
+from .execute import environment_fingerprint
+from .sources import toc_notebooks
+from .tracking import hidden_cell, remove_hidden_cells
+
+_PREAMBLE = """\
+import gc as _mb_gc, sys as _mb_sys, time as _mb_time
+try:
+    import resource as _mb_resource
+except ImportError:  # Windows
+    _mb_resource = None
+_mb_profile = {"cells": [], "current": None}
+def _mb_usage():
+    if _mb_resource is None:
+        return _mb_time.process_time(), 0
+    usage = _mb_resource.getrusage(_mb_resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = usage.ru_maxrss // 1024 if _mb_sys.platform == "darwin" else usage.ru_maxrss
+    return usage.ru_utime + usage.ru_stime, peak
+def _mb_collections():
+    return sum(stats["collections"] for stats in _mb_gc.get_stats())
+def _mb_pre_run_cell(*args):
+    cpu, peak = _mb_usage()
+    _mb_profile["current"] = {
+        "start": _mb_time.time(), "wall": _mb_time.perf_counter(), "cpu": cpu,
+        "peak_rss_kb": peak, "blocks": _mb_sys.getallocatedblocks(),
+        "collections": _mb_collections(),
+    }
+def _mb_post_run_cell(*args):
+    before = _mb_profile["current"]
+    if before is None:
+        return
+    cpu, peak = _mb_usage()
+    _mb_profile["cells"].append({
+        "start": before["start"],
+        "wall_seconds": _mb_time.perf_counter() - before["wall"],
+        "cpu_seconds": cpu - before["cpu"],
+        "peak_rss_delta_kb": peak - before["peak_rss_kb"],
+        "allocated_blocks": _mb_sys.getallocatedblocks() - before["blocks"],
+        "gc_collections": _mb_collections() - before["collections"],
+    })
+    _mb_profile["current"] = None
+get_ipython().events.register("pre_run_cell", _mb_pre_run_cell)
+get_ipython().events.register("post_run_cell", _mb_post_run_cell)
+"""
+
+_EPILOGUE = """\
+get_ipython().events.unregister("post_run_cell", _mb_post_run_cell)
+import json as _mb_json
+with open({record!r}, "w") as _mb_file:
+    _mb_json.dump(_mb_profile["cells"], _mb_file)
+"""
+
+
+def _source_hash(source: str) -> str:
+    return hashlib.sha256(source.encode()).hexdigest()[:16]
+
+
+def profile_notebook(
+    notebook: Union[str, Path], timeout: int = 600, kernel_name: Optional[str] = None
+) -> dict:
+    """Execute ``notebook`` and return its per-cell measurements.
+
+    The notebook file is not modified. Cells are identified by their index
+    among the code cells and a hash of their source, so a baseline is only
+    compared against cells whose code did not change. Empty code cells are
+    not executed and have no measurements.
+    """
+    from nbclient import NotebookClient
+
+    notebook = Path(notebook)
+    content = nbformat.read(str(notebook), as_version=4)
+    # nbclient does not run empty cells, so they fire no hooks and get no
+    # measurement; the index stays the position among all code cells
+    code_cells = [
+        (index, cell)
+        for index, cell in enumerate(cell for cell in content.cells if cell.cell_type == "code")
+        if cell.source.strip()
+    ]
+    with tempfile.TemporaryDirectory() as scratch:
+        record = Path(scratch) / "cells.json"
+        content.cells.insert(0, hidden_cell(_PREAMBLE))
+        content.cells.append(hidden_cell(_EPILOGUE.format(record=str(record))))
+        client = NotebookClient(
+            content,
+            timeout=timeout,
+            kernel_name=kernel_name or content.metadata.get("kernelspec", {}).get("name", "python3"),
+            resources={"metadata": {"path": str(notebook.parent)}},
+        )
+        start = time.perf_counter()
+        client.execute()
+        total = time.perf_counter() - start
+        measured = json.loads(record.read_text())
+    remove_hidden_cells(content)
+
+    # the epilogue's own pre_run_cell never gets a matching post_run_cell,
+    # so the measurements line up with the non-empty code cells
+    cells = []
+    for (index, cell), values in zip(code_cells, measured):
+        first_line = next((line for line in cell.source.splitlines() if line.strip()), "")
+        cells.append({
+            "index": index,
+            "source_hash": _source_hash(cell.source),
+            "label": first_line[:80],
+            **values,
+        })
+    return {"total_seconds": total, "cells": cells}
+
+
+def profile_book(
+    book_dir: Union[str, Path],
+    notebooks: Optional[Sequence[Union[str, Path]]] = None,
+    workers: Optional[int] = None,
+    timeout: int = 600,
+    kernel_name: Optional[str] = None,
+) -> dict:
+    """Profile notebooks of the book in a process pool and return the report.
+
+    Notebooks default to those in ``_toc.yml``. A notebook that fails is
+    reported with its error instead of cell measurements.
+    """
+    book_dir = Path(book_dir)
+    if notebooks is None:
+        notebooks = toc_notebooks(book_dir)
+    notebooks = [Path(path) for path in notebooks]
+    report: dict = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment_fingerprint(),
+        "notebooks": {},
+    }
+    workers = workers or min(len(notebooks), os.cpu_count() or 1) or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(profile_notebook, str(notebook), timeout, kernel_name): notebook
+            for notebook in notebooks
+        }
+        for future in as_completed(futures):
+            name = futures[future].resolve().relative_to(book_dir.resolve()).as_posix()
+            try:
+                report["notebooks"][name] = future.result()
+            except Exception as error:
+                report["notebooks"][name] = {"error": str(error), "cells": []}
+    report["notebooks"] = dict(sorted(report["notebooks"].items()))
+    return report
+
+
+def write_trace(report: dict, path: Union[str, Path]) -> None:
+    """Write ``report`` as a Chrome trace / Perfetto timeline.
+
+    Every notebook is a process row and every cell a complete (``"X"``)
+    event with the measurements as arguments.
+    """
+    starts = [cell["start"] for entry in report["notebooks"].values() for cell in entry["cells"]]
+    origin = min(starts, default=0.0)
+    events = []
+    for pid, (name, entry) in enumerate(report["notebooks"].items(), start=1):
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "tid": 0,
+                       "args": {"name": name}})
+        for cell in entry["cells"]:
+            events.append({
+                "name": f"[{cell['index']}] {cell['label']}",
+                "cat": "cell",
+                "ph": "X",
+                "pid": pid,
+                "tid": 0,
+                "ts": (cell["start"] - origin) * 1e6,
+                "dur": cell["wall_seconds"] * 1e6,
+                "args": {key: cell[key] for key in (
+                    "cpu_seconds", "peak_rss_delta_kb", "allocated_blocks", "gc_collections"
+                )},
+            })
+    Path(path).write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+
+
+@dataclass
+class Regression:
+    """A cell that got slower than the baseline allows."""
+
+    notebook: str
+    index: int
+    label: str
+    baseline_seconds: float
+    seconds: float
+
+    def __str__(self) -> str:
+        return (
+            f"{self.notebook} cell {self.index} ({self.label!r}): "
+            f"{self.baseline_seconds:.2f}s -> {self.seconds:.2f}s"
+        )
+
+
+def find_regressions(
+    report: dict, baseline: dict, ratio: float = 1.5, min_seconds: float = 0.5
+) -> List[Regression]:
+    """Return cells whose wall time exceeds ``ratio`` times the baseline.
+
+    Differences below ``min_seconds`` are ignored as noise. Cells whose
+    source changed since the baseline are not compared.
+    """
+    regressions = []
+    for name, entry in report["notebooks"].items():
+        before: Dict[tuple, dict] = {
+            (cell["index"], cell["source_hash"]): cell
+            for cell in baseline.get("notebooks", {}).get(name, {}).get("cells", [])
+        }
+        for cell in entry["cells"]:
+            old = before.get((cell["index"], cell["source_hash"]))
+            if old is None:
+                continue
+            seconds, old_seconds = cell["wall_seconds"], old["wall_seconds"]
+            if seconds > ratio * old_seconds and seconds - old_seconds > min_seconds:
+                regressions.append(
+                    Regression(name, cell["index"], cell["label"], old_seconds, seconds)
+                )
+    return regressions
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m mb100t01.book.profiling",
+        description="Profile the book's notebooks cell by cell.",
+    )
+    parser.add_argument("book_dir", help="directory with _toc.yml")
+    parser.add_argument("notebooks", nargs="*", help="notebooks to profile (default: all in the toc)")
+    parser.add_argument("--report", default="profile.json", help="JSON report to write")
+    parser.add_argument("--trace", help="Chrome trace / Perfetto file to write")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--ratio", type=float, default=1.5,
+                        help="fail when a cell takes more than this times its baseline")
+    parser.add_argument("--min-seconds", type=float, default=0.5,
+                        help="ignore slowdowns smaller than this")
+    parser.add_argument("-j", "--workers", type=int, help="number of worker processes")
+    parser.add_argument("--timeout", type=int, default=600, help="per-cell timeout in seconds")
+    parser.add_argument("--kernel", help="kernel name overriding the notebook metadata")
+    args = parser.parse_args(argv)
+
+    report = profile_book(args.book_dir, args.notebooks or None, workers=args.workers,
+                          timeout=args.timeout, kernel_name=args.kernel)
+    Path(args.report).write_text(json.dumps(report, indent=1))
+    if args.trace:
+        write_trace(report, args.trace)
+
+    status = 0
+    for name, entry in report["notebooks"].items():
+        if "error" in entry:
+            print(f"failed  {name}: {entry['error'].strip().splitlines()[-1]}")
+            status = 1
+            continue
+        slowest = sorted(entry["cells"], key=lambda cell: cell["wall_seconds"], reverse=True)[:3]
+        summary = ", ".join(f"[{cell['index']}] {cell['wall_seconds']:.2f}s" for cell in slowest)
+        print(f"{entry['total_seconds']:7.1f}s  {name}  slowest: {summary}")
+    if args.baseline:
+        regressions = find_regressions(
+            report, json.loads(Path(args.baseline).read_text()), args.ratio, args.min_seconds
+        )
+        for regression in regressions:
+            print(f"regression  {regression}")
+        if regressions:
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Finding the notebooks of the book and the data files they read."""
+
+from __future__ import annotations
+
+import ast
+import glob
+import hashlib
+import re
+from pathlib import Path
+from typing import Iterable, List, Set, Union
+
+import nbformat
+import yaml
+
+# raw GitHub URLs of this repository's data folder, as used by the Colab
+# friendly cells, e.g. https://github.com/vmcf-konfmi/MB100T01/raw/main/data/Results.csv
+_REPO_DATA_URL = re.compile(
+    r"https?://(?:github\.com/vmcf-konfmi/MB100T01/raw|"
+    r"raw\.githubusercontent\.com/vmcf-konfmi/MB100T01)/[^/]+/(data/.+)$"
+)
+
+
+def toc_files(book_dir: Union[str, Path]) -> List[Path]:
+    """Return the source files listed in ``_toc.yml``, in reading order."""
+    book_dir = Path(book_dir)
+    toc = yaml.safe_load((book_dir / "_toc.yml").read_text())
+
+    entries = []
+
+    def visit(node):
+        if isinstance(node, dict):
+            for key in ("root", "file"):
+                if key in node:
+                    entries.append(node[key])
+            for value in node.values():
+                if isinstance(value, (list, dict)):
+                    visit(value)
+        elif isinstance(node, list):
+            for item in node:
+                visit(item)
+
+    visit(toc)
+    files = []
+    for entry in entries:
+        # entries may be given with or without their suffix
+        for suffix in ("", ".ipynb", ".md"):
+            path = book_dir / f"{entry}{suffix}"
+            if path.is_file():
+                files.append(path)
+                break
+    return files
+
+
+def toc_notebooks(book_dir: Union[str, Path]) -> List[Path]:
+    """Return the notebooks listed in ``_toc.yml``, in reading order."""
+    return [path for path in toc_files(book_dir) if path.suffix == ".ipynb"]
+
+
+def code_sources(notebook: nbformat.NotebookNode) -> List[str]:
+    """Return the source of every code cell of ``notebook``."""
+    return [cell.source for cell in notebook.cells if cell.cell_type == "code"]
+
+
+def _string_literals(source: str) -> Iterable[str]:
+    """Yield string constants of a code cell, plus the arguments of shell escapes."""
+    lines = []
+    for line in source.splitlines():
+        if line.lstrip().startswith("!"):
+            # e.g. !wget https://github.com/vmcf-konfmi/MB100T01/raw/main/data/...
+            yield from line.lstrip()[1:].split()[1:]
+            lines.append("")
+        elif line.lstrip().startswith("%"):
+            lines.append("")
+        else:
+            lines.append(line)
+    cleaned = "\n".join(lines)
+    try:
+        tree = ast.parse(cleaned)
+    except SyntaxError:
+        yield from re.findall(r"""['"]([^'"\n]+)['"]""", cleaned)
+        return
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            yield node.value
+
+
+def referenced_paths(notebook_path: Union[str, Path], repo_root: Union[str, Path]) -> Set[Path]:
+    """Return existing files under ``repo_root`` that string literals in code cells refer to.
+
+    Relative paths are resolved against the notebook's directory, which is
+    the working directory during execution. Glob patterns such as
+    ``"../../data/BBBC007_batch/*.tif"`` are expanded, and raw GitHub URLs
+    of this repository are mapped to the local copy of the file.
+    """
+    notebook_path = Path(notebook_path).resolve()
+    repo_root = Path(repo_root).resolve()
+    notebook = nbformat.read(str(notebook_path), as_version=4)
+    found = set()
+    for source in code_sources(notebook):
+        for literal in _string_literals(source):
+            url = _REPO_DATA_URL.match(literal)
+            if url:
+                candidates = [repo_root / url.group(1)]
+            elif "\n" in literal or len(literal) > 300 or "://" in literal:
+                continue
+            elif any(char in literal for char in "*?[") and ("/" in literal or "." in literal):
+                # a bare "*" is more likely a marker style than a pattern
+                candidates = [Path(match) for match in glob.glob(str(notebook_path.parent / literal))]
+            else:
+                candidates = [notebook_path.parent / literal]
+            for candidate in candidates:
+                try:
+                    candidate = candidate.resolve()
+                    if candidate.is_file() and repo_root in candidate.parents:
+                        found.add(candidate)
+                except OSError:
+                    continue
+    found.discard(notebook_path)
+    return found
+
+
+def file_digest(path: Union[str, Path], chunk_size: int = 1 << 20) -> str:
+    """Return the SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
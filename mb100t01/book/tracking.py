@@ -0,0 +1,123 @@
+"""Recording which files a notebook reads and writes while it executes.
+
+Static scanning (:func:`mb100t01.book.sources.referenced_paths`) misses
+paths built at runtime, such as ``f"../../data/{name}.csv"``. During
+execution we therefore add a hidden first cell that installs a
+``sys.addaudithook`` hook. It sees every ``open`` and ``urllib`` request
+the kernel makes, including those from pandas, matplotlib and skimage.
+A hidden last cell writes the paths under the repository to a JSON
+record. Both cells are removed again before the executed notebook is
+saved.
+"""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Set, Union
+
+import nbformat
+
+from .sources import _REPO_DATA_URL
+
+_TAG = "mb100t01-io-tracking"
+
+_PREAMBLE = """\
+import os as _mb_os, sys as _mb_sys
+_mb_io = {{"root": {root!r}, "reads": set(), "writes": set(), "urls": set(), "active": True}}
+# bound as defaults: audit hooks cannot be removed and still run while
+# module globals are cleared at kernel shutdown
+def _mb_audit(event, args, _mb_io=_mb_io, _mb_os=_mb_os):
+    if not _mb_io["active"]:
+        return
+    if event == "open" and isinstance(args[0], (str, bytes, _mb_os.PathLike)):
+        path = _mb_os.path.abspath(_mb_os.fsdecode(args[0]))
+        if not path.startswith(_mb_io["root"]):
+            return
+        mode, flags = args[1], args[2] or 0
+        if mode:
+            writing = any(char in mode for char in "wax+")
+        else:
+            writing = bool(flags & (_mb_os.O_WRONLY | _mb_os.O_RDWR))
+        _mb_io["writes" if writing else "reads"].add(path)
+    elif event == "urllib.Request":
+        _mb_io["urls"].add(str(args[0]))
+_mb_sys.addaudithook(_mb_audit)
+"""
+
+_EPILOGUE = """\
+_mb_io["active"] = False
+import json as _mb_json
+with open({record!r}, "w") as _mb_file:
+    _mb_json.dump({{key: sorted(value) for key, value in _mb_io.items() if isinstance(value, set)}}, _mb_file)
+"""
+
+
+@dataclass
+class NotebookIO:
+    """Files under the repository a notebook reads and writes."""
+
+    reads: Set[Path] = field(default_factory=set)
+    writes: Set[Path] = field(default_factory=set)
+
+    def __or__(self, other: "NotebookIO") -> "NotebookIO":
+        return NotebookIO(self.reads | other.reads, self.writes | other.writes)
+
+
+def hidden_cell(source: str) -> nbformat.NotebookNode:
+    """Return a code cell that :func:`remove_hidden_cells` strips after execution."""
+    cell = nbformat.v4.new_code_cell(source)
+    cell.metadata["tags"] = [_TAG]
+    return cell
+
+
+def add_tracking(
+    content: nbformat.NotebookNode,
+    repo_root: Union[str, Path],
+    record: Union[str, Path],
+) -> None:
+    """Insert the tracking cells into ``content``, in place."""
+    root = str(Path(repo_root).resolve())
+    content.cells.insert(0, hidden_cell(_PREAMBLE.format(root=root)))
+    content.cells.append(hidden_cell(_EPILOGUE.format(record=str(Path(record).resolve()))))
+
+
+def _is_hidden(cell) -> bool:
+    return _TAG in cell.get("metadata", {}).get("tags", [])
+
+
+def remove_hidden_cells(content: nbformat.NotebookNode) -> None:
+    """Remove tracking and profiling cells and renumber execution counts, in place."""
+    # the leading hidden cells took the first execution counts
+    offset = 0
+    for cell in content.cells:
+        if not _is_hidden(cell):
+            break
+        offset += 1 if cell.get("execution_count") else 0
+    content.cells = [cell for cell in content.cells if not _is_hidden(cell)]
+    for cell in content.cells:
+        if cell.cell_type != "code":
+            continue
+        if cell.get("execution_count"):
+            cell.execution_count -= offset
+        for output in cell.get("outputs", []):
+            if output.get("execution_count"):
+                output.execution_count -= offset
+
+
+def load_record(record: Union[str, Path], repo_root: Union[str, Path]) -> NotebookIO:
+    """Read a record written by the tracking cells.
+
+    URLs of this repository's raw data files count as reads of the local
+    copies. Files that were written are not also reported as read.
+    """
+    repo_root = Path(repo_root).resolve()
+    raw = json.loads(Path(record).read_text())
+    reads = {Path(path) for path in raw.get("reads", [])}
+    writes = {Path(path) for path in raw.get("writes", [])}
+    for url in raw.get("urls", []):
+        match = _REPO_DATA_URL.match(url)
+        if match:
+            reads.add(repo_root / match.group(1))
+    return NotebookIO(reads=reads - writes, writes=writes)
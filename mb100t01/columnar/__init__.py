@@ -0,0 +1,21 @@
+"""Feature tables stored column by column, filters and grouped summaries
+evaluated over them in chunks, and intermediate tables shared between
+notebooks in that format."""
+
+from .artifacts import ArtifactStore
+from .groupby import GroupPartial, groupby_agg
+from .query import col, count, query, ranges, select
+from .store import ColumnStore, write_store
+
+__all__ = [
+    "ArtifactStore",
+    "ColumnStore",
+    "GroupPartial",
+    "col",
+    "count",
+    "groupby_agg",
+    "query",
+    "ranges",
+    "select",
+    "write_store",
+]
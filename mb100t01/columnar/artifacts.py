@@ -0,0 +1,284 @@
+"""Intermediate tables shared between notebooks, invalidated by their lineage.
+
+``penguins.dropna()`` and the species and sex subsets derived from it
+(``Adelie_values``, ``Gentoo_values_male``, ...) are computed again in
+``02_Pandas_operations``, ``05_Statistic``, ``02_Using_Seaborn`` and
+``03_Statistic_Annotations_in_Seaborn_Bonus``. :class:`ArtifactStore`
+computes a named intermediate once, writes it as a
+:class:`~mb100t01.columnar.store.ColumnStore` under ``.artifacts/`` at
+the repository root, and later calls, from any notebook, memory-map it
+instead::
+
+    from mb100t01.columnar import ArtifactStore
+    artifacts = ArtifactStore()
+
+    penguins = sns.load_dataset("penguins")
+    penguins_cleaned = artifacts.get("penguins_cleaned", lambda df: df.dropna(), penguins)
+    Adelie_values = artifacts.get(
+        "Adelie_values", lambda df, species: df[df["species"] == species], penguins_cleaned, species="Adelie"
+    )
+
+An artifact is stored under the hash of its lineage: the hash of every
+input, the source code of the transformation and the values of the
+variables it reads from enclosing functions or from the notebook's
+globals, such as a ``threshold`` set in an earlier cell. Inputs and
+variables are hashed by content: tables and arrays by their values,
+paths by the bytes of the file, anything else by its ``repr``. A table
+returned by :meth:`ArtifactStore.get` is hashed by its own lineage
+instead, as long as it is unchanged, so a change anywhere upstream, in
+the data, the code or a variable, gives every downstream artifact a new
+key and it is computed again. Modules and callables the transformation refers to, such as
+functions and classes, are not hashed: only the transformation's own
+source is, not that of the functions it calls.
+Hashing a large table costs about as much as reading it; for big
+sources pass the file instead, which is hashed once per change::
+
+    cleaned = artifacts.get("results_cleaned", lambda path: pd.read_csv(path, sep=";").dropna(),
+                            Path("../../data/Results.csv"))
+
+The numeric columns of tables returned from the store are read-only
+views of the files, so edit a ``.copy()``. A returned table whose columns
+or index were replaced, or whose text columns were edited in place, is
+hashed by content like any other table.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import textwrap
+import time
+import weakref
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .store import ColumnStore, write_store
+
+ARTIFACT_DIR = Path(__file__).resolve().parent.parent.parent / ".artifacts"
+
+_VERSION = 1
+
+# lineage key of every table handed out by an ArtifactStore, by id(), with
+# what _unchanged() compares to trust it
+_LINEAGE: Dict[int, Tuple[str, pd.Index, list]] = {}
+
+
+def _code_hash(function: Callable) -> str:
+    """Hash of a function's source code, or of its bytecode if the source is unavailable."""
+    try:
+        text = textwrap.dedent(inspect.getsource(function))
+    except (OSError, TypeError):
+        code = function.__code__
+
+        def describe(code) -> str:
+            constants = [describe(constant) if inspect.iscode(constant) else repr(constant)
+                         for constant in code.co_consts]
+            return f"{code.co_code.hex()}|{constants}|{code.co_names}"
+
+        text = describe(code)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _free_variables(function: Callable) -> Dict[str, Any]:
+    """Values of the non-local and global variables ``function`` reads, except modules and callables."""
+    try:
+        closure = inspect.getclosurevars(function)
+    except TypeError:
+        # not a Python function, e.g. a builtin or a functools.partial
+        return {}
+    # names used by nested functions and comprehensions too
+    names, codes = set(), [function.__code__]
+    while codes:
+        code = codes.pop()
+        names.update(code.co_names)
+        codes.extend(constant for constant in code.co_consts if inspect.iscode(constant))
+    namespace = getattr(function, "__globals__", {})
+    variables = dict(closure.nonlocals)
+    variables.update((name, namespace[name]) for name in names if name in namespace)
+    return {
+        name: value for name, value in sorted(variables.items())
+        if not (inspect.ismodule(value) or callable(value))
+    }
+
+
+def _file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as stream:
+        for block in iter(lambda: stream.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _columns(table) -> list:
+    return list(table.items()) if isinstance(table, pd.DataFrame) else [(None, table)]
+
+
+def _address(series: pd.Series) -> Optional[int]:
+    if not isinstance(series.dtype, np.dtype):
+        return None
+    return series.to_numpy(copy=False).__array_interface__["data"][0]
+
+
+def _column_states(table, store: ColumnStore) -> list:
+    """Per column of a loaded table, the address of its memory map or the hash of its values."""
+    states = []
+    for (name, series), stored in zip(_columns(table), store.columns):
+        address = _address(series)
+        if len(series) and address == store.column(stored).__array_interface__["data"][0]:
+            states.append((name, "map", address))
+        else:
+            # decoded text and nullable columns are ordinary, writable arrays
+            states.append((name, "hash", pd.util.hash_pandas_object(series, index=False).to_numpy().tobytes()))
+    return states
+
+
+def _unchanged(table, index: pd.Index, states: list) -> bool:
+    """Whether ``table`` still holds the values it was loaded with."""
+    columns = _columns(table)
+    if table.index is not index or len(columns) != len(states):
+        return False
+    for (name, series), (stored, kind, state) in zip(columns, states):
+        if name != stored:
+            return False
+        if kind == "map":
+            # the maps are read-only, so a column still at its map's address is unchanged
+            if _address(series) != state:
+                return False
+        elif pd.util.hash_pandas_object(series, index=False).to_numpy().tobytes() != state:
+            return False
+    return True
+
+
+def _lineage_key(lineage: dict) -> str:
+    return hashlib.sha256(json.dumps(lineage, sort_keys=True).encode()).hexdigest()
+
+
+class ArtifactStore:
+    """Named intermediate tables, computed once and memory-mapped afterwards.
+
+    Parameters
+    ----------
+    root : str or pathlib.Path, optional
+        Store directory; defaults to ``.artifacts/`` at the repository
+        root, so all notebooks share it.
+    """
+
+    def __init__(self, root: Optional[Union[str, Path]] = None):
+        self.root = Path(root) if root is not None else ARTIFACT_DIR
+        self._file_hashes: Dict[str, list] = {}
+
+    def __repr__(self) -> str:
+        return f"ArtifactStore({str(self.root)!r})"
+
+    def _input_hash(self, value: Any) -> str:
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            entry = _LINEAGE.get(id(value))
+            if entry is not None and _unchanged(value, *entry[1:]):
+                return "artifact:" + entry[0]
+            digest = hashlib.sha256()
+            digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+            frame = value.to_frame() if isinstance(value, pd.Series) else value
+            digest.update(repr([(str(name), str(dtype)) for name, dtype in frame.dtypes.items()]).encode())
+            return "table:" + digest.hexdigest()
+        if isinstance(value, np.ndarray):
+            digest = hashlib.sha256(np.ascontiguousarray(value).tobytes())
+            digest.update(f"{value.dtype.str}{value.shape}".encode())
+            return "array:" + digest.hexdigest()
+        if isinstance(value, Path):
+            # file contents, hashed again only when size or mtime change
+            stat = value.stat()
+            key = str(value.resolve())
+            entry = self._file_hashes.get(key)
+            if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+                entry = self._file_hashes[key] = [stat.st_size, stat.st_mtime_ns, _file_hash(value)]
+            return "file:" + entry[2]
+        return "value:" + hashlib.sha256(repr(value).encode()).hexdigest()
+
+    def _lineage(self, function: Callable, inputs: tuple, params: dict) -> dict:
+        return {
+            "code": _code_hash(function),
+            "variables": {name: self._input_hash(value) for name, value in _free_variables(function).items()},
+            "inputs": [self._input_hash(value) for value in inputs],
+            "params": {param: self._input_hash(value) for param, value in sorted(params.items())},
+        }
+
+    def key(self, function: Callable, *inputs, **params) -> str:
+        """Lineage key of ``function(*inputs, **params)``."""
+        return _lineage_key(self._lineage(function, inputs, params))
+
+    def get(self, name: str, function: Callable, *inputs, **params):
+        """Return artifact ``name``, computing ``function(*inputs, **params)`` if needed.
+
+        Parameters
+        ----------
+        name : str
+            Name of the artifact, shared by all notebooks that use it.
+        function : callable
+            Transformation returning a DataFrame or Series.
+        *inputs, **params
+            Arguments of ``function``; all are part of the lineage. Pass
+            files as ``pathlib.Path`` to have them hashed by content.
+
+        Returns
+        -------
+        pandas.DataFrame or pandas.Series
+            The stored result, whose numeric columns are read-only memory maps.
+        """
+        lineage = self._lineage(function, inputs, params)
+        key = _lineage_key(lineage)
+        directory = self.root / name / key[:16]
+        if not (directory / "lineage.json").is_file():
+            start = time.perf_counter()
+            result = function(*inputs, **params)
+            lineage.update(name=name, key=key, function=getattr(function, "__qualname__", repr(function)),
+                           seconds=time.perf_counter() - start)
+            self._write(name, directory, result, lineage)
+        return self._load(directory, key)
+
+    def _write(self, name: str, directory: Path, result, lineage: dict) -> None:
+        if isinstance(result, pd.Series):
+            lineage.update(series=True, series_name=None if result.name is None else str(result.name))
+            frame = result.to_frame(name="value")
+        elif isinstance(result, pd.DataFrame):
+            frame = result
+        else:
+            raise TypeError(f"artifact {name!r} must be a DataFrame or Series, not {type(result).__name__}")
+        frame = frame.set_axis([str(column) for column in frame.columns], axis=1)
+        temporary = directory.with_name(f"{directory.name}.{os.getpid()}.partial")
+        write_store(frame, temporary)
+        (temporary / "lineage.json").write_text(json.dumps(dict(lineage, version=_VERSION, rows=len(frame))))
+        try:
+            os.rename(temporary, directory)
+        except OSError:
+            # another process stored the same artifact first
+            shutil.rmtree(temporary, ignore_errors=True)
+        # earlier versions of the artifact are stale now
+        for other in directory.parent.iterdir():
+            if other != directory and not other.name.endswith(".partial"):
+                shutil.rmtree(other, ignore_errors=True)
+
+    def _load(self, directory: Path, key: str):
+        lineage = json.loads((directory / "lineage.json").read_text())
+        store = ColumnStore(directory)
+        result = store.to_pandas(copy=False)
+        if lineage.get("series"):
+            result = result.iloc[:, 0].rename(lineage["series_name"])
+        _LINEAGE[id(result)] = (key, result.index, _column_states(result, store))
+        weakref.finalize(result, _LINEAGE.pop, id(result), None)
+        return result
+
+    def lineage(self, name: str) -> Optional[dict]:
+        """Stored lineage of the current version of artifact ``name``, or None."""
+        directory = self.root / name
+        versions = sorted(directory.glob("*/lineage.json"), key=lambda path: path.stat().st_mtime_ns)
+        return json.loads(versions[-1].read_text()) if versions else None
+
+    def clear(self, name: Optional[str] = None) -> None:
+        """Remove artifact ``name``, or all artifacts."""
+        shutil.rmtree(self.root if name is None else self.root / name, ignore_errors=True)
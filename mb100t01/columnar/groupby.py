@@ -0,0 +1,447 @@
+"""Grouped summaries of tables larger than memory, from mergeable partials.
+
+``04_Pandas_Bonus`` summarises with ``titanic.groupby("sex").mean(numeric_only=True)``,
+and the same pattern on regionprops tables grouped by ``file_name`` needs
+the whole table in memory. :func:`groupby_agg` reads the table chunk by
+chunk, from a :class:`~mb100t01.columnar.store.ColumnStore`, a CSV file
+or any iterable of DataFrames, and reduces every chunk to a
+:class:`GroupPartial`: per group and column the count, sum, mean, sum of
+squared deviations, minimum and maximum, and a quantile sketch. Partials
+merge exactly (the variance with Chan's parallel formula), so chunks can
+be reduced in any order and in any process, and memory grows with the
+number of groups rather than rows::
+
+    from mb100t01.columnar import groupby_agg
+    groupby_agg("results.csv", "Type", "mean", read_csv={"sep": ";", "index_col": 0})
+    groupby_agg(store, "file_name", {"area": ["mean", "std", "q0.9"], "intensity_mean": "max"})
+
+The result has the layout of ``DataFrame.groupby(by).agg(...)``. Every
+partial is split by the hash of its group keys into ``partitions``
+parts; the parts are merged and finished independently, in parallel when
+there are several workers. With a store as the source, workers read
+their rows from the memory maps themselves and only row ranges are sent
+to them.
+
+Quantiles (``"median"`` and ``"q<fraction>"``, e.g. ``"q0.9"``) are
+approximate: values are counted in logarithmic buckets as in DDSketch,
+which merge by adding counts, and every quantile is within
+``relative_accuracy`` (1% by default) of a value of the group at the
+requested rank. All other statistics match pandas up to floating point
+rounding.
+"""
+
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .store import ColumnStore
+
+# statistics every aggregation needs
+_NEEDS = {
+    "count": {"count"},
+    "sum": {"sum"},
+    "mean": {"count", "mean"},
+    "var": {"count", "mean", "m2"},
+    "std": {"count", "mean", "m2"},
+    "min": {"min"},
+    "max": {"max"},
+    "size": set(),
+    "median": {"sketch"},
+}
+
+# partials buffered per partition before they are merged
+_MERGE_EVERY = 8
+
+# sketch buckets of positive values start here; negative values mirror them
+_OFFSET = 1 << 40
+
+
+def _needs(function: str) -> set:
+    if function in _NEEDS:
+        return _NEEDS[function]
+    if function.startswith("q"):
+        try:
+            fraction = float(function[1:])
+        except ValueError:
+            fraction = -1
+        if 0 <= fraction <= 1:
+            return {"sketch"}
+    raise ValueError(
+        f"unknown aggregation {function!r}; use one of {', '.join(_NEEDS)} or a quantile like 'q0.9'"
+    )
+
+
+def _buckets(values: np.ndarray, gamma: float) -> np.ndarray:
+    """Sketch bucket of every value, ordered like the values; NaN gets no bucket."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        index = np.ceil(np.log(np.abs(values)) / np.log(gamma))
+    index = np.where(np.isfinite(index), index, 0).astype(np.int64)
+    return np.where(values > 0, index + _OFFSET, np.where(values < 0, -(index + _OFFSET), 0))
+
+
+def _bucket_values(buckets: np.ndarray, gamma: float) -> np.ndarray:
+    """A value within the relative accuracy of every value of each bucket."""
+    index = np.abs(buckets) - _OFFSET
+    magnitude = 2 * gamma ** index.astype(float) / (gamma + 1)
+    return np.where(buckets > 0, magnitude, np.where(buckets < 0, -magnitude, 0.0))
+
+
+class GroupPartial:
+    """Per-group statistics of part of a table; merge partials with :meth:`merge`.
+
+    Attributes
+    ----------
+    size : pandas.Series
+        Rows per group.
+    stats : dict
+        Column to DataFrame indexed by group, with ``count``, ``sum``,
+        ``mean``, ``m2``, ``min`` and ``max`` columns as needed.
+    sketches : dict
+        Column to Series of bucket counts, indexed by group and bucket.
+    """
+
+    def __init__(self, size: pd.Series, stats: Dict[str, pd.DataFrame], sketches: Dict[str, pd.Series]):
+        self.size = size
+        self.stats = stats
+        self.sketches = sketches
+
+    @classmethod
+    def of(cls, frame: pd.DataFrame, by: List[str], needs: Dict[str, set], gamma: float) -> "GroupPartial":
+        """Statistics of one chunk, for the columns and statistics in ``needs``."""
+        frame = frame.dropna(subset=by)
+        # booleans are summarised as 0 and 1, as pandas does for their mean
+        booleans = [column for column in needs if pd.api.types.is_bool_dtype(frame[column].dtype)]
+        if booleans:
+            frame = frame.astype(dict.fromkeys(booleans, float))
+        keys = [frame[column] for column in by]
+        grouped = frame.groupby(keys, sort=False, observed=True)
+        size = grouped.size()
+        stats, sketches = {}, {}
+        for column, wanted in needs.items():
+            values = grouped[column]
+            parts = {}
+            if wanted & {"count", "mean", "m2"}:
+                parts["count"] = values.count()
+            if "sum" in wanted:
+                parts["sum"] = values.sum()
+            if wanted & {"mean", "m2"}:
+                parts["mean"] = values.mean()
+            if "m2" in wanted:
+                parts["m2"] = values.var(ddof=0) * parts["count"]
+            if "min" in wanted:
+                parts["min"] = values.min()
+            if "max" in wanted:
+                parts["max"] = values.max()
+            if parts:
+                stats[column] = pd.DataFrame(parts)
+            if "sketch" in wanted:
+                data = frame[column].to_numpy(dtype=float)
+                valid = ~np.isnan(data)
+                bucket = pd.Series(_buckets(data[valid], gamma), name="bucket")
+                sketches[column] = bucket.groupby([key[valid].reset_index(drop=True) for key in keys]
+                                                  + [bucket]).size()
+        return cls(size, stats, sketches)
+
+    def split(self, partitions: int) -> List["GroupPartial"]:
+        """Split by the hash of the group keys into ``partitions`` partials."""
+        if partitions == 1:
+            return [self]
+
+        def part_of(index: pd.Index) -> np.ndarray:
+            levels = ([index.get_level_values(level) for level in range(index.nlevels)]
+                      if isinstance(index, pd.MultiIndex) else [index])
+            hashed = np.zeros(len(index), dtype=np.uint64)
+            for values in levels:
+                # integer keys of one chunk may be floats in another, where they have gaps
+                values = values.to_numpy(dtype=float) if values.dtype.kind in "biuf" else values.to_numpy()
+                hashed = hashed * np.uint64(31) + pd.util.hash_array(values)
+            return hashed % np.uint64(partitions)
+
+        size_part = part_of(self.size.index)
+        stat_parts = {column: part_of(stat.index) for column, stat in self.stats.items()}
+        sketch_parts = {}
+        for column, sketch in self.sketches.items():
+            groups = sketch.index.droplevel(-1)
+            sketch_parts[column] = part_of(groups)
+        return [
+            GroupPartial(
+                self.size[size_part == part],
+                {column: stat[stat_parts[column] == part] for column, stat in self.stats.items()},
+                {column: sketch[sketch_parts[column] == part] for column, sketch in self.sketches.items()},
+            )
+            for part in range(partitions)
+        ]
+
+    @staticmethod
+    def merge(partials: Sequence["GroupPartial"]) -> "GroupPartial":
+        """Combine partials of disjoint rows into one."""
+        if len(partials) == 1:
+            return partials[0]
+        sizes = pd.concat([partial.size for partial in partials])
+        levels = list(range(sizes.index.nlevels))
+        size = sizes.groupby(level=levels, sort=False).sum()
+        stats = {}
+        for column in partials[0].stats:
+            both = pd.concat([partial.stats[column] for partial in partials])
+            grouped = both.groupby(level=levels, sort=False)
+            parts = {}
+            if "count" in both:
+                parts["count"] = grouped["count"].sum()
+            if "sum" in both:
+                parts["sum"] = grouped["sum"].sum()
+            if "mean" in both:
+                # Chan et al.: weighted means, plus the spread of the partial means
+                count = both["count"]
+                weighted = (both["mean"] * count).fillna(0)
+                total = count.groupby(level=levels, sort=False).transform("sum")
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    mean = weighted.groupby(level=levels, sort=False).transform("sum") / total
+                parts["mean"] = mean.groupby(level=levels, sort=False).first()
+                if "m2" in both:
+                    spread = (both["m2"] + count * (both["mean"] - mean) ** 2).fillna(0)
+                    parts["m2"] = spread.groupby(level=levels, sort=False).sum()
+            if "min" in both:
+                parts["min"] = grouped["min"].min()
+            if "max" in both:
+                parts["max"] = grouped["max"].max()
+            stats[column] = pd.DataFrame(parts)
+        sketches = {}
+        for column in partials[0].sketches:
+            both = pd.concat([partial.sketches[column] for partial in partials])
+            sketches[column] = both.groupby(level=list(range(both.index.nlevels)), sort=False).sum()
+        return GroupPartial(size, stats, sketches)
+
+    def quantiles(self, column: str, fractions: Sequence[float], gamma: float) -> pd.DataFrame:
+        """Approximate quantiles of ``column`` per group, one column per fraction."""
+        sketch = self.sketches[column]
+        groups = sketch.index.nlevels - 1
+        frame = sketch.rename("n").reset_index()
+        frame = frame.sort_values(list(frame.columns[:groups + 1]), kind="stable")
+        group_id = frame.groupby(list(frame.columns[:groups]), sort=False).ngroup().to_numpy()
+        counts = frame["n"].to_numpy()
+        cumulative = np.cumsum(counts)
+        starts = np.flatnonzero(np.r_[True, group_id[1:] != group_id[:-1]])
+        totals = np.add.reduceat(counts, starts)
+        before = cumulative[starts] - counts[starts]
+        values = _bucket_values(frame["bucket"].to_numpy(), gamma)
+        result = {}
+        for fraction in fractions:
+            # the bucket holding the value of rank fraction * (n - 1), counted from 0
+            rank = np.floor(fraction * (totals - 1))
+            row = np.searchsorted(cumulative, before + rank, side="right")
+            result[fraction] = values[row]
+        index = frame.iloc[starts, :groups].set_index(list(frame.columns[:groups])).index
+        return pd.DataFrame(result, index=index)
+
+
+def _spec(frame_columns: Sequence[str], by: List[str], numeric: Sequence[str], agg) -> List[Tuple[str, str]]:
+    """(column, function) pairs of an aggregation spec, in output order."""
+    if isinstance(agg, str):
+        return [(column, agg) for column in numeric]
+    if isinstance(agg, (list, tuple)):
+        return [(column, function) for column in numeric for function in agg]
+    pairs = []
+    for column, functions in agg.items():
+        if column not in frame_columns or column in by:
+            raise KeyError(f"{column!r} is not a column to aggregate")
+        for function in [functions] if isinstance(functions, str) else functions:
+            pairs.append((column, function))
+    return pairs
+
+
+def _chunk_partial(frame, by, needs, gamma, partitions):
+    return GroupPartial.of(frame, by, needs, gamma).split(partitions)
+
+
+def _store_partial(path, start, stop, by, needs, gamma, partitions):
+    """Partial of rows ``start:stop`` of a store; runs in a worker process."""
+    store = ColumnStore(path)
+    columns = list(dict.fromkeys(by + list(needs)))
+    # text group keys stay codes, decoded once at the end
+    frame = pd.DataFrame({column: np.asarray(store.column(column)[start:stop]) for column in columns})
+    coded = [column for column in by if store.categories(column) is not None]
+    if coded:
+        frame = frame[(frame[coded] >= 0).all(axis=1)]
+    return _chunk_partial(frame, by, needs, gamma, partitions)
+
+
+def _finish(partials, by, pairs, gamma):
+    """Merge the partials of one partition into its rows of the result."""
+    partial = GroupPartial.merge(partials)
+    columns = {}
+    fractions: Dict[str, Dict[str, float]] = {}
+    for column, function in pairs:
+        if function == "median" or (function.startswith("q") and function not in _NEEDS):
+            fractions.setdefault(column, {})[function] = 0.5 if function == "median" else float(function[1:])
+    quantiles = {column: partial.quantiles(column, list(wanted.values()), gamma)
+                 for column, wanted in fractions.items() if len(partial.sketches[column])}
+    for column, function in pairs:
+        if function == "size":
+            columns[(column, function)] = partial.size
+            continue
+        if column in fractions and function in fractions[column]:
+            found = quantiles.get(column)
+            columns[(column, function)] = (found[fractions[column][function]] if found is not None
+                                           else pd.Series(dtype=float))
+            continue
+        stat = partial.stats[column]
+        if function in ("count", "sum", "min", "max", "mean"):
+            columns[(column, function)] = stat[function]
+        elif function in ("var", "std"):
+            # NaN below two values, as in pandas; merged m2 of an all-NaN group is 0, not NaN
+            with np.errstate(invalid="ignore", divide="ignore"):
+                variance = (stat["m2"] / (stat["count"] - 1)).where(stat["count"] > 1)
+            columns[(column, function)] = variance if function == "var" else np.sqrt(variance)
+    result = pd.DataFrame(columns, index=partial.size.index)
+    for column, function in pairs:
+        if function == "count":
+            result[(column, function)] = result[(column, function)].fillna(0).astype(np.int64)
+        elif function == "sum" and result[(column, function)].isna().any():
+            result[(column, function)] = result[(column, function)].fillna(0)
+    return result
+
+
+def _finish_partition(arguments):
+    return _finish(*arguments)
+
+
+def groupby_agg(
+    data: Union[ColumnStore, pd.DataFrame, str, Path, Iterable[pd.DataFrame]],
+    by: Union[str, Sequence[str]],
+    agg: Union[str, Sequence[str], Dict[str, Union[str, Sequence[str]]]] = "mean",
+    chunk_rows: int = 1 << 20,
+    workers: Optional[int] = None,
+    partitions: Optional[int] = None,
+    relative_accuracy: float = 0.01,
+    read_csv: Optional[dict] = None,
+) -> pd.DataFrame:
+    """``data.groupby(by).agg(agg)``, computed chunk by chunk.
+
+    Parameters
+    ----------
+    data : ColumnStore, pandas.DataFrame, path or iterable of pandas.DataFrame
+        The table. A path is read as CSV in chunks of ``chunk_rows``.
+    by : str or sequence of str
+        Grouping columns; rows with a missing key are dropped, as in pandas.
+    agg : str, list or dict
+        A function name, a list of them for every numeric column, or a
+        dict from column to names, as for ``DataFrame.agg``. Names are
+        ``count``, ``sum``, ``mean``, ``var``, ``std``, ``min``, ``max``,
+        ``size``, ``median`` and ``q<fraction>``.
+    chunk_rows : int
+        Rows reduced at a time.
+    workers : int, optional
+        Processes reducing chunks; defaults to the number of CPUs.
+    partitions : int, optional
+        Hash partitions of the groups, merged independently; defaults to
+        the number of workers.
+    relative_accuracy : float
+        Accuracy of the quantile sketches.
+    read_csv : dict, optional
+        Extra ``pd.read_csv`` arguments when ``data`` is a path.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Indexed by the sorted group keys; with a single function name the
+        columns are the aggregated columns, otherwise ``(column, function)``
+        pairs.
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+    workers = workers or os.cpu_count() or 1
+    partitions = partitions or workers
+
+    if isinstance(data, (str, Path)):
+        chunks: Iterable[pd.DataFrame] = pd.read_csv(data, chunksize=chunk_rows, **(read_csv or {}))
+    elif isinstance(data, pd.DataFrame):
+        chunks = (data.iloc[start:start + chunk_rows] for start in range(0, max(len(data), 1), chunk_rows))
+    elif isinstance(data, ColumnStore):
+        chunks = None
+    else:
+        chunks = iter(data)
+
+    # the columns and statistics to collect follow from the first chunk's schema
+    if chunks is None:
+        schema = pd.DataFrame({column: data.to_pandas([column], slice(0, 0))[column] for column in data.columns})
+        first = None
+    else:
+        first = next(iter(chunks), None)
+        if first is None:
+            raise ValueError("no data to aggregate")
+        schema = first
+    missing = [column for column in by if column not in schema.columns]
+    if missing:
+        raise KeyError(f"no column {', '.join(missing)} to group by")
+    numeric = [column for column in schema.select_dtypes(["number", "bool"]).columns if column not in by]
+    pairs = _spec(list(schema.columns), by, numeric, agg)
+    needs: Dict[str, set] = {}
+    for column, function in pairs:
+        needs.setdefault(column, set()).update(_needs(function))
+
+    pending: List[List[GroupPartial]] = [[] for _ in range(partitions)]
+
+    def collect(parts: List[GroupPartial]) -> None:
+        for part, partial in enumerate(parts):
+            pending[part].append(partial)
+            if len(pending[part]) >= _MERGE_EVERY:
+                pending[part] = [GroupPartial.merge(pending[part])]
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        if chunks is None:
+            tasks = [(str(data.path), start, min(start + chunk_rows, len(data)), by, needs, gamma, partitions)
+                     for start in range(0, len(data), chunk_rows)]
+            results = pool.map(_store_partial, *zip(*tasks)) if pool and tasks else (
+                _store_partial(*task) for task in tasks)
+            for parts in results:
+                collect(parts)
+        else:
+            frames = _chain(first, chunks)
+            if pool is None:
+                for frame in frames:
+                    collect(_chunk_partial(frame, by, needs, gamma, partitions))
+            else:
+                # at most two chunks per worker in flight
+                in_flight = []
+                for frame in frames:
+                    in_flight.append(pool.submit(_chunk_partial, frame, by, needs, gamma, partitions))
+                    if len(in_flight) >= 2 * workers:
+                        collect(in_flight.pop(0).result())
+                for future in in_flight:
+                    collect(future.result())
+        arguments = [(parts, by, pairs, gamma) for parts in pending if parts]
+        if pool is not None and len(arguments) > 1:
+            pieces = list(pool.map(_finish_partition, arguments))
+        else:
+            pieces = [_finish_partition(argument) for argument in arguments]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    result = pd.concat(pieces) if pieces else pd.DataFrame(columns=pd.MultiIndex.from_tuples(pairs))
+    if isinstance(data, ColumnStore):
+        # text keys were grouped as codes
+        decoded = []
+        for level, column in enumerate(by):
+            values = result.index.get_level_values(level)
+            categories = data.categories(column)
+            decoded.append(values if categories is None
+                           else pd.Index(np.array(categories, dtype=object)[values.astype(np.int64)]))
+        result.index = pd.MultiIndex.from_arrays(decoded) if len(by) > 1 else decoded[0]
+    result.index.names = by
+    result = result.sort_index()
+    if isinstance(agg, str) or (isinstance(agg, dict) and all(isinstance(value, str) for value in agg.values())):
+        result.columns = [column for column, _ in pairs]
+    return result
+
+
+def _chain(first: pd.DataFrame, rest: Iterable[pd.DataFrame]):
+    yield first
+    yield from rest
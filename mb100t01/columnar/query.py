@@ -0,0 +1,466 @@
+"""Lazy row filters over a :class:`~mb100t01.columnar.store.ColumnStore`.
+
+The notebooks select rows with chained boolean masks, e.g.
+``df[(df["aspect_ratio"] < 1.2) & (df["file_name"] == name)]``; every
+comparison allocates a mask as long as the table. Here the same filter is
+written with :func:`col` and only builds an expression::
+
+    from mb100t01.columnar import col
+    round_nuclei = (col("aspect_ratio") < 1.2) & (col("file_name") == name)
+    rows = select(store, round_nuclei)        # int64 row positions
+    table = query(store, round_nuclei, ["area", "intensity_mean"])
+
+Evaluation runs chunk by chunk. The store's per-chunk minima and maxima
+first decide, for every chunk and every part of the expression, whether
+it matches no row, every row, or has to be looked at; only chunks of the
+last kind are read, and within them only the parts of the expression
+that are still undecided. Their masks go into buffers of one chunk that
+are reused, so memory does not grow with the table. Text columns compare
+through a lookup table over their categories, which costs one ``np.take``
+per chunk whatever the comparison.
+
+Tables sorted by image, as regionprops tables are, make selections like
+``col("file_name") == name`` touch only the chunks of that image;
+:func:`ranges` returns such selections as runs of rows, and
+``store.column(name)[start:stop]`` is a view of each run.
+"""
+
+from __future__ import annotations
+
+import operator
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .store import ColumnStore
+
+
+class Expression:
+    """A boolean row filter; combine with ``&``, ``|`` and ``~``."""
+
+    def __and__(self, other: "Expression") -> "Expression":
+        return _And([self, other])
+
+    def __or__(self, other: "Expression") -> "Expression":
+        return _Or([self, other])
+
+    def __invert__(self) -> "Expression":
+        return _Not(self)
+
+    def __bool__(self):
+        raise TypeError("filters have no truth value; combine them with &, | and ~ instead of and, or and not")
+
+    def columns(self) -> set:
+        """Names of the columns the filter reads."""
+        raise NotImplementedError
+
+    def _bind(self, store: ColumnStore) -> "_Bound":
+        raise NotImplementedError
+
+
+class _Bound:
+    """A filter prepared for one store.
+
+    ``maybe`` and ``always`` tell per chunk whether some or all of its rows
+    can match; :meth:`evaluate` writes the mask of one undecided chunk.
+    """
+
+    maybe: np.ndarray
+    always: np.ndarray
+
+    def evaluate(self, chunk: int, start: int, stop: int, out: np.ndarray) -> None:
+        if self.always[chunk]:
+            out[:] = True
+        elif not self.maybe[chunk]:
+            out[:] = False
+        else:
+            self._evaluate(chunk, start, stop, out)
+
+    def _evaluate(self, chunk: int, start: int, stop: int, out: np.ndarray) -> None:
+        raise NotImplementedError
+
+
+_COMPARISONS = {
+    "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+    "==": operator.eq, "!=": operator.ne,
+}
+_UFUNCS = {"<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal,
+           "==": np.equal, "!=": np.not_equal}
+
+
+class Column:
+    """A column reference; comparing it gives a filter. Create with :func:`col`."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"col({self.name!r})"
+
+    def __lt__(self, value) -> Expression:
+        return _Compare(self.name, "<", value)
+
+    def __le__(self, value) -> Expression:
+        return _Compare(self.name, "<=", value)
+
+    def __gt__(self, value) -> Expression:
+        return _Compare(self.name, ">", value)
+
+    def __ge__(self, value) -> Expression:
+        return _Compare(self.name, ">=", value)
+
+    def __eq__(self, value) -> Expression:  # type: ignore[override]
+        return _Compare(self.name, "==", value)
+
+    def __ne__(self, value) -> Expression:  # type: ignore[override]
+        return _Compare(self.name, "!=", value)
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def between(self, low, high) -> Expression:
+        """``low <= column <= high``, like ``Series.between``."""
+        return (self >= low) & (self <= high)
+
+    def isin(self, values) -> Expression:
+        return _IsIn(self.name, list(values))
+
+    def isna(self) -> Expression:
+        return _IsNa(self.name)
+
+    def notna(self) -> Expression:
+        return ~_IsNa(self.name)
+
+
+def col(name: str) -> Column:
+    """Refer to column ``name`` in a filter, e.g. ``col("area") > 100``."""
+    return Column(name)
+
+
+class _Leaf(Expression):
+    def __init__(self, name: str):
+        self.name = name
+
+    def columns(self) -> set:
+        return {self.name}
+
+    def _bind(self, store: ColumnStore) -> "_Bound":
+        if self.name not in store.columns:
+            raise KeyError(f"{self.name!r} is not a column of {store!r}")
+        categories = store.categories(self.name)
+        if categories is not None:
+            # text columns: the filter's value for every category, then
+            # for missing values in the last entry, where code -1 lands
+            lookup = np.zeros(len(categories) + 1, dtype=bool)
+            lookup[:-1] = self._categories(np.array(categories, dtype=object), store._meta[self.name]["ordered"])
+            lookup[-1] = self._missing_category()
+            return _BoundLookup(store, self.name, lookup)
+        return self._bind_numeric(store)
+
+    def _categories(self, categories: np.ndarray, ordered: bool) -> np.ndarray:
+        raise NotImplementedError
+
+    def _missing_category(self) -> bool:
+        return False
+
+    def _bind_numeric(self, store: ColumnStore) -> "_Bound":
+        raise NotImplementedError
+
+
+class _Compare(_Leaf):
+    def __init__(self, name: str, op: str, value):
+        super().__init__(name)
+        if isinstance(value, (Column, Expression)):
+            raise TypeError("comparisons between columns are not supported; compare with a value")
+        self.op = op
+        self.value = value
+
+    def __repr__(self) -> str:
+        return f"(col({self.name!r}) {self.op} {self.value!r})"
+
+    def _categories(self, categories: np.ndarray, ordered: bool) -> np.ndarray:
+        compare = _COMPARISONS[self.op]
+        if ordered and self.op not in ("==", "!="):
+            # ordered categoricals compare by category position, as in pandas
+            position = list(categories).index(self.value)
+            return compare(np.arange(len(categories)), position)
+        return np.array([_safe_compare(compare, category, self.value) for category in categories], dtype=bool)
+
+    def _missing_category(self) -> bool:
+        # NaN != value is true in pandas, every other comparison false
+        return self.op == "!="
+
+    def _bind_numeric(self, store: ColumnStore) -> "_Bound":
+        minima, maxima, nulls = store.statistics(self.name)
+        value, op = self.value, self.op
+        complete = nulls == 0
+        with np.errstate(invalid="ignore"):
+            if op in ("<", "<="):
+                compare = _COMPARISONS[op]
+                maybe, always = compare(minima, value), compare(maxima, value) & complete
+            elif op in (">", ">="):
+                compare = _COMPARISONS[op]
+                maybe, always = compare(maxima, value), compare(minima, value) & complete
+            elif op == "==":
+                maybe = (minima <= value) & (value <= maxima)
+                always = (minima == value) & (maxima == value) & complete
+            else:
+                maybe = ~((minima == value) & (maxima == value) & complete)
+                always = (value < minima) | (value > maxima)
+        return _BoundUfunc(store, self.name, _UFUNCS[op], value, maybe, always)
+
+
+def _safe_compare(compare: Callable, left, right) -> bool:
+    try:
+        return bool(compare(left, right))
+    except TypeError:
+        # e.g. "A" < 3; pandas raises too, but only for ordering comparisons
+        if compare in (operator.eq, operator.ne):
+            return compare is operator.ne
+        raise
+
+
+class _IsIn(_Leaf):
+    def __init__(self, name: str, values: list):
+        super().__init__(name)
+        self.values = values
+
+    def __repr__(self) -> str:
+        return f"col({self.name!r}).isin({self.values!r})"
+
+    def _categories(self, categories: np.ndarray, ordered: bool) -> np.ndarray:
+        return pd.Index(categories).isin(self.values)
+
+    def _bind_numeric(self, store: ColumnStore) -> "_Bound":
+        minima, maxima, nulls = store.statistics(self.name)
+        values = np.unique(np.asarray(self.values, dtype=float))
+        values = values[~np.isnan(values)]
+        # some value between the chunk's minimum and maximum
+        maybe = np.searchsorted(values, minima, "left") < np.searchsorted(values, maxima, "right")
+        always = (minima == maxima) & (nulls == 0) & np.isin(minima, values)
+        return _BoundIsIn(store, self.name, values, maybe, always)
+
+
+class _IsNa(_Leaf):
+    def __repr__(self) -> str:
+        return f"col({self.name!r}).isna()"
+
+    def _categories(self, categories: np.ndarray, ordered: bool) -> np.ndarray:
+        return np.zeros(len(categories), dtype=bool)
+
+    def _missing_category(self) -> bool:
+        return True
+
+    def _bind_numeric(self, store: ColumnStore) -> "_Bound":
+        _, _, nulls = store.statistics(self.name)
+        return _BoundIsNa(store, self.name, nulls > 0, nulls == _chunk_sizes(store))
+
+
+def _chunk_sizes(store: ColumnStore) -> np.ndarray:
+    sizes = np.full(store.n_chunks, store.chunk_rows, dtype=np.int64)
+    if len(sizes):
+        sizes[-1] = len(store) - store.chunk_rows * (len(sizes) - 1)
+    return sizes
+
+
+class _BoundColumn(_Bound):
+    def __init__(self, store: ColumnStore, name: str, maybe: np.ndarray, always: np.ndarray):
+        self.values = store.column(name)
+        self.maybe, self.always = maybe, always
+
+
+class _BoundUfunc(_BoundColumn):
+    def __init__(self, store, name, ufunc, value, maybe, always):
+        super().__init__(store, name, maybe, always)
+        self.ufunc, self.value = ufunc, value
+
+    def _evaluate(self, chunk, start, stop, out):
+        self.ufunc(self.values[start:stop], self.value, out=out)
+
+
+class _BoundIsIn(_BoundColumn):
+    def __init__(self, store, name, values, maybe, always):
+        super().__init__(store, name, maybe, always)
+        self.targets = values
+
+    def _evaluate(self, chunk, start, stop, out):
+        out[:] = np.isin(self.values[start:stop], self.targets)
+
+
+class _BoundIsNa(_BoundColumn):
+    def _evaluate(self, chunk, start, stop, out):
+        np.isnan(self.values[start:stop], out=out)
+
+
+class _BoundLookup(_BoundColumn):
+    def __init__(self, store: ColumnStore, name: str, lookup: np.ndarray):
+        minima, maxima, nulls = store.statistics(name)
+        # matching codes between each chunk's smallest and largest code
+        matches = np.concatenate([[0], np.cumsum(lookup[:-1])])
+        low = np.minimum(minima, len(lookup) - 1)
+        high = np.maximum(maxima, low - 1) + 1
+        inside = matches[high] - matches[low]
+        maybe = (inside > 0) | ((nulls > 0) & lookup[-1])
+        always = (inside == high - low) & ((nulls == 0) | lookup[-1])
+        if lookup[:-1].all():
+            always |= (nulls == 0) | lookup[-1]
+        super().__init__(store, name, maybe, always)
+        self.lookup = lookup
+
+    def _evaluate(self, chunk, start, stop, out):
+        np.take(self.lookup, self.values[start:stop], out=out)
+
+
+class _Combination(Expression):
+    def __init__(self, children: List[Expression]):
+        flat = []
+        for child in children:
+            flat.extend(child.children if type(child) is type(self) else [child])
+        self.children = flat
+
+    def columns(self) -> set:
+        return set().union(*(child.columns() for child in self.children))
+
+
+class _And(_Combination):
+    def __repr__(self) -> str:
+        return "(" + " & ".join(map(repr, self.children)) + ")"
+
+    def _bind(self, store):
+        return _BoundAnd([child._bind(store) for child in self.children], store.chunk_rows)
+
+
+class _Or(_Combination):
+    def __repr__(self) -> str:
+        return "(" + " | ".join(map(repr, self.children)) + ")"
+
+    def _bind(self, store):
+        return _BoundOr([child._bind(store) for child in self.children], store.chunk_rows)
+
+
+class _Not(Expression):
+    def __init__(self, child: Expression):
+        self.child = child
+
+    def __repr__(self) -> str:
+        return f"~{self.child!r}"
+
+    def columns(self) -> set:
+        return self.child.columns()
+
+    def _bind(self, store):
+        return _BoundNot(self.child._bind(store))
+
+
+class _BoundAnd(_Bound):
+    def __init__(self, children: List[_Bound], chunk_rows: int):
+        self.children = children
+        self.maybe = np.logical_and.reduce([child.maybe for child in children])
+        self.always = np.logical_and.reduce([child.always for child in children])
+        self.scratch = np.empty(chunk_rows, dtype=bool)
+
+    def _evaluate(self, chunk, start, stop, out):
+        # children true for the whole chunk need no evaluation
+        pending = [child for child in self.children if not child.always[chunk]]
+        pending[0].evaluate(chunk, start, stop, out)
+        scratch = self.scratch[:stop - start]
+        for child in pending[1:]:
+            if not out.any():
+                return
+            child.evaluate(chunk, start, stop, scratch)
+            out &= scratch
+
+
+class _BoundOr(_Bound):
+    def __init__(self, children: List[_Bound], chunk_rows: int):
+        self.children = children
+        self.maybe = np.logical_or.reduce([child.maybe for child in children])
+        self.always = np.logical_or.reduce([child.always for child in children])
+        self.scratch = np.empty(chunk_rows, dtype=bool)
+
+    def _evaluate(self, chunk, start, stop, out):
+        # children false for the whole chunk need no evaluation
+        pending = [child for child in self.children if child.maybe[chunk]]
+        pending[0].evaluate(chunk, start, stop, out)
+        scratch = self.scratch[:stop - start]
+        for child in pending[1:]:
+            if out.all():
+                return
+            child.evaluate(chunk, start, stop, scratch)
+            out |= scratch
+
+
+class _BoundNot(_Bound):
+    def __init__(self, child: _Bound):
+        self.child = child
+        self.maybe = ~child.always
+        self.always = ~child.maybe
+
+    def _evaluate(self, chunk, start, stop, out):
+        self.child.evaluate(chunk, start, stop, out)
+        np.logical_not(out, out=out)
+
+
+def _chunks(store: ColumnStore, predicate: Expression):
+    """Yield ``(start, stop, mask)`` of the chunks that may match; mask is None if all rows do."""
+    bound = predicate._bind(store)
+    buffer = np.empty(store.chunk_rows, dtype=bool)
+    for chunk in np.flatnonzero(bound.maybe):
+        start = int(chunk) * store.chunk_rows
+        stop = min(start + store.chunk_rows, len(store))
+        if bound.always[chunk]:
+            yield start, stop, None
+        else:
+            out = buffer[:stop - start]
+            bound.evaluate(chunk, start, stop, out)
+            yield start, stop, out
+
+
+def select(store: ColumnStore, predicate: Expression) -> np.ndarray:
+    """Row positions of ``store`` matching ``predicate``, ascending, as ``int64``."""
+    pieces = []
+    for start, stop, mask in _chunks(store, predicate):
+        pieces.append(np.arange(start, stop) if mask is None else np.flatnonzero(mask) + start)
+    return np.concatenate(pieces) if pieces else np.empty(0, dtype=np.int64)
+
+
+def count(store: ColumnStore, predicate: Expression) -> int:
+    """Number of rows of ``store`` matching ``predicate``."""
+    return sum(stop - start if mask is None else int(np.count_nonzero(mask))
+               for start, stop, mask in _chunks(store, predicate))
+
+
+def ranges(store: ColumnStore, predicate: Expression) -> np.ndarray:
+    """Matching rows as ``(n, 2)`` half-open ``[start, stop)`` runs.
+
+    Each run can be read as a view, ``store.column(name)[start:stop]``.
+    """
+    starts: List[np.ndarray] = []
+    stops: List[np.ndarray] = []
+    for start, stop, mask in _chunks(store, predicate):
+        if mask is None:
+            starts.append(np.array([start]))
+            stops.append(np.array([stop]))
+            continue
+        edges = np.diff(mask.view(np.int8), prepend=0, append=0)
+        starts.append(np.flatnonzero(edges == 1) + start)
+        stops.append(np.flatnonzero(edges == -1) + start)
+    if not starts:
+        return np.empty((0, 2), dtype=np.int64)
+    starts_, stops_ = np.concatenate(starts), np.concatenate(stops)
+    # join runs that continue across a chunk border
+    joined = np.concatenate([[False], starts_[1:] == stops_[:-1]])
+    return np.column_stack([starts_[~joined], stops_[np.concatenate([~joined[1:], [True]])]]).astype(np.int64)
+
+
+def query(
+    store: ColumnStore, predicate: Optional[Expression] = None, columns: Optional[Sequence[str]] = None
+) -> pd.DataFrame:
+    """The rows of ``store`` matching ``predicate`` as a DataFrame, like ``df[mask][columns]``."""
+    if predicate is None:
+        return store.to_pandas(columns)
+    rows = select(store, predicate)
+    if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+        # one run of rows: read it as slices of the memory maps
+        return store.to_pandas(columns, slice(int(rows[0]), int(rows[-1]) + 1))
+    return store.to_pandas(columns, rows)
@@ -0,0 +1,308 @@
+"""Feature tables stored column by column, for memory-mapped reads.
+
+A CSV of 10**8 regionprops rows has to be parsed completely before any
+row can be looked at. :func:`write_store` converts a table, or a stream
+of chunks such as ``pd.read_csv(..., chunksize=10**6)``, into a
+directory with one raw binary file per column. :class:`ColumnStore`
+memory-maps them, so reading a column or a slice of rows touches only
+those bytes. Text columns such as ``file_name`` or ``Type`` are stored as
+``int32`` codes into a list of categories, in first-seen order.
+
+Rows are grouped into chunks of ``chunk_rows`` (65536 by default), and
+the store keeps the minimum, maximum and number of missing values of
+every column per chunk. :mod:`mb100t01.columnar.query` uses them to skip
+chunks that cannot match a filter::
+
+    store = write_store(pd.read_csv("big.csv", chunksize=10**6), "big.columns")
+    store = ColumnStore("big.columns")
+    store.column("area")[:10]          # a view of the file
+    store.to_pandas(["area", "file_name"])
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CHUNK_ROWS = 1 << 16
+
+_VERSION = 1
+_INDEX = "__index__"
+_NO_CODE = np.iinfo(np.int32).max
+
+
+def _nulls(values: np.ndarray) -> np.ndarray:
+    if values.dtype.kind == "f":
+        return np.isnan(values)
+    return values < 0 if values.dtype == np.int32 else np.zeros(values.shape, dtype=bool)
+
+
+class _ColumnWriter:
+    """Appends one column to its file and collects its chunk statistics."""
+
+    def __init__(self, name: str, series: pd.Series, file: Path, chunk_rows: int):
+        self.name = name
+        self.file = file
+        self.stream = open(file, "wb")
+        self.chunk_rows = chunk_rows
+        self.pandas_dtype = str(series.dtype)
+        self.categories: Optional[Dict] = None
+        self.ordered = False
+        if series.dtype.kind in "biuf" and not isinstance(series.dtype, pd.CategoricalDtype):
+            numpy_dtype = getattr(series.dtype, "numpy_dtype", series.dtype)
+            # nullable integers and booleans become floats to hold NaN
+            self.dtype = np.dtype(np.float64 if isinstance(series.dtype, pd.api.extensions.ExtensionDtype)
+                                  and numpy_dtype.kind in "biu" else numpy_dtype)
+        else:
+            self.dtype = np.dtype(np.int32)
+            self.categories = {}
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                self.categories = {value: code for code, value in enumerate(series.cat.categories)}
+                self.ordered = bool(series.cat.ordered)
+        self.carry = np.empty(0, dtype=self.dtype)
+        self.minima: List = []
+        self.maxima: List = []
+        self.nulls: List[int] = []
+
+    def _values(self, series: pd.Series) -> np.ndarray:
+        if self.categories is None:
+            if self.dtype.kind == "f":
+                return series.to_numpy(dtype=self.dtype, na_value=np.nan)
+            if series.hasnans:
+                raise ValueError(
+                    f"column {self.name!r} has missing values in a later chunk but was "
+                    f"{self.pandas_dtype} in the first; read it as float"
+                )
+            values = series.to_numpy(dtype=self.dtype)
+            if series.dtype != self.dtype and not np.array_equal(values, series.to_numpy()):
+                raise ValueError(
+                    f"column {self.name!r} has {series.dtype} values in a later chunk that "
+                    f"{self.pandas_dtype} cannot hold; read it as float"
+                )
+            return values
+        codes, uniques = pd.factorize(series, use_na_sentinel=True)
+        mapping = np.array([self.categories.setdefault(value, len(self.categories)) for value in uniques],
+                           dtype=np.int32)
+        return np.where(codes >= 0, mapping[np.maximum(codes, 0)] if len(mapping) else -1, -1).astype(np.int32)
+
+    def _statistics(self, values: np.ndarray) -> None:
+        nulls = _nulls(values)
+        self.nulls.append(int(nulls.sum()))
+        if self.categories is not None:
+            present = values[~nulls]
+            self.minima.append(present.min() if len(present) else _NO_CODE)
+            self.maxima.append(present.max() if len(present) else -1)
+        elif self.dtype.kind == "f":
+            # fmin/fmax skip NaN; an all-missing chunk gets an empty range
+            low, high = np.fmin.reduce(values), np.fmax.reduce(values)
+            self.minima.append(np.inf if np.isnan(low) else low)
+            self.maxima.append(-np.inf if np.isnan(high) else high)
+        else:
+            self.minima.append(values.min())
+            self.maxima.append(values.max())
+
+    def append(self, series: pd.Series) -> None:
+        values = self._values(series)
+        values.tofile(self.stream)
+        if len(self.carry):
+            values = np.concatenate([self.carry, values])
+        full = len(values) - len(values) % self.chunk_rows
+        for start in range(0, full, self.chunk_rows):
+            self._statistics(values[start:start + self.chunk_rows])
+        self.carry = values[full:].copy()
+
+    def close(self) -> dict:
+        if len(self.carry):
+            self._statistics(self.carry)
+        self.stream.close()
+        meta = {"name": self.name, "file": self.file.name, "dtype": self.dtype.str, "pandas_dtype": self.pandas_dtype}
+        if self.categories is not None:
+            meta["categories"] = list(self.categories)
+            meta["ordered"] = self.ordered
+        return meta
+
+
+def write_store(
+    data: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+    path: Union[str, Path],
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+) -> "ColumnStore":
+    """Write a table, or a stream of chunks of one, as a column store.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame or iterable of pandas.DataFrame
+        The table; chunks must all have the first chunk's columns. Memory
+        use is one chunk at a time.
+    path : str or pathlib.Path
+        Output directory; an existing store there is replaced.
+    chunk_rows : int
+        Rows per statistics chunk.
+
+    Returns
+    -------
+    ColumnStore
+    """
+    if isinstance(data, pd.DataFrame):
+        data = [data]
+    path = Path(path)
+    temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    shutil.rmtree(temporary, ignore_errors=True)
+    temporary.mkdir(parents=True)
+    writers: Dict[str, _ColumnWriter] = {}
+    names: List[str] = []
+    index_name = None
+    rows = 0
+    for frame in data:
+        if not writers:
+            names = list(frame.columns)
+            if len(set(names)) != len(names) or _INDEX in names:
+                raise ValueError("column names must be unique strings other than " + repr(_INDEX))
+            if isinstance(frame.index, pd.MultiIndex):
+                raise ValueError("tables with a MultiIndex are not supported; reset_index() first")
+            columns = {name: frame[name] for name in names}
+            # a default RangeIndex is not stored
+            if not (isinstance(frame.index, pd.RangeIndex) and frame.index.start == 0 and frame.index.step == 1):
+                columns[_INDEX] = frame.index.to_series()
+            index_name = frame.index.name
+            for number, (name, series) in enumerate(columns.items()):
+                writers[name] = _ColumnWriter(name, series, temporary / f"{number}.bin", chunk_rows)
+        elif list(frame.columns) != names:
+            raise ValueError("all chunks must have the columns of the first chunk")
+        for name, writer in writers.items():
+            writer.append(frame.index.to_series() if name == _INDEX else frame[name])
+        rows += len(frame)
+    if not writers:
+        raise ValueError("no data to write")
+
+    metas = [writer.close() for writer in writers.values()]
+    statistics = {}
+    for number, writer in enumerate(writers.values()):
+        statistics[f"min-{number}"] = np.array(writer.minima, dtype=writer.dtype)
+        statistics[f"max-{number}"] = np.array(writer.maxima, dtype=writer.dtype)
+        statistics[f"nulls-{number}"] = np.array(writer.nulls, dtype=np.int64)
+    np.savez(temporary / "statistics.npz", **statistics)
+    meta = {"version": _VERSION, "rows": rows, "chunk_rows": chunk_rows, "columns": metas,
+            "index_name": index_name}
+    (temporary / "store.json").write_text(json.dumps(meta, default=str))
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(temporary, path)
+    return ColumnStore(path)
+
+
+class ColumnStore:
+    """A table written by :func:`write_store`, read through memory maps.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The store directory.
+    mode : {"r", "c"}
+        ``"r"`` maps the columns read-only; with ``"c"`` they can be
+        written to, but the changes stay in memory and never reach the
+        files.
+
+    Attributes
+    ----------
+    columns : list of str
+        Column names, in table order.
+    chunk_rows : int
+        Rows per statistics chunk.
+    """
+
+    def __init__(self, path: Union[str, Path], mode: str = "r"):
+        if mode not in ("r", "c"):
+            raise ValueError(f"mode must be 'r' or 'c', not {mode!r}")
+        self.path = Path(path)
+        self.mode = mode
+        meta = json.loads((self.path / "store.json").read_text())
+        if meta.get("version") != _VERSION:
+            raise ValueError(f"{self.path} was written by another version of write_store")
+        self._rows = meta["rows"]
+        self.chunk_rows = meta["chunk_rows"]
+        self._index_name = meta["index_name"]
+        self._meta = {column["name"]: dict(column, number=number) for number, column in enumerate(meta["columns"])}
+        self.columns = [name for name in self._meta if name != _INDEX]
+        self._maps: Dict[str, np.ndarray] = {}
+        self._statistics = None
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def __repr__(self) -> str:
+        return f"ColumnStore({str(self.path)!r}, rows={self._rows}, columns={len(self.columns)})"
+
+    @property
+    def n_chunks(self) -> int:
+        return -(-self._rows // self.chunk_rows)
+
+    def column(self, name: str) -> np.ndarray:
+        """The stored values of column ``name`` as a memory map.
+
+        Text columns hold ``int32`` codes into :meth:`categories`, ``-1``
+        where the value is missing.
+        """
+        if name not in self._maps:
+            meta = self._meta[name]
+            dtype = np.dtype(meta["dtype"])
+            if self._rows:
+                self._maps[name] = np.memmap(self.path / meta["file"], dtype=dtype, mode=self.mode, shape=(self._rows,))
+            else:
+                self._maps[name] = np.empty(0, dtype=dtype)
+        return self._maps[name]
+
+    def categories(self, name: str) -> Optional[list]:
+        """Categories of a text column, indexed by its codes; None for numeric columns."""
+        return self._meta[name].get("categories")
+
+    def statistics(self, name: str):
+        """Per-chunk ``(minima, maxima, nulls)`` of column ``name``.
+
+        Chunks where every value is missing have a minimum above their
+        maximum.
+        """
+        if self._statistics is None:
+            with np.load(self.path / "statistics.npz") as data:
+                self._statistics = dict(data)
+        number = self._meta[name]["number"]
+        return (self._statistics[f"min-{number}"], self._statistics[f"max-{number}"],
+                self._statistics[f"nulls-{number}"])
+
+    def _decode(self, name: str, values: np.ndarray):
+        meta = self._meta[name]
+        if "categories" not in meta:
+            if meta["pandas_dtype"] != str(values.dtype):
+                # nullable integers and booleans, stored as floats
+                return pd.array(values).astype(meta["pandas_dtype"])
+            return values
+        categorical = pd.Categorical.from_codes(
+            values, pd.Index(meta["categories"]) if meta["categories"] else pd.Index([], dtype=object),
+            ordered=meta["ordered"],
+        )
+        if meta["pandas_dtype"] == "category":
+            return categorical
+        return pd.Series(categorical).astype(meta["pandas_dtype"]).array
+
+    def index(self, rows=None) -> pd.Index:
+        """Row labels of the stored table, or of ``rows`` of it."""
+        rows = slice(None) if rows is None else rows
+        if _INDEX in self._meta:
+            return pd.Index(self._decode(_INDEX, np.asarray(self.column(_INDEX)[rows])), name=self._index_name)
+        return pd.RangeIndex(self._rows, name=self._index_name)[rows]
+
+    def to_pandas(self, columns: Optional[Sequence[str]] = None, rows=None, copy: bool = True) -> pd.DataFrame:
+        """Read ``columns`` (default all) of ``rows`` (a slice or row positions) into a DataFrame.
+
+        With ``copy=False`` and a slice of rows, numeric columns are views
+        of the memory maps, so only the pages that are used get read.
+        """
+        columns = self.columns if columns is None else list(columns)
+        rows = slice(None) if rows is None else rows
+        data = {name: self._decode(name, np.asarray(self.column(name)[rows])) for name in columns}
+        return pd.DataFrame(data, index=self.index(rows), columns=columns, copy=copy)
@@ -0,0 +1,13 @@
+"""Helpers for reading, storing and previewing microscopy image batches."""
+
+from .crops import RaggedCrops, object_crops, pack_crops
+from .pyramid import ImagePyramid, build_pyramid, pyramid_imshow
+
+__all__ = [
+    "ImagePyramid",
+    "RaggedCrops",
+    "build_pyramid",
+    "object_crops",
+    "pack_crops",
+    "pyramid_imshow",
+]
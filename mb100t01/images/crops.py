@@ -0,0 +1,196 @@
+"""Object crops from the ``bbox`` columns of a feature table.
+
+``blobs_statistics.csv`` stores each blob's bounding box in ``bbox-0``
+... ``bbox-3`` (first row, first column, last row + 1, last column + 1),
+as ``skimage.measure.regionprops_table`` writes it. Looking at objects or
+measuring them again has meant a Python loop that slices and copies each
+crop. :func:`object_crops` returns the crops as views of the image, which
+copies no pixels, and :func:`pack_crops` gathers all of them into one
+contiguous buffer with one ``np.take`` per batch of objects, so there is
+no allocation per object::
+
+    crops = pack_crops(table, image, margin=2)
+    crops[0]                       # first object, a view of crops.data
+    crops.data[crops.offsets[i]:crops.offsets[i + 1]]   # same pixels, flat
+
+Margins are clipped at the image border, so crops near the border are
+smaller than ``bbox + 2 * margin``; ``RaggedCrops.boxes`` holds the
+clipped boxes.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+BBOX_COLUMNS = ("bbox-0", "bbox-1", "bbox-2", "bbox-3")
+
+# pixels gathered per pass of pack_crops; keeps its index arrays in cache
+_BATCH_PIXELS = 1 << 18
+
+
+def crop_boxes(table: pd.DataFrame, shape, margin: int = 0) -> np.ndarray:
+    """Return the ``(n, 4)`` bounding boxes of ``table``, widened by ``margin`` and clipped to ``shape``."""
+    missing = [column for column in BBOX_COLUMNS if column not in table.columns]
+    if missing:
+        raise ValueError(f"Table has no {', '.join(missing)} column")
+    boxes = np.array(table[list(BBOX_COLUMNS)], dtype=np.int64)
+    boxes[:, :2] -= margin
+    boxes[:, 2:] += margin
+    height, width = shape[:2]
+    boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, height)
+    boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, width)
+    return boxes
+
+
+def object_crops(table: pd.DataFrame, image: np.ndarray, margin: int = 0) -> List[np.ndarray]:
+    """Return the crop of every object of ``table`` as a view of ``image``.
+
+    Parameters
+    ----------
+    table : pandas.DataFrame
+        Feature table with ``bbox-0`` ... ``bbox-3`` columns.
+    image : numpy.ndarray
+        Image the table was measured on, optionally with trailing channels;
+        a ``numpy.memmap`` works too and is only read where crops are used.
+    margin : int
+        Pixels added around every box, clipped at the image border.
+
+    Returns
+    -------
+    list of numpy.ndarray
+        One view per row of ``table``; writing to it writes to ``image``.
+    """
+    boxes = crop_boxes(table, image.shape, margin)
+    return [image[top:bottom, left:right] for top, left, bottom, right in boxes.tolist()]
+
+
+@dataclass
+class RaggedCrops:
+    """All object crops packed back to back in one buffer.
+
+    Attributes
+    ----------
+    data : numpy.ndarray
+        Pixels of all crops, row by row, shape ``(total_pixels,)`` plus the
+        image's channel axes.
+    offsets : numpy.ndarray
+        ``n + 1`` start positions in ``data``; crop ``i`` is
+        ``data[offsets[i]:offsets[i + 1]]``.
+    shapes : numpy.ndarray
+        ``(n, 2)`` height and width of every crop.
+    boxes : numpy.ndarray
+        ``(n, 4)`` clipped boxes in image coordinates, ordered like
+        ``bbox-0`` ... ``bbox-3``.
+    masks : numpy.ndarray or None
+        Boolean buffer laid out like ``data``, true on the object's own
+        pixels, if labels were given.
+    """
+
+    data: np.ndarray
+    offsets: np.ndarray
+    shapes: np.ndarray
+    boxes: np.ndarray
+    masks: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.shapes)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        """Crop ``index`` as a 2D view of :attr:`data`."""
+        return self._view(self.data, index)
+
+    def mask(self, index: int) -> np.ndarray:
+        """Mask of crop ``index`` as a 2D view of :attr:`masks`."""
+        if self.masks is None:
+            raise ValueError("crops were packed without labels")
+        return self._view(self.masks, index)
+
+    def _view(self, buffer: np.ndarray, index: int) -> np.ndarray:
+        height, width = self.shapes[index]
+        start, stop = self.offsets[index], self.offsets[index + 1]
+        return buffer[start:stop].reshape((height, width) + buffer.shape[1:])
+
+    def object_index(self) -> np.ndarray:
+        """Crop number of every element of :attr:`data`, for ``np.bincount`` style reductions."""
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+
+def _source_indices(boxes: np.ndarray, shapes: np.ndarray, width: int) -> np.ndarray:
+    """Flat image index of every pixel of the crops ``boxes``, crop after crop."""
+    # one entry per crop row: its first pixel's flat index and length
+    heights, widths = shapes[:, 0], shapes[:, 1]
+    rows = heights[widths > 0]
+    crop = np.repeat(np.flatnonzero(widths > 0), rows)
+    row_in_crop = np.arange(len(crop)) - np.repeat(np.cumsum(rows) - rows, rows)
+    row_start = (boxes[crop, 0] + row_in_crop) * width + boxes[crop, 1]
+    row_length = widths[crop]
+    # consecutive pixels of a row are consecutive in the image: a running
+    # sum of ones, with a jump to the next row's start after each row
+    steps = np.ones(int(row_length.sum()), dtype=np.int64)
+    if len(crop):
+        position = np.cumsum(row_length) - row_length
+        steps[position[1:]] = row_start[1:] - (row_start[:-1] + row_length[:-1] - 1)
+        steps[0] = row_start[0]
+    return np.cumsum(steps)
+
+
+def pack_crops(
+    table: pd.DataFrame,
+    image: np.ndarray,
+    margin: int = 0,
+    labels: Optional[np.ndarray] = None,
+    label_column: str = "label",
+) -> RaggedCrops:
+    """Copy every object crop of ``table`` into one contiguous ragged buffer.
+
+    Parameters
+    ----------
+    table : pandas.DataFrame
+        Feature table with ``bbox-0`` ... ``bbox-3`` columns.
+    image : numpy.ndarray
+        Image the table was measured on, optionally with trailing channels.
+    margin : int
+        Pixels added around every box, clipped at the image border.
+    labels : numpy.ndarray, optional
+        Label image; with it, :attr:`RaggedCrops.masks` marks the pixels of
+        each object, identified by ``label_column``.
+    label_column : str
+        Column of ``table`` holding each object's label.
+
+    Returns
+    -------
+    RaggedCrops
+    """
+    boxes = crop_boxes(table, image.shape, margin)
+    shapes = np.column_stack([boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]])
+    sizes = shapes[:, 0] * shapes[:, 1]
+    offsets = np.zeros(len(boxes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    height, width = image.shape[:2]
+    pixels = image.reshape((height * width,) + image.shape[2:])
+    data = np.empty((int(offsets[-1]),) + image.shape[2:], dtype=image.dtype)
+    masks = None
+    if labels is not None:
+        if labels.shape != image.shape[:2]:
+            raise ValueError(f"labels shape {labels.shape} differs from image shape {image.shape[:2]}")
+        object_labels = table[label_column].to_numpy()
+        flat_labels = labels.reshape(-1)
+        masks = np.empty(int(offsets[-1]), dtype=bool)
+
+    # batches of whole objects of about _BATCH_PIXELS pixels each
+    first = 0
+    while first < len(boxes):
+        last = int(np.searchsorted(offsets, offsets[first] + _BATCH_PIXELS, "right")) - 1
+        last = min(max(last, first + 1), len(boxes))
+        start, stop = offsets[first], offsets[last]
+        source = _source_indices(boxes[first:last], shapes[first:last], width)
+        np.take(pixels, source, axis=0, out=data[start:stop])
+        if masks is not None:
+            owner_labels = np.repeat(object_labels[first:last], sizes[first:last])
+            np.equal(flat_labels[source], owner_labels, out=masks[start:stop])
+        first = last
+    return RaggedCrops(data=data, offsets=offsets, shapes=shapes, boxes=boxes, masks=masks)
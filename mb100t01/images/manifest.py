@@ -0,0 +1,425 @@
+"""Batch-wide intensity statistics from streamed histograms, kept in a manifest.
+
+Display ranges and thresholds for the BBBC007 images are chosen image by
+image, and batch-wide statistics have meant loading every TIFF at once.
+:func:`update_manifest` reads the images of a directory one plane at a
+time in a process pool and keeps only a histogram per image: exact
+per-value counts for integer images spanning up to 65536 values, and for
+float images and wider integer ranges up to 4096 bins spanning the
+image's own range. Memory use is one plane per worker
+plus the histograms.
+
+The histograms go into a JSON manifest together with each file's size,
+modification time and content hash, and the statistics derived from
+them: minimum, maximum, mean, standard deviation, percentiles and Otsu's
+threshold per image and for the whole batch. Unchanged files are not
+read again, so later display and segmentation steps just load the
+manifest::
+
+    manifest = update_manifest("data/BBBC007_batch")
+    manifest.table()                      # per-image statistics
+    low, high = manifest.normalization_range()
+    contact_sheet("data/BBBC007_batch", intensity_range=(low, high))
+    threshold = manifest.otsu()           # one threshold for the batch
+
+Histograms merge by adding counts, so percentiles and thresholds of any
+subset of images come from :meth:`Manifest.histogram` without touching
+the files.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+MANIFEST_DIR = Path(__file__).resolve().parent.parent.parent / ".manifests"
+
+# bins of float images at most, which have no natural per-value histogram
+FLOAT_BINS = 4096
+
+# integer images spanning more values are binned like float images
+EXACT_SPAN = 1 << 16
+
+# percentiles stored for every image and the batch
+PERCENTILES = (0.1, 1.0, 5.0, 50.0, 95.0, 99.0, 99.8, 99.9)
+
+_VERSION = 2
+
+
+def _planes(path: Union[str, Path]):
+    """Yield the pages of a TIFF file one at a time; channels of a page share its histogram."""
+    import tifffile
+
+    with tifffile.TiffFile(path) as tiff:
+        for page in tiff.series[0].pages:
+            yield page.asarray()
+
+
+def _float_width(low: float, high: float) -> float:
+    """Power-of-two bin width fitting ``[low, high]`` into about :data:`FLOAT_BINS` bins."""
+    # bins no narrower than 2**-52 of the magnitude, so bin indices stay exact integers
+    span = max(high - low, max(abs(low), abs(high)) * 2.0 ** -40, np.finfo(float).tiny)
+    return 2.0 ** math.ceil(math.log2(span / FLOAT_BINS))
+
+
+def _add_counts(first: np.ndarray, first_offset: int, second: np.ndarray, second_offset: int):
+    """Sum of two runs of counts starting at bins ``first_offset`` and ``second_offset``."""
+    low = min(first_offset, second_offset)
+    high = max(first_offset + len(first), second_offset + len(second))
+    counts = np.zeros(high - low, dtype=np.int64)
+    counts[first_offset - low:first_offset - low + len(first)] += first
+    counts[second_offset - low:second_offset - low + len(second)] += second
+    return counts, low
+
+
+class Histogram:
+    """Counts of the values of one or more images.
+
+    Integer images spanning at most :data:`EXACT_SPAN` values get one bin
+    per value from ``offset`` on. Float images, and integer images with a
+    wider range, get bins of ``width``, a power of two chosen so that their
+    range takes at most about :data:`FLOAT_BINS` bins; bin ``i`` covers
+    ``[(offset + i) * width, (offset + i + 1) * width)``. The grid is
+    aligned to multiples of the width, so merging binned histograms of
+    different ranges only joins whole bins of the finer grid into the
+    coarser one. Their exact ``minimum`` and ``maximum`` are kept.
+    """
+
+    def __init__(
+        self,
+        counts: np.ndarray,
+        offset: int = 0,
+        width: Optional[float] = None,
+        minimum: Optional[float] = None,
+        maximum: Optional[float] = None,
+    ):
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.offset = int(offset)
+        self.width = None if width is None else float(width)
+        self.minimum = minimum
+        self.maximum = maximum
+
+    @classmethod
+    def of(cls, values: np.ndarray) -> "Histogram":
+        values = np.asarray(values).ravel()
+        if np.issubdtype(values.dtype, np.floating):
+            finite = values[np.isfinite(values)].astype(np.float64)
+            if not finite.size:
+                return cls(np.zeros(0, dtype=np.int64))
+            return cls._binned(finite, float(finite.min()), float(finite.max()))
+        if values.dtype == bool:
+            values = values.view(np.uint8)
+        if not values.size:
+            return cls(np.zeros(0, dtype=np.int64))
+        low, high = int(values.min()), int(values.max())
+        if high - low >= EXACT_SPAN:
+            return cls._binned(values.astype(np.float64), low, high)
+        return cls(np.bincount((values - low).astype(np.intp, copy=False)), offset=low)
+
+    @classmethod
+    def _binned(cls, values: np.ndarray, low: float, high: float) -> "Histogram":
+        width = _float_width(low, high)
+        offset = math.floor(low / width)
+        n_bins = math.floor(high / width) - offset + 1
+        indices = np.clip(np.floor(values / width) - offset, 0, n_bins - 1).astype(np.intp)
+        return cls(np.bincount(indices, minlength=n_bins), offset, width, low, high)
+
+    @property
+    def is_binned(self) -> bool:
+        return self.width is not None
+
+    @property
+    def values(self) -> np.ndarray:
+        """The value each bin stands for: the integer, or the bin centre within the data's range."""
+        if self.is_binned:
+            centres = (self.offset + np.arange(len(self.counts)) + 0.5) * self.width
+            return np.clip(centres, self.minimum, self.maximum)
+        return np.arange(self.offset, self.offset + len(self.counts))
+
+    def rebin(self, width: float) -> "Histogram":
+        """This histogram on the grid of ``width``, a power-of-two multiple of its own.
+
+        Per-value histograms count as bins of width 1.
+        """
+        if not self.is_binned:
+            used = np.flatnonzero(self.counts)
+            minimum, maximum = self.offset + int(used[0]), self.offset + int(used[-1])
+            return Histogram(self.counts, self.offset, 1.0, minimum, maximum).rebin(width)
+        ratio = round(width / self.width)
+        indices = (self.offset + np.arange(len(self.counts))) // ratio
+        offset = int(indices[0])
+        counts = np.bincount(indices - offset, weights=self.counts).astype(np.int64)
+        return Histogram(counts, offset, width, self.minimum, self.maximum)
+
+    def __add__(self, other: "Histogram") -> "Histogram":
+        if not len(other.counts):
+            return self
+        if not len(self.counts):
+            return other
+        if not self.is_binned and not other.is_binned:
+            low = min(self.offset, other.offset)
+            high = max(self.offset + len(self.counts), other.offset + len(other.counts))
+            if high - low <= EXACT_SPAN:
+                counts, offset = _add_counts(self.counts, self.offset, other.counts, other.offset)
+                return Histogram(counts, offset=offset)
+        # on a common power-of-two grid; per-value histograms are bins of width 1
+        first, second = self.rebin(self.width or 1.0), other.rebin(other.width or 1.0)
+        minimum, maximum = min(first.minimum, second.minimum), max(first.maximum, second.maximum)
+        width = max(first.width, second.width, _float_width(minimum, maximum))
+        first, second = first.rebin(width), second.rebin(width)
+        counts, offset = _add_counts(first.counts, first.offset, second.counts, second.offset)
+        return Histogram(counts, offset, width, minimum, maximum)
+
+    def __radd__(self, other) -> "Histogram":
+        # lets sum() start from 0
+        return self if other == 0 else self + other
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def percentile(self, q) -> np.ndarray:
+        """Lowest value with at least ``q`` percent of the pixels at or below it."""
+        cumulative = np.cumsum(self.counts)
+        ranks = np.asarray(q, dtype=float) / 100 * cumulative[-1]
+        index = np.searchsorted(cumulative, np.maximum(ranks, 1), side="left")
+        return self.values[np.minimum(index, len(self.counts) - 1)]
+
+    def otsu(self) -> float:
+        """Otsu's threshold; pixels above it are foreground, as in skimage."""
+        from skimage.filters import threshold_otsu
+
+        used = np.flatnonzero(self.counts)
+        if len(used) < 2:
+            return float(self.values[used[0]]) if len(used) else float("nan")
+        # trimmed to the occupied range, as skimage's own histogram would be
+        first, last = used[0], used[-1] + 1
+        return float(threshold_otsu(hist=(self.counts[first:last], self.values[first:last])))
+
+    def statistics(self) -> Dict[str, float]:
+        values, counts = self.values.astype(float), self.counts
+        total = counts.sum()
+        if not total:
+            return {}
+        used = np.flatnonzero(counts)
+        mean = float((values * counts).sum() / total)
+        variance = float((counts * (values - mean) ** 2).sum() / total)
+        statistics = {
+            "min": float(self.minimum if self.is_binned else values[used[0]]),
+            "max": float(self.maximum if self.is_binned else values[used[-1]]),
+            "mean": mean,
+            "std": variance ** 0.5,
+            "otsu": self.otsu(),
+        }
+        for q, value in zip(PERCENTILES, self.percentile(PERCENTILES)):
+            statistics[f"p{q:g}"] = float(value)
+        return statistics
+
+    def to_json(self) -> dict:
+        if self.is_binned:
+            return {"offset": self.offset, "width": self.width, "minimum": self.minimum,
+                    "maximum": self.maximum, "counts": self.counts.tolist()}
+        return {"offset": self.offset, "counts": self.counts.tolist()}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Histogram":
+        return cls(data["counts"], data["offset"], data.get("width"), data.get("minimum"), data.get("maximum"))
+
+
+def _file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as stream:
+        for block in iter(lambda: stream.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _scan(path: str) -> dict:
+    """Histogram one file plane by plane; runs in a worker process."""
+    histogram = 0
+    shape, dtype, planes = None, None, 0
+    for plane in _planes(path):
+        histogram = histogram + Histogram.of(plane)
+        shape, dtype, planes = plane.shape, plane.dtype.str, planes + 1
+    return {
+        "sha256": _file_hash(Path(path)),
+        "shape": list(shape or ()),
+        "planes": planes,
+        "dtype": dtype,
+        "histogram": histogram.to_json() if planes else Histogram(np.zeros(0)).to_json(),
+    }
+
+
+class Manifest:
+    """Per-image histograms and statistics of a directory of images.
+
+    Attributes
+    ----------
+    path : pathlib.Path
+        The JSON file.
+    images : dict
+        File name to entry, with ``size``, ``mtime_ns``, ``sha256``,
+        ``shape``, ``planes``, ``dtype``, ``histogram`` and ``statistics``.
+    batch : dict
+        ``statistics`` of all images together.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.images: Dict[str, dict] = {}
+        self.batch: dict = {}
+        if self.path.exists():
+            data = json.loads(self.path.read_text())
+            if data.get("version") == _VERSION:
+                self.images = data["images"]
+                self.batch = data["batch"]
+        self._histograms: Dict[str, Histogram] = {}
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_name(self.path.name + ".tmp")
+        temporary.write_text(json.dumps({"version": _VERSION, "images": self.images, "batch": self.batch}))
+        os.replace(temporary, self.path)
+
+    def histogram(self, names: Optional[Union[str, Iterable[str]]] = None) -> Histogram:
+        """Histogram of one image, of several, or of the whole batch."""
+        if isinstance(names, str):
+            names = [names]
+        names = list(self.images) if names is None else list(names)
+        total = 0
+        for name in names:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram.from_json(self.images[name]["histogram"])
+            total = total + self._histograms[name]
+        return total if names else Histogram(np.zeros(0))
+
+    def percentile(self, q, name: Optional[str] = None):
+        """Percentiles of one image, or of the batch; the batch values are stored."""
+        if name is None and np.isscalar(q) and f"p{q:g}" in self.batch.get("statistics", {}):
+            return self.batch["statistics"][f"p{q:g}"]
+        if name is not None and np.isscalar(q) and f"p{q:g}" in self.images[name]["statistics"]:
+            return self.images[name]["statistics"][f"p{q:g}"]
+        return self.histogram(name).percentile(q)
+
+    def otsu(self, name: Optional[str] = None) -> float:
+        """Otsu's threshold of one image, or of the whole batch."""
+        statistics = self.batch["statistics"] if name is None else self.images[name]["statistics"]
+        return statistics["otsu"]
+
+    def normalization_range(
+        self, percentiles: Tuple[float, float] = (1.0, 99.8), name: Optional[str] = None
+    ) -> Tuple[float, float]:
+        """Display range between two percentiles, of one image or the batch."""
+        low, high = (self.percentile(q, name) for q in percentiles)
+        return float(low), float(high)
+
+    def table(self) -> pd.DataFrame:
+        """Per-image statistics, one row per file name."""
+        rows = {name: {"shape": tuple(entry["shape"]), "planes": entry["planes"], "dtype": entry["dtype"],
+                       **entry["statistics"]}
+                for name, entry in self.images.items()}
+        return pd.DataFrame.from_dict(rows, orient="index").rename_axis("file")
+
+
+def manifest_path(directory: Union[str, Path]) -> Path:
+    """Default manifest file of ``directory``, under ``.manifests/`` at the repository root."""
+    directory = Path(directory).resolve()
+    digest = hashlib.sha256(str(directory).encode()).hexdigest()[:10]
+    return MANIFEST_DIR / f"{directory.name}-{digest}.json"
+
+
+def update_manifest(
+    directory: Union[str, Path],
+    pattern: str = "*.tif*",
+    path: Optional[Union[str, Path]] = None,
+    workers: Optional[int] = None,
+) -> Manifest:
+    """Scan new and changed images of ``directory`` and save the manifest.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        Directory of images.
+    pattern : str
+        File name pattern of the images.
+    path : str or pathlib.Path, optional
+        Manifest file; defaults to :func:`manifest_path`.
+    workers : int, optional
+        Size of the process pool; defaults to the number of CPUs.
+
+    Returns
+    -------
+    Manifest
+    """
+    directory = Path(directory)
+    manifest = Manifest(path if path is not None else manifest_path(directory))
+    files = sorted(file for file in directory.glob(pattern) if file.is_file())
+    present = {file.name for file in files}
+    changed = bool(set(manifest.images) - present)
+    for name in set(manifest.images) - present:
+        del manifest.images[name]
+
+    stale: List[Path] = []
+    for file in files:
+        stat = file.stat()
+        entry = manifest.images.get(file.name)
+        if entry is None or (entry["size"], entry["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+            stale.append(file)
+    if stale:
+        workers = min(workers or os.cpu_count() or 1, len(stale))
+        if workers == 1:
+            scans = [_scan(str(file)) for file in stale]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                scans = list(pool.map(_scan, [str(file) for file in stale], chunksize=4))
+        for file, scan in zip(stale, scans):
+            stat = file.stat()
+            histogram = Histogram.from_json(scan["histogram"])
+            manifest.images[file.name] = {
+                "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, **scan,
+                "statistics": histogram.statistics(),
+            }
+        manifest._histograms.clear()
+        changed = True
+    if changed or not manifest.batch:
+        manifest.images = dict(sorted(manifest.images.items()))
+        manifest.batch = {"statistics": manifest.histogram().statistics() if manifest.images else {}}
+        manifest.save()
+    return manifest
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m mb100t01.images.manifest",
+        description="Histogram the images of a directory and store their statistics in a manifest.",
+    )
+    parser.add_argument("directory", help="directory of images")
+    parser.add_argument("--pattern", default="*.tif*", help="image file name pattern")
+    parser.add_argument("--manifest", help="manifest file; defaults to .manifests/<directory>-<hash>.json")
+    parser.add_argument("-j", "--workers", type=int, help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    manifest = update_manifest(args.directory, args.pattern, args.manifest, args.workers)
+    print(manifest.table().drop(columns=["shape", "dtype"]).round(2).to_string())
+    batch = manifest.batch["statistics"]
+    if batch:
+        low, high = manifest.normalization_range()
+        print(f"batch: otsu {batch['otsu']:.4g}, display range {low:.4g}-{high:.4g}")
+    print(f"{len(manifest.images)} images in {time.perf_counter() - start:.1f}s, manifest {manifest.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
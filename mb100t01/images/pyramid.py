@@ -0,0 +1,285 @@
+"""Tiled multiresolution pyramids for displaying large images.
+
+``plt.imshow(image1)`` hands the full-resolution array to matplotlib, which
+resamples all of it on every draw. That is fine for a 340 x 340 BBBC007
+image and unusable for a stitched plate. :func:`build_pyramid` writes the
+image and successively 2x downsampled copies of it to a directory, each
+level stored as a grid of tiles in a memory-mapped ``.npy`` file, and
+:func:`pyramid_imshow` displays it like ``imshow`` while reading only the
+tiles in view from the level that matches the screen resolution.
+
+Example
+-------
+>>> pyramid = build_pyramid(plate, "plate.pyramid")
+>>> pyramid = ImagePyramid("plate.pyramid")   # later, e.g. in another notebook
+>>> pyramid_imshow(pyramid, cmap="gray")
+"""
+
+from __future__ import annotations
+
+import json
+import math
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+_METADATA = "pyramid.json"
+
+
+def _downsample(block: np.ndarray) -> np.ndarray:
+    """Average 2 x 2 pixel blocks; odd trailing rows/columns are averaged alone."""
+    height, width = block.shape[:2]
+    padded_h, padded_w = height + height % 2, width + width % 2
+    if (padded_h, padded_w) != (height, width):
+        pad = [(0, padded_h - height), (0, padded_w - width)] + [(0, 0)] * (block.ndim - 2)
+        block = np.pad(block, pad, mode="edge")
+    shape = (padded_h // 2, 2, padded_w // 2, 2) + block.shape[2:]
+    return block.reshape(shape).mean(axis=(1, 3))
+
+
+def _read_tiles(tiles: np.ndarray, shape, size: int, rows, cols) -> np.ndarray:
+    """Assemble a region of a level from its ``(ty, tx, size, size, ...)`` tiles."""
+    top, bottom = max(rows[0], 0), min(rows[1], shape[0])
+    left, right = max(cols[0], 0), min(cols[1], shape[1])
+    out_shape = (max(bottom - top, 0), max(right - left, 0)) + tuple(shape[2:])
+    out = np.empty(out_shape, dtype=tiles.dtype)
+    if out.size == 0:
+        return out
+    for ty in range(top // size, (bottom - 1) // size + 1):
+        y0, y1 = max(top, ty * size), min(bottom, (ty + 1) * size)
+        for tx in range(left // size, (right - 1) // size + 1):
+            x0, x1 = max(left, tx * size), min(right, (tx + 1) * size)
+            out[y0 - top : y1 - top, x0 - left : x1 - left] = tiles[
+                ty, tx, y0 - ty * size : y1 - ty * size, x0 - tx * size : x1 - tx * size
+            ]
+    return out
+
+
+class ImagePyramid:
+    """Read access to a pyramid written by :func:`build_pyramid`.
+
+    Level 0 is the full resolution image, level ``k`` is downsampled by
+    ``2 ** k``. Every level is a memory-mapped array of shape
+    ``(tiles_y, tiles_x, tile_size, tile_size[, channels])``, so each tile
+    is contiguous on disk and reading a region touches only its tiles.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        metadata = json.loads((self.path / _METADATA).read_text())
+        self.tile_size: int = metadata["tile_size"]
+        self.dtype = np.dtype(metadata["dtype"])
+        self.shapes: List[Tuple[int, ...]] = [tuple(shape) for shape in metadata["shapes"]]
+        self._tiles = [
+            np.load(self.path / f"level_{level}.npy", mmap_mode="r")
+            for level in range(len(self.shapes))
+        ]
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """Shape of the full-resolution image."""
+        return self.shapes[0]
+
+    @property
+    def n_levels(self) -> int:
+        return len(self.shapes)
+
+    def level_for(self, pixels_per_screen_pixel: float) -> int:
+        """Return the coarsest level that still has at least one pixel per screen pixel."""
+        if pixels_per_screen_pixel <= 1:
+            return 0
+        level = int(math.floor(math.log2(pixels_per_screen_pixel)))
+        return min(level, self.n_levels - 1)
+
+    def read_region(self, level: int, rows: Tuple[int, int], cols: Tuple[int, int]) -> np.ndarray:
+        """Return pixels ``[rows[0]:rows[1], cols[0]:cols[1]]`` of ``level``.
+
+        Coordinates are in pixels of that level and are clipped to it.
+        """
+        return _read_tiles(self._tiles[level], self.shapes[level], self.tile_size, rows, cols)
+
+    def level(self, level: int) -> np.ndarray:
+        """Return a whole level as a regular array. Only sensible for coarse levels."""
+        shape = self.shapes[level]
+        return self.read_region(level, (0, shape[0]), (0, shape[1]))
+
+
+def _write_level(path: Path, level: int, source, shape, tile_size: int, dtype) -> np.ndarray:
+    """Copy ``source`` (any array-like supporting 2D slicing) into a tiled level file."""
+    tiles_y = -(-shape[0] // tile_size)
+    tiles_x = -(-shape[1] // tile_size)
+    tiles = np.lib.format.open_memmap(
+        path / f"level_{level}.npy",
+        mode="w+",
+        dtype=dtype,
+        shape=(tiles_y, tiles_x, tile_size, tile_size) + tuple(shape[2:]),
+    )
+    for ty in range(tiles_y):
+        # one strip of tiles at a time keeps memory bounded by width x tile_size
+        strip = np.asarray(source[ty * tile_size : (ty + 1) * tile_size])
+        for tx in range(tiles_x):
+            block = strip[:, tx * tile_size : (tx + 1) * tile_size]
+            tiles[ty, tx, : block.shape[0], : block.shape[1]] = block
+    tiles.flush()
+    return tiles
+
+
+class _DownsampledLevel:
+    """Lazy 2x downsampled view of a tiled level; supports slicing rows only."""
+
+    def __init__(self, tiles: np.ndarray, shape, tile_size: int):
+        self._tiles = tiles
+        self._source_shape = shape
+        self._tile_size = tile_size
+        self.shape = (-(-shape[0] // 2), -(-shape[1] // 2)) + tuple(shape[2:])
+
+    def __getitem__(self, rows: slice) -> np.ndarray:
+        start, stop, _ = rows.indices(self.shape[0])
+        block = _read_tiles(
+            self._tiles, self._source_shape, self._tile_size,
+            (2 * start, 2 * stop), (0, self._source_shape[1]),
+        )
+        block = _downsample(block)
+        if np.issubdtype(self._tiles.dtype, np.integer):
+            block = np.rint(block)
+        return block.astype(self._tiles.dtype)
+
+
+def build_pyramid(
+    image: Union[np.ndarray, str, Path],
+    path: Union[str, Path],
+    tile_size: int = 256,
+    min_size: Optional[int] = None,
+) -> ImagePyramid:
+    """Write ``image`` and its 2x downsampled levels as a tiled pyramid.
+
+    Parameters
+    ----------
+    image : numpy.ndarray or path
+        2D image, optionally with a trailing channel axis. A path is read
+        with ``skimage.io.imread``; pass a ``numpy.memmap`` or
+        ``tifffile.memmap`` array for images that do not fit in memory.
+    path : str or pathlib.Path
+        Directory to write the pyramid to. Existing level files are
+        overwritten.
+    tile_size : int
+        Edge length of the square tiles.
+    min_size : int, optional
+        Stop adding levels once both image dimensions are at most this
+        large. Defaults to ``tile_size``.
+
+    Returns
+    -------
+    ImagePyramid
+    """
+    if isinstance(image, (str, Path)):
+        from skimage.io import imread
+
+        image = imread(image)
+    if image.ndim not in (2, 3):
+        raise ValueError(f"Expected a 2D image with optional channels, got shape {image.shape}.")
+    if min_size is None:
+        min_size = tile_size
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    # level 0 keeps the image dtype; coarser levels are averages and stay
+    # in that dtype too, so display scaling is the same on every level
+    dtype = image.dtype
+    shapes = [tuple(image.shape)]
+    tiles = _write_level(path, 0, image, image.shape, tile_size, dtype)
+    while max(shapes[-1][:2]) > min_size:
+        source = _DownsampledLevel(tiles, shapes[-1], tile_size)
+        tiles = _write_level(path, len(shapes), source, source.shape, tile_size, dtype)
+        shapes.append(source.shape)
+
+    (path / _METADATA).write_text(
+        json.dumps({"tile_size": tile_size, "dtype": dtype.str, "shapes": shapes})
+    )
+    return ImagePyramid(path)
+
+
+class _PyramidView:
+    """Keeps an ``AxesImage`` in sync with the visible part of a pyramid."""
+
+    def __init__(self, pyramid: ImagePyramid, image, ax):
+        self.pyramid = pyramid
+        self.image = image
+        self.ax = ax
+        self._shown = None
+
+    def update(self, *_):
+        ax = self.ax
+        height, width = self.pyramid.shape[:2]
+        (x0, x1), (y0, y1) = sorted(ax.get_xlim()), sorted(ax.get_ylim())
+        # extent uses pixel edges, pixel i covers [i - 0.5, i + 0.5]
+        left, right = max(int(math.floor(x0 + 0.5)), 0), min(int(math.ceil(x1 + 0.5)), width)
+        top, bottom = max(int(math.floor(y0 + 0.5)), 0), min(int(math.ceil(y1 + 0.5)), height)
+        if right <= left or bottom <= top:
+            return
+        bbox = ax.get_window_extent()
+        screen = max(min(bbox.width / (x1 - x0), bbox.height / (y1 - y0)), 1e-9)
+        level = self.pyramid.level_for(1 / screen)
+        factor = 2 ** level
+        # widen to whole pixels of the chosen level
+        rows = (top // factor, -(-bottom // factor))
+        cols = (left // factor, -(-right // factor))
+        key = (level, rows, cols)
+        if key == self._shown:
+            return
+        self._shown = key
+        self.image.set_data(self.pyramid.read_region(level, rows, cols))
+        self.image.set_extent((
+            cols[0] * factor - 0.5,
+            min(cols[1] * factor, width) - 0.5,
+            min(rows[1] * factor, height) - 0.5,
+            rows[0] * factor - 0.5,
+        ))
+
+
+def pyramid_imshow(pyramid: Union[ImagePyramid, str, Path], ax=None, **kwargs):
+    """Display an image pyramid like ``plt.imshow`` displays an array.
+
+    The axes use full-resolution pixel coordinates, so overlays such as
+    centroids from a feature table can be plotted on top unchanged. On
+    every change of the view limits or the figure size only the tiles in
+    view are read, from the coarsest level with at least one image pixel
+    per screen pixel.
+
+    Parameters
+    ----------
+    pyramid : ImagePyramid or path
+        Pyramid, or the directory it was written to.
+    ax : matplotlib.axes.Axes, optional
+        Axes to draw into; the current axes by default.
+    **kwargs
+        Passed on to ``Axes.imshow``, e.g. ``cmap``, ``vmin`` and ``vmax``.
+        Set ``vmin``/``vmax`` explicitly to keep the color scale fixed
+        while panning.
+
+    Returns
+    -------
+    matplotlib.image.AxesImage
+    """
+    from matplotlib import pyplot as plt
+
+    if not isinstance(pyramid, ImagePyramid):
+        pyramid = ImagePyramid(pyramid)
+    if ax is None:
+        ax = plt.gca()
+    height, width = pyramid.shape[:2]
+    coarsest = pyramid.n_levels - 1
+    image = ax.imshow(
+        pyramid.level(coarsest),
+        extent=(-0.5, width - 0.5, height - 0.5, -0.5),
+        **kwargs,
+    )
+    view = _PyramidView(pyramid, image, ax)
+    view.update()
+    ax.callbacks.connect("xlim_changed", view.update)
+    ax.callbacks.connect("ylim_changed", view.update)
+    ax.figure.canvas.mpl_connect("resize_event", view.update)
+    # keep the view alive as long as the image is
+    image._pyramid_view = view
+    return image
@@ -0,0 +1,450 @@
+"""Cached thumbnails, contact sheets and object galleries for image batches.
+
+The plotting notebooks find out what a batch looks like with
+``plt.imshow(image1)``, one full image at a time. :func:`thumbnails`
+makes a small, contrast-stretched PNG preview of every TIFF in a
+directory in a process pool, and :func:`contact_sheet` tiles them into
+one image. :func:`object_gallery` does the same for the objects of a
+feature table, from their ``bbox`` columns.
+
+Previews are cached under ``.thumbnails/`` at the repository root, named
+by the SHA-256 of the image file's content and the preview settings, so
+renamed or copied files reuse them and changed files get new ones. An
+index of file size and modification time avoids hashing unchanged files
+again; with a warm cache a contact sheet of a 1000-image plate only
+stats the files and reads the small PNGs, which takes a second or two::
+
+    from mb100t01.images.thumbnails import contact_sheet
+    sheet = contact_sheet("data/BBBC007_batch")
+    sheet.show()
+
+or ``python -m mb100t01.images.thumbnails data/BBBC007_batch sheet.png``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = Path(__file__).resolve().parent.parent.parent / ".thumbnails"
+
+# bump when the preview algorithm changes, so old cache entries are not used
+_VERSION = 1
+
+_INDEX = "index.json"
+
+
+def _file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as stream:
+        for block in iter(lambda: stream.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class _HashIndex:
+    """Content hashes of files, reused while their size and mtime are unchanged."""
+
+    def __init__(self, cache_dir: Path):
+        self.path = cache_dir / _INDEX
+        try:
+            self.entries: Dict[str, list] = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            self.entries = {}
+        self.changed = False
+
+    def hash(self, path: Path) -> str:
+        stat = path.stat()
+        key = str(path.resolve())
+        entry = self.entries.get(key)
+        if entry is not None and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry[2]
+        digest = _file_hash(path)
+        self.entries[key] = [stat.st_size, stat.st_mtime_ns, digest]
+        self.changed = True
+        return digest
+
+    def save(self) -> None:
+        if not self.changed:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        temporary.write_text(json.dumps(self.entries))
+        os.replace(temporary, self.path)
+        self.changed = False
+
+
+def _read_plane(path: Union[str, Path]) -> np.ndarray:
+    """Read an image as one 2D plane, or 2D plus colour channels."""
+    import tifffile
+
+    image = tifffile.imread(path)
+    if image.ndim == 3 and image.shape[-1] not in (3, 4):
+        # a stack of planes: preview the maximum projection
+        image = image.max(axis=0)
+    elif image.ndim > 3:
+        image = image.reshape((-1,) + image.shape[-2:]).max(axis=0)
+    return image
+
+
+def downsample(image: np.ndarray, size: int) -> np.ndarray:
+    """Shrink ``image`` by averaging blocks so its longer side is at most ``size``."""
+    height, width = image.shape[:2]
+    factor = max(math.ceil(max(height, width) / size), 1)
+    if factor == 1:
+        return image.astype(np.float32)
+    padded_h, padded_w = -(-height // factor) * factor, -(-width // factor) * factor
+    pad = [(0, padded_h - height), (0, padded_w - width)] + [(0, 0)] * (image.ndim - 2)
+    block = np.pad(image.astype(np.float32), pad, mode="edge")
+    shape = (padded_h // factor, factor, padded_w // factor, factor) + image.shape[2:]
+    return block.reshape(shape).mean(axis=(1, 3))
+
+
+def normalize(
+    image: np.ndarray,
+    percentiles: Tuple[float, float] = (1.0, 99.8),
+    intensity_range: Optional[Tuple[float, float]] = None,
+) -> np.ndarray:
+    """Stretch ``image`` to ``uint8`` between two percentiles, or a fixed range."""
+    if intensity_range is None:
+        low, high = np.percentile(image, percentiles)
+    else:
+        low, high = intensity_range
+    scale = 255.0 / (high - low) if high > low else 0.0
+    return np.clip((image - low) * scale, 0, 255).astype(np.uint8)
+
+
+def _write_png(array: np.ndarray, path: Path) -> None:
+    from PIL import Image
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    Image.fromarray(array).save(temporary, format="PNG")
+    os.replace(temporary, path)
+
+
+def _read_png(path: Path) -> np.ndarray:
+    from PIL import Image
+
+    with Image.open(path) as image:
+        return np.asarray(image)
+
+
+def _make_thumbnail(source: str, target: str, size: int, percentiles, intensity_range) -> str:
+    """Render the preview of ``source`` to ``target``; runs in a worker process."""
+    image = downsample(_read_plane(source), size)
+    _write_png(normalize(image, percentiles, intensity_range), Path(target))
+    return target
+
+
+def _settings_key(digest: str, **settings) -> str:
+    text = json.dumps({"version": _VERSION, "content": digest, **settings}, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:24]
+
+
+def image_files(directory: Union[str, Path], pattern: str = "*.tif*") -> List[Path]:
+    """The image files in ``directory`` matching ``pattern``, sorted by name."""
+    return sorted(path for path in Path(directory).glob(pattern) if path.is_file())
+
+
+def thumbnails(
+    images: Union[str, Path, Iterable[Union[str, Path]]],
+    size: int = 128,
+    percentiles: Tuple[float, float] = (1.0, 99.8),
+    intensity_range: Optional[Tuple[float, float]] = None,
+    workers: Optional[int] = None,
+    cache_dir: Union[str, Path] = CACHE_DIR,
+) -> Dict[Path, Path]:
+    """Return a cached PNG preview for every image.
+
+    Parameters
+    ----------
+    images : path or iterable of paths
+        A directory, whose ``*.tif*`` files are used, or image files.
+    size : int
+        Longest side of the previews in pixels; images are shrunk by
+        averaging blocks of pixels, never enlarged.
+    percentiles : tuple of float
+        Intensity percentiles of each image mapped to black and white.
+    intensity_range : tuple of float, optional
+        Fixed intensities mapped to black and white instead, e.g. a
+        batch-wide range, so previews are comparable.
+    workers : int, optional
+        Size of the process pool for previews not in the cache; defaults
+        to the number of CPUs.
+    cache_dir : str or pathlib.Path
+        Cache directory.
+
+    Returns
+    -------
+    dict
+        Image path to preview path, in the order of ``images``.
+    """
+    if isinstance(images, (str, Path)):
+        images = image_files(images)
+    images = [Path(image) for image in images]
+    cache_dir = Path(cache_dir)
+    index = _HashIndex(cache_dir)
+    settings = {
+        "size": size,
+        "percentiles": list(percentiles),
+        "range": None if intensity_range is None else [float(value) for value in intensity_range],
+    }
+    targets = {}
+    for image in images:
+        key = _settings_key(index.hash(image), **settings)
+        targets[image] = cache_dir / key[:2] / f"{key}.png"
+    index.save()
+
+    # identical files share a target, which is rendered once
+    missing = {target: image for image, target in targets.items() if not target.exists()}
+    if missing:
+        arguments = [
+            (str(image), str(target), size, tuple(percentiles), intensity_range)
+            for target, image in missing.items()
+        ]
+        workers = min(workers or os.cpu_count() or 1, len(arguments))
+        if workers == 1:
+            for args in arguments:
+                _make_thumbnail(*args)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(_make_thumbnail, *zip(*arguments), chunksize=8))
+    return targets
+
+
+@dataclass
+class ContactSheet:
+    """Previews tiled into one image.
+
+    Attributes
+    ----------
+    image : numpy.ndarray
+        ``uint8`` sheet, grey or RGB(A).
+    names : list of str
+        Caption of every cell, row by row.
+    cell : int
+        Edge length of the square cells in pixels, including the gap.
+    columns : int
+        Number of cells per row.
+    """
+
+    image: np.ndarray
+    names: List[str]
+    cell: int
+    columns: int
+
+    def cell_of(self, position: int) -> Tuple[int, int]:
+        """Top left pixel of cell ``position`` in :attr:`image`."""
+        row, column = divmod(position, self.columns)
+        return row * self.cell, column * self.cell
+
+    def save(self, path: Union[str, Path]) -> None:
+        _write_png(self.image, Path(path))
+
+    def show(self, ax=None, captions: Optional[bool] = None, **kwargs):
+        """Display the sheet; captions default to on for up to 100 cells.
+
+        Returns
+        -------
+        matplotlib.image.AxesImage
+        """
+        from matplotlib import pyplot as plt
+
+        if ax is None:
+            ax = plt.gca()
+        kwargs.setdefault("cmap", "gray")
+        shown = ax.imshow(self.image, interpolation="nearest", **kwargs)
+        ax.set_axis_off()
+        if captions is None:
+            captions = len(self.names) <= 100
+        if captions:
+            for position, name in enumerate(self.names):
+                top, left = self.cell_of(position)
+                ax.text(left + 1, top + 1, name, color="yellow", fontsize=6, va="top", ha="left", clip_on=True)
+        return shown
+
+
+def _tile(previews: Sequence[np.ndarray], names: List[str], cell: int, columns: Optional[int], gap: int) -> ContactSheet:
+    """Place previews of at most ``cell - gap`` pixels into a grid of cells."""
+    count = len(previews)
+    if columns is None:
+        columns = max(int(math.ceil(math.sqrt(count))), 1)
+    rows = max(-(-count // columns), 1)
+    channels = max((preview.shape[2:] for preview in previews), default=())
+    sheet = np.zeros((rows * cell - gap, columns * cell - gap) + tuple(channels), dtype=np.uint8)
+    for position, preview in enumerate(previews):
+        if preview.shape[2:] != tuple(channels):
+            preview = np.repeat(preview[..., None], channels[0], axis=2) if channels else preview[..., 0]
+        row, column = divmod(position, columns)
+        top = row * cell + (cell - gap - preview.shape[0]) // 2
+        left = column * cell + (cell - gap - preview.shape[1]) // 2
+        sheet[top:top + preview.shape[0], left:left + preview.shape[1]] = preview
+    return ContactSheet(image=sheet, names=names, cell=cell, columns=columns)
+
+
+def contact_sheet(
+    images: Union[str, Path, Iterable[Union[str, Path]]],
+    size: int = 128,
+    columns: Optional[int] = None,
+    gap: int = 2,
+    **kwargs,
+) -> ContactSheet:
+    """Tile the cached previews of ``images`` into one sheet.
+
+    Parameters
+    ----------
+    images : path or iterable of paths
+        A directory or image files, as for :func:`thumbnails`.
+    size : int
+        Preview size.
+    columns : int, optional
+        Cells per row; by default the sheet is about square.
+    gap : int
+        Black pixels between cells.
+    **kwargs
+        Passed on to :func:`thumbnails`, e.g. ``intensity_range``.
+
+    Returns
+    -------
+    ContactSheet
+    """
+    previews = thumbnails(images, size=size, **kwargs)
+    return _tile(
+        [_read_png(preview) for preview in previews.values()],
+        [image.stem for image in previews],
+        size + gap,
+        columns,
+        gap,
+    )
+
+
+def _gallery_cells(crops, size: int) -> np.ndarray:
+    """Resample every packed crop to fit a ``size`` x ``size`` cell, all at once."""
+    heights, widths = crops.shapes[:, 0], crops.shapes[:, 1]
+    scale = np.maximum(np.maximum(heights, widths) / size, 1e-9)
+    # nearest pixel of each crop under every cell pixel, crops centred in their cell
+    grid = np.arange(size) + 0.5
+    row = ((grid[None, :] - (size - heights[:, None] / scale[:, None]) / 2) * scale[:, None]).astype(np.int64)
+    column = ((grid[None, :] - (size - widths[:, None] / scale[:, None]) / 2) * scale[:, None]).astype(np.int64)
+    inside = (
+        ((row >= 0) & (row < heights[:, None]))[:, :, None]
+        & ((column >= 0) & (column < widths[:, None]))[:, None, :]
+    )
+    source = (
+        crops.offsets[:-1, None, None]
+        + np.clip(row, 0, None)[:, :, None] * widths[:, None, None]
+        + np.clip(column, 0, None)[:, None, :]
+    )
+    source = np.where(inside, source, 0)
+    cells = crops.data[source].astype(np.float32)
+    cells[~inside] = np.nan
+    return cells
+
+
+def object_gallery(
+    table: pd.DataFrame,
+    image: Union[np.ndarray, str, Path],
+    size: int = 48,
+    margin: int = 2,
+    columns: Optional[int] = None,
+    percentiles: Tuple[float, float] = (1.0, 99.8),
+    gap: int = 2,
+    cache_dir: Union[str, Path] = CACHE_DIR,
+) -> ContactSheet:
+    """Gallery of the objects of a feature table, one cell per row of ``table``.
+
+    Parameters
+    ----------
+    table : pandas.DataFrame
+        Rows to show, in order, with ``bbox-0`` ... ``bbox-3`` columns;
+        sort or sample it first, e.g. ``table.nlargest(100, "area")``.
+    image : numpy.ndarray or path
+        Image the table was measured on.
+    size : int
+        Cell size; crops are scaled to fit, keeping their aspect ratio.
+    margin : int
+        Pixels of context around every bounding box.
+    columns : int, optional
+        Cells per row; by default the gallery is about square.
+    percentiles : tuple of float
+        Percentiles of all shown pixels mapped to black and white, so the
+        objects are comparable with each other.
+    gap : int
+        Black pixels between cells.
+    cache_dir : str or pathlib.Path
+        Cache directory for galleries of image files.
+
+    Returns
+    -------
+    ContactSheet
+        Captioned with the index of ``table``.
+    """
+    from .crops import BBOX_COLUMNS, pack_crops
+
+    names = [str(name) for name in table.index]
+    target = None
+    if isinstance(image, (str, Path)):
+        index = _HashIndex(Path(cache_dir))
+        boxes = np.ascontiguousarray(table[list(BBOX_COLUMNS)].to_numpy(dtype=np.int64))
+        key = _settings_key(
+            index.hash(Path(image)), gallery=hashlib.sha256(boxes.tobytes()).hexdigest(),
+            size=size, margin=margin, columns=columns, percentiles=list(percentiles), gap=gap,
+        )
+        index.save()
+        target = Path(cache_dir) / key[:2] / f"{key}.png"
+        if target.exists():
+            cached = _read_png(target)
+            return ContactSheet(image=cached, names=names, cell=size + gap,
+                                columns=columns or max(int(math.ceil(math.sqrt(len(table)))), 1))
+        image = _read_plane(image)
+
+    cells = _gallery_cells(pack_crops(table, image, margin=margin), size)
+    shown = cells[~np.isnan(cells)]
+    low, high = np.percentile(shown, percentiles) if shown.size else (0.0, 1.0)
+    previews = normalize(np.nan_to_num(cells, nan=low), intensity_range=(low, high))
+    sheet = _tile(list(previews), names, size + gap, columns, gap)
+    if target is not None:
+        _write_png(sheet.image, target)
+    return sheet
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m mb100t01.images.thumbnails",
+        description="Write a contact sheet of the images in a directory.",
+    )
+    parser.add_argument("directory", help="directory of images")
+    parser.add_argument("output", help="PNG file to write the sheet to")
+    parser.add_argument("--pattern", default="*.tif*", help="image file name pattern")
+    parser.add_argument("--size", type=int, default=128, help="preview size in pixels")
+    parser.add_argument("--columns", type=int, help="cells per row")
+    parser.add_argument("--range", type=float, nargs=2, metavar=("LOW", "HIGH"),
+                        help="fixed intensity range instead of per-image percentiles")
+    parser.add_argument("-j", "--workers", type=int, help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    sheet = contact_sheet(
+        image_files(args.directory, args.pattern), size=args.size, columns=args.columns,
+        intensity_range=args.range, workers=args.workers,
+    )
+    sheet.save(args.output)
+    print(f"{len(sheet.names)} images in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
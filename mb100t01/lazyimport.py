@@ -0,0 +1,271 @@
+"""Deferred imports for faster notebook kernel startup.
+
+The notebooks import pandas, seaborn, scipy.stats, statsmodels,
+scikit_posthocs, statannotations, skimage and pivottablejs in their first
+cell, although most cells use only a fraction of them. After
+:func:`install`, a listed module is registered in ``sys.modules`` without
+running its code; it is actually imported on first attribute access, so
+the unchanged ``import seaborn as sns`` statements in the notebook become
+cheap. The time spent importing each module, when it finally happens, is
+recorded and available from :func:`import_report`::
+
+    import sys
+    sys.path.append("../..")
+    from mb100t01 import lazyimport
+    lazyimport.install()
+
+    import seaborn as sns          # nothing imported yet
+    sns.histplot(...)              # seaborn is imported here
+
+``from module import name`` still imports ``module`` right away, because
+the name has to be looked up. ``from scipy import stats`` stays lazy.
+
+Run ``python -m mb100t01.lazyimport <book_dir>`` to compare kernel-ready
+times of the notebooks with and without the shim, and
+``python -m mb100t01.lazyimport --importtime seaborn`` for a
+``-X importtime`` breakdown of single modules.
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib
+import importlib.machinery
+import importlib.util
+import subprocess
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# imported by the notebooks but not needed by most of their cells
+DEFAULT_MODULES = (
+    "seaborn",
+    "scipy.stats",
+    "statsmodels.api",
+    "statsmodels.stats.multicomp",
+    "scikit_posthocs",
+    "statannotations.Annotator",
+    "skimage.io",
+    "pivottablejs",
+    "watermark",
+)
+
+# seconds spent executing each lazily imported module, including the
+# imports it triggered
+IMPORT_TIMES: Dict[str, float] = {}
+
+
+class _TimedLoader:
+    """Wrap a loader to record how long executing the module takes."""
+
+    def __init__(self, loader, name: str):
+        self._loader = loader
+        self._name = name
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            IMPORT_TIMES[self._name] = time.perf_counter() - start
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class _LazyModule(importlib.util._LazyModule):
+    """A lazy module whose ``__spec__`` can be read without loading it.
+
+    The ``import`` statement reads ``module.__spec__`` of modules already in
+    ``sys.modules``, which would otherwise load them on the spot.
+    """
+
+    def __getattribute__(self, attr):
+        if attr == "__spec__":
+            return object.__getattribute__(self, "__dict__")["__spec__"]
+        return super().__getattribute__(attr)
+
+
+class _LazyLoader(importlib.util.LazyLoader):
+    def exec_module(self, module):
+        super().exec_module(module)
+        module.__class__ = _LazyModule
+
+
+def lazy_import(name: str):
+    """Return module ``name``, deferring its execution until first attribute access.
+
+    Already imported modules are returned as they are. Missing modules
+    raise ``ModuleNotFoundError`` right away, not on first use.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    parent, _, child = name.rpartition(".")
+    if parent:
+        # importlib.util.find_spec would import the parent package for its
+        # __path__; make the parent lazy too and search its locations directly
+        parent_module = lazy_import(parent)
+        locations = parent_module.__spec__.submodule_search_locations
+        spec = importlib.machinery.PathFinder.find_spec(name, locations) if locations else None
+    else:
+        spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    if spec.loader is None or not hasattr(spec.loader, "exec_module"):
+        return importlib.import_module(name)
+    spec.loader = _LazyLoader(_TimedLoader(spec.loader, name))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    # as the import system does, bind the submodule on its parent so that
+    # "from scipy import stats" finds it without loading it
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+def install(modules: Iterable[str] = DEFAULT_MODULES) -> List[str]:
+    """Register ``modules`` for lazy loading; return those that are installed.
+
+    Modules that are not installed are skipped, so a notebook can call this
+    unconditionally and fail only where it really uses a missing module.
+    """
+    registered = []
+    for name in modules:
+        try:
+            lazy_import(name)
+        except ModuleNotFoundError:
+            continue
+        registered.append(name)
+    return registered
+
+
+def import_report() -> List[Tuple[str, float]]:
+    """Return ``(module, seconds)`` for every lazily imported module used so far, slowest first."""
+    return sorted(IMPORT_TIMES.items(), key=lambda item: item[1], reverse=True)
+
+
+def importtime(module: str, python: str = sys.executable) -> List[Tuple[str, float, float]]:
+    """Run ``python -X importtime -c "import module"`` in a fresh interpreter.
+
+    Returns
+    -------
+    list of tuple
+        ``(module, self_seconds, cumulative_seconds)`` for every module
+        imported, sorted by cumulative time, slowest first.
+    """
+    completed = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+
+def _leading_import_cells(notebook) -> List[str]:
+    """Return the code cells before the first one doing more than importing."""
+    import ast
+
+    cells = []
+    for cell in notebook.cells:
+        if cell.cell_type != "code":
+            continue
+        lines = [line for line in cell.source.splitlines()
+                 if line.strip() and not line.lstrip().startswith(("#", "%", "!"))]
+        try:
+            tree = ast.parse("\n".join(lines))
+        except SyntaxError:
+            break
+        if not all(isinstance(node, (ast.Import, ast.ImportFrom)) for node in tree.body):
+            break
+        if tree.body:
+            cells.append("\n".join(lines))
+    return cells
+
+
+def kernel_ready_time(
+    notebook_path: str,
+    lazy: bool,
+    repo_root: str,
+    modules: Sequence[str] = DEFAULT_MODULES,
+    kernel_name: Optional[str] = None,
+) -> float:
+    """Seconds from starting a kernel until the notebook's import cells have run.
+
+    With ``lazy`` the shim is installed first, exactly as a notebook would
+    do in its first cell.
+    """
+    import nbformat
+    from jupyter_client.manager import start_new_kernel
+
+    content = nbformat.read(notebook_path, as_version=4)
+    code = "\n".join(_leading_import_cells(content))
+    if lazy:
+        code = (
+            f"import sys; sys.path.insert(0, {repo_root!r})\n"
+            f"from mb100t01 import lazyimport; lazyimport.install({list(modules)!r})\n"
+            + code
+        )
+    start = time.perf_counter()
+    manager, client = start_new_kernel(
+        kernel_name=kernel_name or content.metadata.get("kernelspec", {}).get("name", "python3")
+    )
+    try:
+        reply = client.execute_interactive(code, timeout=600, output_hook=lambda msg: None)
+        elapsed = time.perf_counter() - start
+        if reply["content"]["status"] != "ok":
+            raise RuntimeError(f"{notebook_path}: {reply['content'].get('evalue')}")
+    finally:
+        client.stop_channels()
+        manager.shutdown_kernel(now=True)
+    return elapsed
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m mb100t01.lazyimport",
+        description="Measure notebook kernel-ready times with and without lazy imports.",
+    )
+    parser.add_argument("book_dir", nargs="?", help="directory with _toc.yml")
+    parser.add_argument("notebooks", nargs="*", help="notebooks to measure (default: all in the toc)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per variant; the best is kept")
+    parser.add_argument("--importtime", metavar="MODULE", action="append", default=[],
+                        help="print a -X importtime breakdown of MODULE and exit")
+    parser.add_argument("--top", type=int, default=15, help="rows of --importtime output")
+    args = parser.parse_args(argv)
+
+    for module in args.importtime:
+        print(f"{module}:")
+        for name, self_seconds, cumulative in importtime(module)[: args.top]:
+            print(f"  {cumulative * 1000:8.1f} ms cumulative  {self_seconds * 1000:7.1f} ms self  {name}")
+    if args.importtime:
+        return 0
+    if args.book_dir is None:
+        parser.error("book_dir is required unless --importtime is given")
+
+    from pathlib import Path
+
+    from .book.sources import toc_notebooks
+
+    repo_root = str(Path(__file__).resolve().parent.parent)
+    notebooks = args.notebooks or [str(path) for path in toc_notebooks(args.book_dir)]
+    print(f"{'eager':>8} {'lazy':>8}  notebook")
+    for notebook in notebooks:
+        timings = [
+            min(kernel_ready_time(notebook, lazy, repo_root) for _ in range(args.repeat))
+            for lazy in (False, True)
+        ]
+        print(f"{timings[0]:7.2f}s {timings[1]:7.2f}s  {notebook}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
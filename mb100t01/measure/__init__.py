@@ -0,0 +1,16 @@
+"""Measurements of segmented objects for tables like ``BBBC007_analysis.csv``.
+
+:mod:`mb100t01.measure.tiled` segments and measures images larger than
+memory; it runs as a script with ``python -m``.
+"""
+
+from .feret import FERET_PROPERTIES, feret_table
+from .regionprops import ALIASES, PROPERTIES, regionprops_table
+
+__all__ = [
+    "ALIASES",
+    "FERET_PROPERTIES",
+    "PROPERTIES",
+    "feret_table",
+    "regionprops_table",
+]
@@ -0,0 +1,271 @@
+"""Measuring every object of a label image at once.
+
+The columns of ``BBBC007_analysis.csv`` and ``blobs_statistics.csv`` come
+from ``skimage.measure.regionprops``, which builds a Python object per
+label and computes each property from that label's crop. With 10**5
+labels that loop dominates. :func:`regionprops_table` computes the same
+numbers for all labels together: one pass collects the foreground pixels,
+``np.bincount`` sums their counts, coordinates, products of coordinates
+and intensities per label, and the shape properties follow from those
+moments with array arithmetic. Bounding boxes come from
+``scipy.ndimage.find_objects``, a single pass in C.
+
+The result is a dict of columns named as by
+``skimage.measure.regionprops_table``, so it drops into ``pd.DataFrame``::
+
+    from mb100t01.measure import regionprops_table
+    table = pd.DataFrame(regionprops_table(labels, image, properties=(
+        "label", "area", "intensity_mean", "axis_major_length", "axis_minor_length")))
+
+Values agree with skimage to floating point precision, except for the
+``feret_*`` properties: they are measured on the object's own outline,
+while skimage measures the outline of its rasterized convex hull, and
+``feret_diameter_max`` differs from skimage's by up to about 0.7 px (see
+:mod:`mb100t01.measure.feret`). Only 2D label images are supported.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterable, Optional, Sequence
+
+import numpy as np
+
+from .feret import FERET_PROPERTIES, feret_table
+
+PROPERTIES = (
+    "label",
+    "area",
+    "area_bbox",
+    "bbox",
+    "centroid",
+    "axis_major_length",
+    "axis_minor_length",
+    "aspect_ratio",
+    "eccentricity",
+    "orientation",
+    "extent",
+    "equivalent_diameter_area",
+    "intensity_mean",
+    "intensity_min",
+    "intensity_max",
+    "intensity_std",
+    "feret_diameter_max",
+    "feret_diameter_min",
+    "feret_angle_max",
+    "feret_angle_min",
+)
+
+# older skimage names, as used in blobs_statistics.csv
+ALIASES = {
+    "major_axis_length": "axis_major_length",
+    "minor_axis_length": "axis_minor_length",
+    "mean_intensity": "intensity_mean",
+    "min_intensity": "intensity_min",
+    "max_intensity": "intensity_max",
+    "equivalent_diameter": "equivalent_diameter_area",
+    "bbox_area": "area_bbox",
+}
+
+_INTENSITY = {"intensity_mean", "intensity_min", "intensity_max", "intensity_std"}
+
+
+class _Moments:
+    """Per-label sums over the foreground pixels, computed once and shared."""
+
+    def __init__(self, labels: np.ndarray, intensity: Optional[np.ndarray]):
+        if labels.ndim != 2:
+            raise ValueError(f"labels must be 2D, got {labels.ndim} dimensions")
+        if intensity is not None and intensity.shape != labels.shape:
+            raise ValueError(f"intensity image shape {intensity.shape} differs from {labels.shape}")
+        self.labels = labels
+        flat = labels.ravel()
+        foreground = np.flatnonzero(flat)
+        values = flat[foreground]
+        if values.size and values.min() < 0:
+            raise ValueError("labels must not be negative")
+        self.present = np.unique(values) if values.size and values.max() > flat.size else None
+        if self.present is not None:
+            # sparse large label values; bincount over the dense ranks instead
+            values = np.searchsorted(self.present, values)
+        self.values = values.astype(np.intp, copy=False)
+        self.n_bins = int(self.values.max()) + 1 if self.values.size else 1
+        self.foreground = foreground
+        self.rows, self.columns = np.divmod(foreground, labels.shape[1])
+        self.intensity = None if intensity is None else intensity.ravel()[foreground]
+        self.count = self.sum()
+        self.index = np.flatnonzero(self.count)
+        if self.present is None:
+            self.index = self.index[self.index > 0]
+
+    def sum(self, weights: Optional[np.ndarray] = None) -> np.ndarray:
+        return np.bincount(self.values, weights=weights, minlength=self.n_bins)
+
+    def extreme(self, data: np.ndarray, function) -> np.ndarray:
+        initial = np.inf if function is np.minimum else -np.inf
+        result = np.full(self.n_bins, initial)
+        function.at(result, self.values, data)
+        return result
+
+    def bbox(self) -> np.ndarray:
+        """Return (min row, min column, max row + 1, max column + 1) per label."""
+        from scipy.ndimage import find_objects
+
+        if self.present is None:
+            objects = find_objects(self.labels)
+            slices = [objects[label - 1] for label in self.index]
+        else:
+            ranks = np.zeros(self.labels.shape, dtype=np.intp)
+            ranks.flat[self.foreground] = self.values + 1
+            objects = find_objects(ranks)
+            slices = [objects[rank] for rank in self.index]
+        box = np.array(
+            [(rows.start, columns.start, rows.stop, columns.stop) for rows, columns in slices],
+            dtype=np.intp,
+        )
+        return box.reshape(-1, 4).T
+
+    def label(self) -> np.ndarray:
+        return self.index if self.present is None else self.present[self.index]
+
+    def second_moments(self, centroid: np.ndarray):
+        """Return mu_rr, mu_cc and mu_rc per label about ``centroid``, divided by the area."""
+        # coordinates are taken relative to the centroid before squaring to
+        # avoid cancellation on large images
+        center = np.zeros((2, self.n_bins))
+        center[:, self.index] = centroid
+        dr = self.rows - center[0][self.values]
+        dc = self.columns - center[1][self.values]
+        area = self.count[self.index]
+        return (
+            self.sum(dr * dr)[self.index] / area,
+            self.sum(dc * dc)[self.index] / area,
+            self.sum(dr * dc)[self.index] / area,
+        )
+
+
+def _inertia(mu_rr: np.ndarray, mu_cc: np.ndarray, mu_rc: np.ndarray):
+    """Return the inertia tensor eigenvalues (larger first) and tensor entries."""
+    # inertia tensor as in skimage: [[mu_cc, -mu_rc], [-mu_rc, mu_rr]]
+    a, b, c = mu_cc, -mu_rc, mu_rr
+    half_trace = (a + c) / 2
+    root = np.sqrt(((a - c) / 2) ** 2 + b ** 2)
+    eigenvalues = (np.clip(half_trace + root, 0, None), np.clip(half_trace - root, 0, None))
+    return eigenvalues, (a, b, c)
+
+
+def _columns(moments: _Moments, properties: Sequence[str]) -> Dict[str, np.ndarray]:
+    index = moments.index
+    area = moments.count[index].astype(float)
+    cache: Dict[str, np.ndarray] = {}
+
+    def bbox():
+        if "bbox" not in cache:
+            cache["bbox"] = moments.bbox()
+        return cache["bbox"]
+
+    def centroid():
+        if "centroid" not in cache:
+            cache["centroid"] = np.stack([
+                moments.sum(moments.rows)[index] / area,
+                moments.sum(moments.columns)[index] / area,
+            ])
+        return cache["centroid"]
+
+    def eigenvalues():
+        if "eigenvalues" not in cache:
+            cache["eigenvalues"], cache["tensor"] = _inertia(*moments.second_moments(centroid()))
+        return cache["eigenvalues"]
+
+    def intensity_sums():
+        if moments.intensity is None:
+            raise ValueError("intensity properties need an intensity image")
+        if "intensity_mean" not in cache:
+            weights = moments.intensity.astype(float)
+            cache["intensity_mean"] = moments.sum(weights)[index] / area
+            cache["intensity_square"] = moments.sum(weights * weights)[index] / area
+        return cache["intensity_mean"], cache["intensity_square"]
+
+    columns: Dict[str, np.ndarray] = {}
+    for requested in properties:
+        name = ALIASES.get(requested, requested)
+        if name == "label":
+            columns[requested] = moments.label()
+        elif name == "area":
+            columns[requested] = area
+        elif name == "bbox":
+            for axis, values in enumerate(bbox()):
+                columns[f"{requested}-{axis}"] = values
+        elif name == "area_bbox":
+            box = bbox()
+            columns[requested] = ((box[2] - box[0]) * (box[3] - box[1])).astype(float)
+        elif name == "centroid":
+            for axis, values in enumerate(centroid()):
+                columns[f"{requested}-{axis}"] = values
+        elif name == "axis_major_length":
+            columns[requested] = 4 * np.sqrt(eigenvalues()[0])
+        elif name == "axis_minor_length":
+            columns[requested] = 4 * np.sqrt(eigenvalues()[1])
+        elif name == "aspect_ratio":
+            major, minor = eigenvalues()
+            with np.errstate(divide="ignore", invalid="ignore"):
+                columns[requested] = np.sqrt(major / minor)
+        elif name == "eccentricity":
+            major, minor = eigenvalues()
+            with np.errstate(divide="ignore", invalid="ignore"):
+                columns[requested] = np.where(major == 0, 0.0, np.sqrt(1 - minor / major))
+        elif name == "orientation":
+            eigenvalues()
+            a, b, c = cache["tensor"]
+            diagonal = np.where(b < 0, np.pi / 4, -np.pi / 4)
+            columns[requested] = np.where(a - c == 0, diagonal, 0.5 * np.arctan2(-2 * b, c - a))
+        elif name == "extent":
+            box = bbox()
+            columns[requested] = area / ((box[2] - box[0]) * (box[3] - box[1]))
+        elif name == "equivalent_diameter_area":
+            columns[requested] = np.sqrt(4 * area / np.pi)
+        elif name in _INTENSITY:
+            mean, square = intensity_sums()
+            if name == "intensity_mean":
+                columns[requested] = mean
+            elif name == "intensity_std":
+                columns[requested] = np.sqrt(np.clip(square - mean ** 2, 0, None))
+            else:
+                function = np.minimum if name == "intensity_min" else np.maximum
+                columns[requested] = moments.extreme(moments.intensity.astype(float), function)[index]
+        elif name in FERET_PROPERTIES:
+            if "feret" not in cache:
+                cache["feret"] = feret_table(moments.labels)
+            columns[requested] = cache["feret"][name]
+        else:
+            raise ValueError(f"Unknown property {requested!r}; choose from {', '.join(PROPERTIES)}")
+    return columns
+
+
+def regionprops_table(
+    labels: np.ndarray,
+    intensity_image: Optional[np.ndarray] = None,
+    properties: Iterable[str] = ("label", "bbox"),
+) -> Dict[str, np.ndarray]:
+    """Measure every label of ``labels`` at once.
+
+    Parameters
+    ----------
+    labels : numpy.ndarray
+        2D integer label image; 0 is background.
+    intensity_image : numpy.ndarray, optional
+        Image of the same shape, needed for the ``intensity_*`` properties.
+    properties : iterable of str
+        Names from :data:`PROPERTIES`, or the older names in
+        :data:`ALIASES`. ``aspect_ratio`` is ``axis_major_length /
+        axis_minor_length`` as in ``BBBC007_analysis.csv``. The Feret
+        properties come from :func:`~mb100t01.measure.feret.feret_table`.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        One entry per property and label, in increasing label order;
+        ``bbox`` and ``centroid`` are split into ``bbox-0`` ... columns.
+    """
+    properties = list(properties)
+    moments = _Moments(np.asarray(labels), None if intensity_image is None else np.asarray(intensity_image))
+    return _columns(moments, properties)
@@ -0,0 +1,436 @@
+"""Threshold, label and measure images larger than memory, tile by tile.
+
+``00_Intro_matplotlib`` reads each ``data/BBBC007_batch`` image whole,
+and a segmentation built on it would assume the whole image fits in
+memory. A stitched plate does not. :func:`segment_tiled` splits the image
+into ``tile_size`` tiles and processes them in a process pool:
+
+1. Each worker reads its tile plus a ``halo`` of neighbouring pixels,
+   smooths it (the halo makes the result identical to smoothing the whole
+   image), thresholds and labels the tile, writes the tile's labels to
+   the output file and returns the labels along its four edges and
+   mergeable partial moments of each of its objects.
+2. The parent numbers the tile labels globally and joins the labels that
+   touch across tile borders with union-find over the edge pixels.
+3. The workers renumber their tiles to the final, consecutive labels.
+
+The partial moments of the pieces of an object that spans several tiles
+are merged, so each object gets exactly one row in the measurement
+table, as if the whole image had been measured at once. At any time a
+worker holds one tile with its halo and the parent only tile edges and
+per-object rows, so peak memory is about ``(tile_size + 2 * halo) ** 2
+* 40`` bytes per worker, whatever the image size.
+
+The image can be a ``.npy`` file, an uncompressed TIFF, a pyramid
+directory written by :func:`mb100t01.images.build_pyramid`, or a
+``numpy.memmap``; in-memory arrays are processed in threads instead::
+
+    result = segment_tiled("plate.npy", "plate_labels.npy", sigma=1, workers=8)
+    result.table.plot.scatter("centroid-1", "centroid-0")
+
+or from the command line::
+
+    python -m mb100t01.measure.tiled plate.npy --labels plate_labels.npy --sigma 1 --table plate.csv
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .regionprops import _inertia, _Moments
+
+# histogram bins for the Otsu threshold of the whole image
+_THRESHOLD_BINS = 1024
+
+
+@dataclass
+class TiledSegmentation:
+    """Result of :func:`segment_tiled`.
+
+    Attributes
+    ----------
+    labels : numpy.memmap or None
+        Label image, memory-mapped from the output file, if one was given.
+    table : pandas.DataFrame
+        One row per object with ``label``, ``area``, ``centroid-0/1``,
+        ``bbox-0..3``, ``axis_major_length``, ``axis_minor_length``,
+        ``eccentricity`` and ``intensity_mean/min/max`` (of the unsmoothed
+        image).
+    threshold : float
+        Threshold that was applied to the smoothed image.
+    tiles : tuple of int
+        Number of tile rows and columns.
+    """
+
+    labels: Optional[np.ndarray]
+    table: pd.DataFrame
+    threshold: float
+    tiles: Tuple[int, int]
+
+
+def _source(image) -> Tuple[object, bool]:
+    """Return a picklable description of ``image`` and whether workers can reopen it."""
+    if isinstance(image, (str, Path)):
+        return str(image), True
+    if isinstance(image, np.memmap) and image.filename is not None and image.flags.c_contiguous:
+        return ("memmap", image.filename, image.dtype.str, image.shape, image.offset), True
+    return image, False
+
+
+def _open(source):
+    """Open a description from :func:`_source` as something that slices like an array."""
+    from ..images import ImagePyramid
+
+    if isinstance(source, tuple):
+        _, filename, dtype, shape, offset = source
+        return np.memmap(filename, dtype=dtype, mode="r", shape=shape, offset=offset)
+    if not isinstance(source, str):
+        return source
+    path = Path(source)
+    if path.is_dir():
+        return ImagePyramid(path)
+    if path.suffix == ".npy":
+        return np.load(path, mmap_mode="r")
+    if path.suffix in (".tif", ".tiff"):
+        import tifffile
+
+        return tifffile.memmap(path, mode="r")
+    raise ValueError(f"Cannot memory-map {source}; use a .npy, uncompressed .tif or pyramid directory")
+
+
+def _shape(image) -> Tuple[int, int]:
+    shape = tuple(image.shape)
+    if len(shape) != 2:
+        raise ValueError(f"Expected a 2D image, got shape {shape}")
+    return shape
+
+
+def _read(image, rows: Tuple[int, int], columns: Tuple[int, int]) -> np.ndarray:
+    if hasattr(image, "read_region"):
+        return image.read_region(0, rows, columns)
+    return np.asarray(image[rows[0]:rows[1], columns[0]:columns[1]])
+
+
+def _tile_bounds(shape, tile_size: int, ty: int, tx: int):
+    rows = (ty * tile_size, min((ty + 1) * tile_size, shape[0]))
+    columns = (tx * tile_size, min((tx + 1) * tile_size, shape[1]))
+    return rows, columns
+
+
+def _smoothed(image, shape, rows, columns, halo: int, sigma: float) -> np.ndarray:
+    """Read a tile with its halo, smooth it and return the tile without the halo."""
+    from scipy.ndimage import gaussian_filter
+
+    top, left = max(rows[0] - halo, 0), max(columns[0] - halo, 0)
+    bottom, right = min(rows[1] + halo, shape[0]), min(columns[1] + halo, shape[1])
+    block = _read(image, (top, bottom), (left, right)).astype(np.float32)
+    if sigma > 0:
+        block = gaussian_filter(block, sigma)
+    return block[rows[0] - top:rows[1] - top, columns[0] - left:columns[1] - left]
+
+
+def _tile_range(source, tile_size: int, ty: int, tx: int) -> Tuple[float, float]:
+    image = _open(source)
+    rows, columns = _tile_bounds(_shape(image), tile_size, ty, tx)
+    block = _read(image, rows, columns)
+    return float(block.min()), float(block.max())
+
+
+def _tile_histogram(source, tile_size, halo, sigma, bins, ty, tx) -> np.ndarray:
+    image = _open(source)
+    shape = _shape(image)
+    rows, columns = _tile_bounds(shape, tile_size, ty, tx)
+    block = _smoothed(image, shape, rows, columns, halo, sigma)
+    return np.histogram(block, bins=bins)[0]
+
+
+def _label_tile(source, output, tile_size, halo, sigma, threshold, connectivity, ty, tx) -> Dict:
+    """Segment one tile; write its local labels to ``output`` and return edges and moments."""
+    from scipy.ndimage import generate_binary_structure, label
+
+    image = _open(source)
+    shape = _shape(image)
+    rows, columns = _tile_bounds(shape, tile_size, ty, tx)
+    smoothed = _smoothed(image, shape, rows, columns, halo, sigma)
+    local, count = label(smoothed > threshold, structure=generate_binary_structure(2, connectivity))
+    local = local.astype(np.uint32)
+    del smoothed
+    if output is not None:
+        labels = np.load(output, mmap_mode="r+")
+        labels[rows[0]:rows[1], columns[0]:columns[1]] = local
+        labels.flush()
+        del labels
+
+    moments = _Moments(local, _read(image, rows, columns))
+    area = moments.count[moments.index].astype(float)
+    centroid = np.stack([moments.sum(moments.rows)[moments.index], moments.sum(moments.columns)[moments.index]]) / area
+    mu_rr, mu_cc, mu_rc = moments.second_moments(centroid)
+    intensity = moments.intensity.astype(float)
+    bbox = moments.bbox()
+    return {
+        "count": count,
+        "edges": (local[0].copy(), local[-1].copy(), local[:, 0].copy(), local[:, -1].copy()),
+        "partial": {
+            "label": moments.index,
+            "area": area,
+            "row": centroid[0] + rows[0],
+            "column": centroid[1] + columns[0],
+            # second moments summed rather than averaged, so pieces add up
+            "m_rr": mu_rr * area,
+            "m_cc": mu_cc * area,
+            "m_rc": mu_rc * area,
+            "bbox_top": bbox[0] + rows[0],
+            "bbox_left": bbox[1] + columns[0],
+            "bbox_bottom": bbox[2] + rows[0],
+            "bbox_right": bbox[3] + columns[0],
+            "intensity_sum": moments.sum(intensity)[moments.index],
+            "intensity_min": moments.extreme(intensity, np.minimum)[moments.index],
+            "intensity_max": moments.extreme(intensity, np.maximum)[moments.index],
+        },
+    }
+
+
+def _relabel_tile(output, tile_size, lut, ty, tx) -> None:
+    """Replace the local labels of one tile in ``output`` by their final labels."""
+    labels = np.load(output, mmap_mode="r+")
+    rows, columns = _tile_bounds(labels.shape, tile_size, ty, tx)
+    block = labels[rows[0]:rows[1], columns[0]:columns[1]]
+    block[...] = lut[block]
+    labels.flush()
+
+
+def _find(parent: np.ndarray) -> np.ndarray:
+    """Point every element of a union-find forest directly at its root."""
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            return parent
+        parent = grandparent
+
+
+def _union_find(n: int, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Return the root of each of ``n`` elements after joining the pairs ``a``, ``b``."""
+    parent = np.arange(n)
+    while True:
+        parent = _find(parent)
+        root_a, root_b = parent[a], parent[b]
+        differ = root_a != root_b
+        if not differ.any():
+            return parent
+        # hook the larger root under the smaller; roots hooked twice keep the
+        # smallest and the other pairs are joined in the next round
+        np.minimum.at(parent, np.maximum(root_a, root_b)[differ], np.minimum(root_a, root_b)[differ])
+
+
+def _seam_pairs(first: np.ndarray, second: np.ndarray, connectivity: int):
+    """Pairs of labels that touch across a seam between two lines of pixels."""
+    pairs = [(first, second)]
+    if connectivity == 2:
+        pairs += [(first[:-1], second[1:]), (first[1:], second[:-1])]
+    for a, b in pairs:
+        touching = (a > 0) & (b > 0)
+        yield a[touching], b[touching]
+
+
+def _merge(partial: pd.DataFrame) -> pd.DataFrame:
+    """Combine the partial moments of the pieces of each object into one row."""
+    groups = partial.groupby("label", sort=True)
+    area = groups["area"].sum()
+    row = (partial["row"] * partial["area"]).groupby(partial["label"]).sum() / area
+    column = (partial["column"] * partial["area"]).groupby(partial["label"]).sum() / area
+    # parallel axis theorem: shift each piece's moments to the object centroid
+    dr = partial["row"] - row.reindex(partial["label"]).to_numpy()
+    dc = partial["column"] - column.reindex(partial["label"]).to_numpy()
+    shifted = pd.DataFrame({
+        "label": partial["label"],
+        "m_rr": partial["m_rr"] + partial["area"] * dr * dr,
+        "m_cc": partial["m_cc"] + partial["area"] * dc * dc,
+        "m_rc": partial["m_rc"] + partial["area"] * dr * dc,
+    }).groupby("label").sum()
+    (major, minor), _ = _inertia(
+        (shifted["m_rr"] / area).to_numpy(),
+        (shifted["m_cc"] / area).to_numpy(),
+        (shifted["m_rc"] / area).to_numpy(),
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        eccentricity = np.where(major == 0, 0.0, np.sqrt(1 - minor / major))
+    return pd.DataFrame({
+        "label": area.index.to_numpy(),
+        "area": area.to_numpy(),
+        "centroid-0": row.to_numpy(),
+        "centroid-1": column.to_numpy(),
+        "bbox-0": groups["bbox_top"].min().to_numpy(),
+        "bbox-1": groups["bbox_left"].min().to_numpy(),
+        "bbox-2": groups["bbox_bottom"].max().to_numpy(),
+        "bbox-3": groups["bbox_right"].max().to_numpy(),
+        "axis_major_length": 4 * np.sqrt(major),
+        "axis_minor_length": 4 * np.sqrt(minor),
+        "eccentricity": eccentricity,
+        "intensity_mean": (groups["intensity_sum"].sum() / area).to_numpy(),
+        "intensity_min": groups["intensity_min"].min().to_numpy(),
+        "intensity_max": groups["intensity_max"].max().to_numpy(),
+    })
+
+
+def segment_tiled(
+    image: Union[np.ndarray, str, Path],
+    output: Optional[Union[str, Path]] = None,
+    tile_size: int = 2048,
+    sigma: float = 0.0,
+    halo: Optional[int] = None,
+    threshold: Optional[float] = None,
+    connectivity: int = 2,
+    workers: Optional[int] = None,
+) -> TiledSegmentation:
+    """Threshold, label and measure a large 2D image in parallel tiles.
+
+    Parameters
+    ----------
+    image : numpy.ndarray or path
+        ``.npy`` file, uncompressed TIFF or pyramid directory, or an array;
+        see the module docstring.
+    output : str or pathlib.Path, optional
+        ``.npy`` file to write the ``uint32`` label image to. Without it
+        objects are only measured.
+    tile_size : int
+        Edge length of the square tiles each worker processes at once.
+    sigma : float
+        Standard deviation of the Gaussian smoothing before thresholding;
+        0 to threshold the image as it is.
+    halo : int, optional
+        Pixels read around each tile. Defaults to the smoothing kernel
+        radius, which makes tiled and whole-image smoothing identical.
+    threshold : float, optional
+        Pixels of the smoothed image above it are foreground. Defaults to
+        Otsu's threshold of the whole smoothed image, computed from a
+        histogram gathered tile by tile.
+    connectivity : int
+        1 joins pixels sharing an edge, 2 also diagonal neighbours, as in
+        ``skimage.measure.label``.
+    workers : int, optional
+        Number of worker processes; defaults to the number of CPUs.
+
+    Returns
+    -------
+    TiledSegmentation
+    """
+    source, reopenable = _source(image)
+    shape = _shape(_open(source))
+    if connectivity not in (1, 2):
+        raise ValueError(f"connectivity must be 1 or 2, got {connectivity}")
+    if halo is None:
+        # scipy's gaussian_filter truncates the kernel at 4 sigma
+        halo = int(4 * sigma + 0.5) if sigma > 0 else 0
+    grid = (-(-shape[0] // tile_size), -(-shape[1] // tile_size))
+    tiles = [(ty, tx) for ty in range(grid[0]) for tx in range(grid[1])]
+    workers = workers or os.cpu_count() or 1
+    if output is not None:
+        output = str(output)
+        np.lib.format.open_memmap(output, mode="w+", dtype=np.uint32, shape=shape).flush()
+
+    executor = ProcessPoolExecutor if reopenable else ThreadPoolExecutor
+    with executor(max_workers=workers) as pool:
+
+        def run(function, *arguments) -> List:
+            columns = list(zip(*tiles))
+            constant = [[argument] * len(tiles) for argument in arguments]
+            return list(pool.map(function, *constant, *columns))
+
+        if threshold is None:
+            from skimage.filters import threshold_otsu
+
+            ranges = np.array(run(_tile_range, source, tile_size))
+            bins = np.linspace(ranges[:, 0].min(), ranges[:, 1].max(), _THRESHOLD_BINS + 1)
+            counts = np.sum(run(_tile_histogram, source, tile_size, halo, sigma, bins), axis=0)
+            threshold = float(threshold_otsu(hist=(counts, (bins[:-1] + bins[1:]) / 2)))
+
+        results = run(_label_tile, source, output, tile_size, halo, sigma, threshold, connectivity)
+
+        # number the tile labels globally; 0 stays background
+        offsets = np.cumsum([0] + [result["count"] for result in results])
+        edges = {}
+        for (ty, tx), result, offset in zip(tiles, results, offsets):
+            edges[ty, tx] = [np.where(edge > 0, edge.astype(np.int64) + offset, 0) for edge in result["edges"]]
+        pairs_a, pairs_b = [], []
+        for ty in range(grid[0] - 1):
+            bottom = np.concatenate([edges[ty, tx][1] for tx in range(grid[1])])
+            top = np.concatenate([edges[ty + 1, tx][0] for tx in range(grid[1])])
+            for a, b in _seam_pairs(bottom, top, connectivity):
+                pairs_a.append(a)
+                pairs_b.append(b)
+        for tx in range(grid[1] - 1):
+            right = np.concatenate([edges[ty, tx][3] for ty in range(grid[0])])
+            left = np.concatenate([edges[ty, tx + 1][2] for ty in range(grid[0])])
+            for a, b in _seam_pairs(right, left, connectivity):
+                pairs_a.append(a)
+                pairs_b.append(b)
+        del edges
+        a = np.concatenate(pairs_a) if pairs_a else np.empty(0, dtype=np.int64)
+        b = np.concatenate(pairs_b) if pairs_b else np.empty(0, dtype=np.int64)
+        roots = _union_find(int(offsets[-1]) + 1, a, b)
+        # consecutive final labels in order of each object's first tile
+        _, final = np.unique(roots, return_inverse=True)
+        final = final.astype(np.uint32)
+
+        partial = pd.concat([
+            pd.DataFrame(result["partial"]).assign(label=lambda frame, offset=offset: final[frame["label"] + offset])
+            for result, offset in zip(results, offsets)
+        ], ignore_index=True)
+        del results
+        if output is not None:
+            lookups = [
+                np.r_[np.uint32(0), final[offsets[index] + 1:offsets[index + 1] + 1]]
+                for index in range(len(tiles))
+            ]
+            columns = list(zip(*tiles))
+            list(pool.map(_relabel_tile, [output] * len(tiles), [tile_size] * len(tiles), lookups, *columns))
+
+    return TiledSegmentation(
+        labels=None if output is None else np.load(output, mmap_mode="r"),
+        table=_merge(partial),
+        threshold=threshold,
+        tiles=grid,
+    )
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m mb100t01.measure.tiled",
+        description="Threshold, label and measure a large image tile by tile.",
+    )
+    parser.add_argument("image", help=".npy file, uncompressed TIFF or pyramid directory")
+    parser.add_argument("--labels", help="write the label image to this .npy file")
+    parser.add_argument("--table", help="write the measurements to this CSV file")
+    parser.add_argument("--tile-size", type=int, default=2048)
+    parser.add_argument("--sigma", type=float, default=0.0, help="Gaussian smoothing before thresholding")
+    parser.add_argument("--halo", type=int, help="pixels read around each tile")
+    parser.add_argument("--threshold", type=float, help="defaults to Otsu's threshold")
+    parser.add_argument("--connectivity", type=int, choices=(1, 2), default=2)
+    parser.add_argument("-j", "--workers", type=int, help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    result = segment_tiled(
+        args.image, args.labels, tile_size=args.tile_size, sigma=args.sigma, halo=args.halo,
+        threshold=args.threshold, connectivity=args.connectivity, workers=args.workers,
+    )
+    seconds = time.perf_counter() - start
+    print(f"{len(result.table)} objects above {result.threshold:.4g} in "
+          f"{result.tiles[0]} x {result.tiles[1]} tiles, {seconds:.1f}s")
+    if args.table:
+        result.table.to_csv(args.table, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,361 @@
+"""Process pool that passes arrays and tables through shared memory.
+
+Handing an image or a feature table to a ``ProcessPoolExecutor`` task
+pickles it, pushes it through a pipe and unpickles it in the worker, and
+large results travel back the same way; for a 1 GB plate that copying
+takes longer than most of the per-tile work. :class:`SharedPool` places
+arrays and DataFrame columns once in memory-mapped files on ``/dev/shm``
+(a RAM-backed file system; the system temporary directory elsewhere) and
+sends workers only small descriptors, :class:`SharedArray` and
+:class:`SharedFrame`, which the workers map without copying. A
+``numpy.memmap``, such as a ``.npy`` file opened with ``mmap_mode``, is
+shared as the file it maps, without any copy at all::
+
+    from mb100t01.parallel import SharedPool
+
+    def tile_mean(plate, top, left):
+        return plate[top:top + 1024, left:left + 1024].mean()
+
+    with SharedPool() as pool:
+        plate = pool.share(image)                     # one copy, under a second per GB
+        means = pool.map(tile_mean, [plate] * 16, tops, lefts)
+
+Arrays that workers return, alone or in tuples, lists and dicts, come
+back through shared files as well when they exceed ``return_bytes``,
+and workers can write into an output array made with
+:meth:`SharedPool.empty` directly. Other input arrays are mapped
+read-only, so no task can change the file behind them, which may be the
+user's own ``.npy``; copy an input before modifying it. Tables arrive
+with private copy-on-write columns. Workers keep up to 1 GB of arrays
+mapped, so later tasks on the same input map nothing; mappings of
+released or deleted files are dropped at the worker's next task.
+:func:`shared_pool` returns one pool per process that notebooks and
+pipelines can keep using; it is closed at exit.
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import shutil
+import tempfile
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+# results at least this large come back through shared files
+RETURN_BYTES = 1 << 20
+
+# bytes of arrays a worker keeps mapped between tasks
+_WORKER_CACHE_BYTES = 1 << 30
+
+_opened: "OrderedDict[Tuple, np.ndarray]" = OrderedDict()
+
+
+def _shared_directory() -> Optional[str]:
+    return "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+
+
+@dataclass(frozen=True)
+class SharedArray:
+    """Descriptor of an array in a shared file; pickles to a few hundred bytes."""
+
+    path: str
+    dtype: str
+    shape: Tuple[int, ...]
+    offset: int = 0
+    order: str = "C"
+    writable: bool = False
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+    def open(self, mode: Optional[str] = None) -> np.ndarray:
+        """Map the array; writes with ``mode="r+"`` are seen by every process.
+
+        ``mode`` defaults to ``"r+"`` for arrays made by
+        :meth:`SharedPool.empty` and to read-only ``"r"`` otherwise.
+        """
+        if mode is None:
+            mode = "r+" if self.writable else "r"
+        if not self.nbytes:
+            return np.empty(self.shape, dtype=self.dtype, order=self.order)
+        return np.memmap(self.path, dtype=self.dtype, mode=mode, offset=self.offset,
+                         shape=self.shape, order=self.order)
+
+
+@dataclass(frozen=True)
+class SharedFrame:
+    """Descriptor of a DataFrame whose numeric columns are :class:`SharedArray` s.
+
+    Other columns, and the index unless it is a default ``RangeIndex``,
+    are small enough in practice to be pickled with the descriptor.
+    """
+
+    columns: Tuple[Tuple[Any, Any], ...]
+    index: Any = None
+    length: int = 0
+    attributes: Dict = field(default_factory=dict)
+
+    def open(self, mode: str = "r") -> pd.DataFrame:
+        """The DataFrame; numeric columns share memory with the files."""
+        data = {name: column.open(mode) if isinstance(column, SharedArray) else column
+                for name, column in self.columns}
+        index = pd.RangeIndex(self.length) if self.index is None else self.index
+        frame = pd.DataFrame(data, index=index, columns=[name for name, _ in self.columns], copy=False)
+        frame.attrs.update(self.attributes)
+        return frame
+
+
+def _write(directory: str, array: np.ndarray) -> SharedArray:
+    """Copy ``array`` into a new shared file."""
+    array = np.asarray(array)
+    order = "F" if array.flags.f_contiguous and not array.flags.c_contiguous else "C"
+    block = SharedArray(os.path.join(directory, f"{uuid.uuid4().hex}.bin"), array.dtype.str, array.shape, 0, order)
+    if block.nbytes:
+        with open(block.path, "wb") as stream:
+            stream.truncate(block.nbytes)
+        block.open("r+")[...] = array
+    else:
+        Path(block.path).touch()
+    return block
+
+
+def _memmap_block(array: np.memmap) -> Optional[SharedArray]:
+    """Descriptor of the file a ``numpy.memmap`` maps, if the array is contiguous in it."""
+    import mmap
+
+    buffer = getattr(array, "_mmap", None)
+    if not array.filename or buffer is None or not (array.flags.c_contiguous or array.flags.f_contiguous):
+        return None
+    # the mapping starts at the offset rounded down to the allocation granularity
+    mapped_at = array.offset - array.offset % mmap.ALLOCATIONGRANULARITY
+    start = array.__array_interface__["data"][0] - np.frombuffer(buffer, np.uint8).__array_interface__["data"][0]
+    order = "C" if array.flags.c_contiguous else "F"
+    return SharedArray(array.filename, array.dtype.str, array.shape, mapped_at + start, order)
+
+
+def _prune_opened() -> None:
+    """Drop a worker's mappings of deleted files, which would keep their memory."""
+    for descriptor in [descriptor for descriptor in _opened if not os.path.exists(descriptor.path)]:
+        del _opened[descriptor]
+
+
+def _open(descriptor: SharedArray) -> np.ndarray:
+    """Map a descriptor in a worker, reusing earlier mappings."""
+    if descriptor in _opened:
+        _opened.move_to_end(descriptor)
+        return _opened[descriptor]
+    array = descriptor.open()
+    if descriptor.nbytes <= _WORKER_CACHE_BYTES:
+        _opened[descriptor] = array
+        while sum(cached.nbytes for cached in _opened) > _WORKER_CACHE_BYTES:
+            _opened.popitem(last=False)
+    return array
+
+
+def _resolve(value):
+    if isinstance(value, SharedArray):
+        return _open(value)
+    if isinstance(value, SharedFrame):
+        # private copy-on-write pages: workers may modify their table
+        return value.open("c")
+    if isinstance(value, tuple) and not hasattr(value, "_fields"):
+        return tuple(_resolve(item) for item in value)
+    if isinstance(value, list):
+        return [_resolve(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _resolve(item) for key, item in value.items()}
+    return value
+
+
+def _export(value, directory: str, threshold: int):
+    """Replace large arrays in a result by shared files."""
+    if isinstance(value, np.ndarray) and value.nbytes >= threshold and value.dtype.kind not in "OV":
+        return _write(directory, value)
+    if isinstance(value, pd.DataFrame) and value.memory_usage(index=False).sum() >= threshold:
+        return _share_frame(value, directory)
+    if isinstance(value, tuple) and not hasattr(value, "_fields"):
+        return tuple(_export(item, directory, threshold) for item in value)
+    if isinstance(value, list):
+        return [_export(item, directory, threshold) for item in value]
+    if isinstance(value, dict):
+        return {key: _export(item, directory, threshold) for key, item in value.items()}
+    return value
+
+
+def _import(value):
+    """Map the shared files of a result in the parent and delete them.
+
+    The mapping stays valid after the file is deleted, and its memory is
+    freed when the array is.
+    """
+    if isinstance(value, SharedArray):
+        array = value.open("r+")
+        os.unlink(value.path)
+        return array
+    if isinstance(value, SharedFrame):
+        frame = value.open("r+")
+        for _, column in value.columns:
+            if isinstance(column, SharedArray):
+                os.unlink(column.path)
+        return frame
+    if isinstance(value, tuple) and not hasattr(value, "_fields"):
+        return tuple(_import(item) for item in value)
+    if isinstance(value, list):
+        return [_import(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _import(item) for key, item in value.items()}
+    return value
+
+
+def _share_frame(frame: pd.DataFrame, directory: str) -> SharedFrame:
+    columns = []
+    for position, name in enumerate(frame.columns):
+        series = frame.iloc[:, position]
+        if series.dtype.kind in "biufcmM" and isinstance(series.dtype, np.dtype):
+            columns.append((name, _write(directory, series.to_numpy())))
+        else:
+            columns.append((name, series.to_numpy()))
+    index = frame.index
+    default = isinstance(index, pd.RangeIndex) and index.start == 0 and index.step == 1
+    return SharedFrame(tuple(columns), None if default else index, len(frame), dict(frame.attrs))
+
+
+def _run(function: Callable, args: tuple, kwargs: dict, directory: str, threshold: int):
+    """Run one task in a worker: map the inputs, export the result."""
+    _prune_opened()
+    result = function(*_resolve(args), **_resolve(kwargs))
+    return _export(result, directory, threshold)
+
+
+class SharedPool:
+    """Process pool whose tasks receive shared arrays and tables by descriptor.
+
+    Parameters
+    ----------
+    workers : int, optional
+        Worker processes; defaults to the number of CPUs.
+    directory : str or pathlib.Path, optional
+        Where the shared files go; defaults to a new directory on
+        ``/dev/shm``, removed by :meth:`close`.
+    return_bytes : int
+        Arrays and tables in results at least this large come back
+        through shared files instead of the result pipe.
+    """
+
+    def __init__(self, workers: Optional[int] = None, directory: Optional[Union[str, Path]] = None,
+                 return_bytes: int = RETURN_BYTES):
+        self.workers = workers or os.cpu_count() or 1
+        self.directory = tempfile.mkdtemp(prefix="mb100t01-", dir=directory or _shared_directory())
+        self.return_bytes = return_bytes
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self) -> "SharedPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return f"SharedPool(workers={self.workers}, directory={self.directory!r})"
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def share(self, value: Union[np.ndarray, pd.DataFrame]) -> Union[SharedArray, SharedFrame]:
+        """Place an array or DataFrame in shared memory; return its descriptor.
+
+        A ``numpy.memmap`` backed by a file is shared as that file, without
+        copying. Arrays are copied once, so changes made to ``value``
+        afterwards are not seen by the workers.
+        """
+        if isinstance(value, pd.DataFrame):
+            return _share_frame(value, self.directory)
+        if isinstance(value, np.memmap):
+            block = _memmap_block(value)
+            if block is not None:
+                return block
+        return _write(self.directory, value)
+
+    def empty(self, shape, dtype=np.float64) -> SharedArray:
+        """A new zero-filled shared array for workers to write results into."""
+        shape = tuple(int(size) for size in np.atleast_1d(shape))
+        block = SharedArray(os.path.join(self.directory, f"{uuid.uuid4().hex}.bin"), np.dtype(dtype).str, shape,
+                            writable=True)
+        with open(block.path, "wb") as stream:
+            stream.truncate(block.nbytes)
+        return block
+
+    def release(self, descriptor: Union[SharedArray, SharedFrame]) -> None:
+        """Delete the shared files of ``descriptor``.
+
+        Mappings stay valid until dropped; workers drop theirs at their
+        next task, and the memory is freed then.
+        """
+        blocks = ([column for _, column in descriptor.columns if isinstance(column, SharedArray)]
+                  if isinstance(descriptor, SharedFrame) else [descriptor])
+        for block in blocks:
+            if os.path.dirname(block.path) == self.directory and os.path.exists(block.path):
+                os.unlink(block.path)
+
+    def submit(self, function: Callable, *args, **kwargs) -> Future:
+        """Run ``function(*args, **kwargs)`` in a worker; descriptors arrive mapped."""
+        future = self.executor.submit(_run, function, args, kwargs, self.directory, self.return_bytes)
+        result: Future = Future()
+
+        def done(finished: Future) -> None:
+            if finished.exception() is not None:
+                result.set_exception(finished.exception())
+            else:
+                result.set_result(_import(finished.result()))
+
+        future.add_done_callback(done)
+        return result
+
+    def map(self, function: Callable, *iterables, chunksize: int = 1) -> List:
+        """``[function(*args) for args in zip(*iterables)]`` in the workers, in order."""
+        arguments = list(zip(*iterables))
+        if not arguments:
+            return []
+        results = self.executor.map(
+            _run, [function] * len(arguments), arguments, [{}] * len(arguments),
+            [self.directory] * len(arguments), [self.return_bytes] * len(arguments), chunksize=chunksize,
+        )
+        return [_import(result) for result in results]
+
+    def close(self) -> None:
+        """Stop the workers and delete all shared files."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+_pools: Dict[int, SharedPool] = {}
+
+
+def shared_pool(workers: Optional[int] = None) -> SharedPool:
+    """A pool shared by all callers in this process, created on first use and closed at exit."""
+    workers = workers or os.cpu_count() or 1
+    if workers not in _pools:
+        _pools[workers] = SharedPool(workers)
+        if len(_pools) == 1:
+            atexit.register(_close_pools)
+    return _pools[workers]
+
+
+def _close_pools() -> None:
+    for pool in _pools.values():
+        pool.close()
+    _pools.clear()
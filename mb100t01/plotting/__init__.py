@@ -0,0 +1,22 @@
+"""Plotting helpers that scale to large feature tables and images.
+
+:mod:`mb100t01.plotting.annotations` needs ``statannotations`` and is
+imported on its own.
+"""
+
+from .facets import FacetLayout, facet_pages, facet_scatter
+from .heatmap import clear_linkage_cache, image_heatmap, seriate
+from .pairplot import PairHistograms, column_bin_edges, hist_pairplot, pairwise_histograms
+
+__all__ = [
+    "FacetLayout",
+    "PairHistograms",
+    "clear_linkage_cache",
+    "column_bin_edges",
+    "facet_pages",
+    "facet_scatter",
+    "hist_pairplot",
+    "image_heatmap",
+    "pairwise_histograms",
+    "seriate",
+]
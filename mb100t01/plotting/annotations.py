@@ -0,0 +1,131 @@
+"""Statistical annotations that reuse test results across plots.
+
+In ``03_Statistic_Annotations_in_Seaborn_Bonus`` the same three
+Mann-Whitney tests on ``penguins_cleaned`` run again for every
+``configure(text_format=...)`` and again for the violin plot.
+:class:`CachingAnnotator` is a drop-in replacement for
+``statannotations.Annotator.Annotator`` that keeps the results of
+``apply_test`` keyed by the data, the ``x``/``y``/``hue`` columns, the
+pairs and the test configuration. Changing only how the results are shown
+(text format, box or violin plot, line offsets) redraws the labels from
+the stored results.
+
+``statannotations`` is an optional dependency of this package, which is
+why this module is not imported by :mod:`mb100t01.plotting`.
+
+Example
+-------
+>>> from mb100t01.plotting.annotations import CachingAnnotator
+>>> annotator = CachingAnnotator(ax, pairs, **plotting_parameters)
+>>> annotator.configure(test="Mann-Whitney", text_format="star").apply_and_annotate()
+>>> annotator.new_plot(violin_ax, pairs=pairs, plot="violinplot", **plotting_parameters)
+>>> annotator.configure(test="Mann-Whitney", text_format="full").apply_and_annotate()
+"""
+
+from __future__ import annotations
+
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from statannotations.Annotation import Annotation
+from statannotations.Annotator import Annotator
+
+# StatResult lists after multiple comparisons correction, keyed by
+# CachingAnnotator._results_key; shared by all annotators of a session
+_RESULTS_CACHE: "OrderedDict[tuple, list]" = OrderedDict()
+_RESULTS_CACHE_SIZE = 256
+
+
+def clear_results_cache() -> None:
+    """Forget all stored test results."""
+    _RESULTS_CACHE.clear()
+
+
+def _data_hash(data, columns) -> Optional[str]:
+    """Hash the plotted columns of ``data``; ``None`` when it cannot be hashed."""
+    if not isinstance(data, pd.DataFrame):
+        return None
+    columns = [column for column in columns if isinstance(column, str) and column in data]
+    hashes = pd.util.hash_pandas_object(data[columns], index=False).to_numpy()
+    digest = hashlib.blake2b(np.ascontiguousarray(hashes).tobytes(), digest_size=16)
+    digest.update(repr(columns).encode())
+    return digest.hexdigest()
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, np.ndarray):
+        return tuple(value.tolist())
+    return value if isinstance(value, (str, int, float, bool, type(None))) else repr(value)
+
+
+class CachingAnnotator(Annotator):
+    """``Annotator`` that computes each set of pairwise tests only once.
+
+    The constructor, ``new_plot``, ``configure`` and ``apply_and_annotate``
+    behave as in ``statannotations``. When ``apply_test`` is called for a
+    combination of data, columns, pairs, test, correction method, alpha
+    and test parameters that was seen before, the stored ``StatResult``
+    objects are attached to the current plot instead of rerunning the
+    tests. The plot type is not part of the key, so switching from a box
+    plot to a violin plot reuses the results.
+    """
+
+    def _get_plotter(self, engine, ax, pairs, plot, data=None, x=None, y=None,
+                     hue=None, order=None, hue_order=None, **plot_params):
+        # both __init__ and new_plot go through here; remember what is plotted
+        self._source = {
+            "data": _data_hash(data, [x, y, hue]),
+            "x": x,
+            "y": y,
+            "hue": hue,
+            "order": _freeze(order),
+            "hue_order": _freeze(hue_order),
+        }
+        return Annotator._get_plotter(engine, ax, pairs, plot, data, x, y, hue,
+                                      order, hue_order, **plot_params)
+
+    def _results_key(self, num_comparisons, stats_params) -> Optional[tuple]:
+        source = getattr(self, "_source", None)
+        if source is None or source["data"] is None:
+            return None
+        test = self.test
+        correction = self.comparisons_correction
+        return (
+            tuple(sorted(source.items())),
+            _freeze([(first["group"], second["group"]) for first, second in self._struct_pairs]),
+            getattr(test, "short_name", None) or repr(test),
+            getattr(correction, "name", None) or repr(correction),
+            self.alpha,
+            num_comparisons,
+            _freeze(stats_params),
+        )
+
+    def _get_results(self, num_comparisons, pvalues=None, **stats_params):
+        if not self.perform_stat_test:
+            return super()._get_results(num_comparisons, pvalues, **stats_params)
+        key = self._results_key(num_comparisons, stats_params)
+        if key is None:
+            return super()._get_results(num_comparisons, pvalues, **stats_params)
+
+        results = _RESULTS_CACHE.get(key)
+        if results is None:
+            annotations = super()._get_results(num_comparisons, pvalues, **stats_params)
+            _RESULTS_CACHE[key] = [annotation.data for annotation in annotations]
+            if len(_RESULTS_CACHE) > _RESULTS_CACHE_SIZE:
+                _RESULTS_CACHE.popitem(last=False)
+            return annotations
+
+        _RESULTS_CACHE.move_to_end(key)
+        # the results are already corrected for multiple comparisons; only
+        # the plot structures and the formatter belong to the current plot
+        return [
+            Annotation(structs, result, formatter=self.pvalue_format)
+            for structs, result in zip(self._struct_pairs, results)
+        ]
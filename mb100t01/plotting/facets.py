@@ -0,0 +1,280 @@
+"""Small multiples for hundreds of facets on a few shared canvases.
+
+``sns.relplot(..., col="file_name")`` creates one matplotlib Axes per
+image, each with its own ticks, layout and legend work. On a full BBBC007
+plate that is hundreds of Axes and the figure takes longer to lay out than
+to compute. :func:`facet_scatter` sorts the rows by the facet key once,
+places every panel in its own cell of a single Axes per page and draws all
+points of a page as one scatter collection. Pages hold at most
+``panels_per_page`` panels.
+
+Example
+-------
+>>> nuclei_features_df = pd.read_csv("../../data/BBBC007_analysis.csv")
+>>> nuclei_features_df["round"] = nuclei_features_df["aspect_ratio"] < 1.2
+>>> pages = facet_scatter(
+...     nuclei_features_df, x="aspect_ratio", y="intensity_mean",
+...     size="area", hue="round", col="file_name",
+... )
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Iterator, List, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# gap between panels and room for titles, in units of the panel size
+_GAP = 0.12
+_TITLE = 0.18
+
+
+@dataclass
+class FacetLayout:
+    """Rows of a table sorted by facet key, with panel boundaries.
+
+    Attributes
+    ----------
+    keys : numpy.ndarray
+        Facet keys in panel order.
+    order : numpy.ndarray
+        Row positions of the original table, sorted by facet.
+    bounds : numpy.ndarray
+        ``order[bounds[i]:bounds[i + 1]]`` are the rows of panel ``i``.
+    """
+
+    keys: np.ndarray
+    order: np.ndarray
+    bounds: np.ndarray
+
+    @classmethod
+    def from_column(cls, values) -> "FacetLayout":
+        codes, keys = pd.factorize(pd.Series(values), sort=True)
+        order = np.argsort(codes, kind="stable")
+        # rows with a missing key get code -1 and are sorted first; skip them
+        order = order[np.count_nonzero(codes < 0) :]
+        counts = np.bincount(codes[codes >= 0], minlength=len(keys))
+        bounds = np.concatenate([[0], np.cumsum(counts)])
+        return cls(keys=np.asarray(keys), order=order, bounds=bounds)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def rows(self, panel: int) -> np.ndarray:
+        return self.order[self.bounds[panel] : self.bounds[panel + 1]]
+
+
+def _map_hue(values: pd.Series, palette) -> Tuple[np.ndarray, list, np.ndarray]:
+    """Return an RGBA color per row, the hue levels and their colors."""
+    from matplotlib import colors as mcolors
+    from matplotlib import pyplot as plt
+
+    codes, levels = pd.factorize(values, sort=True)
+    if palette is None:
+        palette = plt.get_cmap("tab10").colors
+    elif isinstance(palette, str):
+        cmap = plt.get_cmap(palette)
+        palette = [cmap(x) for x in np.linspace(0, 1, max(len(levels), 2))]
+    if isinstance(palette, Mapping):
+        palette = [palette[level] for level in levels]
+    level_colors = np.array(
+        [mcolors.to_rgba(palette[i % len(palette)]) for i in range(len(levels))]
+    )
+    row_colors = np.empty((len(values), 4))
+    row_colors[codes >= 0] = level_colors[codes[codes >= 0]]
+    row_colors[codes < 0] = mcolors.to_rgba("lightgray")
+    return row_colors, list(levels), level_colors
+
+
+def _map_size(values: np.ndarray, sizes: Tuple[float, float]) -> np.ndarray:
+    low, high = np.nanmin(values), np.nanmax(values)
+    if not np.isfinite(low) or high == low:
+        return np.full(len(values), np.mean(sizes))
+    scaled = (values - low) / (high - low)
+    return np.where(np.isfinite(scaled), sizes[0] + scaled * (sizes[1] - sizes[0]), sizes[0])
+
+
+def _limits(values: np.ndarray) -> Tuple[float, float]:
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return 0.0, 1.0
+    low, high = float(finite.min()), float(finite.max())
+    margin = 0.05 * (high - low) if high > low else 0.5
+    return low - margin, high + margin
+
+
+def facet_pages(
+    data: pd.DataFrame,
+    x: str,
+    y: str,
+    col: str,
+    hue: Optional[str] = None,
+    size: Optional[str] = None,
+    col_wrap: int = 6,
+    panels_per_page: int = 48,
+    height: float = 2.0,
+    sizes: Tuple[float, float] = (4, 60),
+    palette=None,
+    alpha: float = 0.8,
+) -> Iterator:
+    """Yield one figure per page of scatter panels, one panel per ``col`` value.
+
+    All panels share the x and y limits, as in ``sns.relplot`` with the
+    default ``facet_kws``. Colors and sizes are mapped for the whole table
+    once, so the legend is identical on every page. See
+    :func:`facet_scatter` for the parameters.
+    """
+    from matplotlib import pyplot as plt
+    from matplotlib.collections import LineCollection, PatchCollection
+    from matplotlib.lines import Line2D
+    from matplotlib.patches import Rectangle
+    from matplotlib.ticker import MaxNLocator
+
+    layout = FacetLayout.from_column(data[col])
+    x_values = data[x].to_numpy(dtype=float)
+    y_values = data[y].to_numpy(dtype=float)
+    x_lim, y_lim = _limits(x_values), _limits(y_values)
+    # panel-local coordinates in [0, 1]; panel i is shifted to its grid cell
+    x_unit = (x_values - x_lim[0]) / (x_lim[1] - x_lim[0])
+    y_unit = (y_values - y_lim[0]) / (y_lim[1] - y_lim[0])
+    x_ticks = [t for t in MaxNLocator(4).tick_values(*x_lim) if x_lim[0] <= t <= x_lim[1]]
+    y_ticks = [t for t in MaxNLocator(4).tick_values(*y_lim) if y_lim[0] <= t <= y_lim[1]]
+
+    if hue is None:
+        row_colors = np.tile(np.array([0.12, 0.47, 0.71, 1.0]), (len(data), 1))
+        levels, level_colors = [], np.empty((0, 4))
+    else:
+        row_colors, levels, level_colors = _map_hue(data[hue], palette)
+    if size is None:
+        row_sizes = np.full(len(data), sizes[0] * 3)
+    else:
+        row_sizes = _map_size(data[size].to_numpy(dtype=float), sizes)
+
+    n_cols = max(1, min(col_wrap, len(layout)))
+    cell_w, cell_h = 1 + _GAP, 1 + _GAP + _TITLE
+    for first in range(0, len(layout), panels_per_page):
+        panels = range(first, min(first + panels_per_page, len(layout)))
+        n_rows = -(-len(panels) // n_cols)
+        fig, ax = plt.subplots(figsize=(height * n_cols * cell_w, height * n_rows * cell_h))
+
+        offsets_x, offsets_y, frames, rows = [], [], [], []
+        for slot, panel in enumerate(panels):
+            left = (slot % n_cols) * cell_w
+            bottom = (n_rows - 1 - slot // n_cols) * cell_h
+            index = layout.rows(panel)
+            rows.append(index)
+            offsets_x.append(x_unit[index] + left)
+            offsets_y.append(y_unit[index] + bottom)
+            frames.append(Rectangle((left, bottom), 1, 1))
+            ax.text(left + 0.5, bottom + 1 + _TITLE / 3, str(layout.keys[panel]),
+                    ha="center", va="bottom", fontsize="x-small", clip_on=False)
+        rows = np.concatenate(rows)
+        ax.scatter(
+            np.concatenate(offsets_x),
+            np.concatenate(offsets_y),
+            s=row_sizes[rows],
+            c=row_colors[rows],
+            alpha=alpha,
+            linewidths=0,
+        )
+        ax.add_collection(
+            PatchCollection(frames, facecolor="none", edgecolor="black", linewidth=0.8)
+        )
+
+        # tick marks on every panel, labels only on the outer panels
+        segments = []
+        for slot in range(len(panels)):
+            left = (slot % n_cols) * cell_w
+            bottom = (n_rows - 1 - slot // n_cols) * cell_h
+            is_bottom = slot + n_cols >= len(panels)
+            for tick in x_ticks:
+                position = left + (tick - x_lim[0]) / (x_lim[1] - x_lim[0])
+                segments.append([(position, bottom), (position, bottom - 0.03)])
+                if is_bottom:
+                    ax.text(position, bottom - 0.05, f"{tick:g}", ha="center", va="top",
+                            fontsize="x-small")
+            for tick in y_ticks:
+                position = bottom + (tick - y_lim[0]) / (y_lim[1] - y_lim[0])
+                segments.append([(left, position), (left - 0.03, position)])
+                if slot % n_cols == 0:
+                    ax.text(left - 0.05, position, f"{tick:g}", ha="right", va="center",
+                            fontsize="x-small")
+            if is_bottom:
+                ax.text(left + 0.5, bottom - 0.15, x, ha="center", va="top", fontsize="small")
+            if slot % n_cols == 0:
+                ax.text(left - 0.2, bottom + 0.5, y, ha="right", va="center",
+                        rotation=90, fontsize="small")
+        ax.add_collection(LineCollection(segments, colors="black", linewidths=0.8))
+
+        ax.set_xlim(-0.3, n_cols * cell_w)
+        ax.set_ylim(-0.3, n_rows * cell_h)
+        ax.set_axis_off()
+        fig.suptitle(col, fontsize="small")
+        if levels:
+            fig.subplots_adjust(right=0.85)
+            handles = [Line2D([], [], marker="o", linestyle="", color=c) for c in level_colors]
+            fig.legend(handles, [str(level) for level in levels], title=hue,
+                       loc="center right", frameon=False)
+        yield fig
+
+
+def facet_scatter(
+    data: pd.DataFrame,
+    x: str,
+    y: str,
+    col: str,
+    hue: Optional[str] = None,
+    size: Optional[str] = None,
+    col_wrap: int = 6,
+    panels_per_page: int = 48,
+    height: float = 2.0,
+    sizes: Tuple[float, float] = (4, 60),
+    palette=None,
+    alpha: float = 0.8,
+) -> List:
+    """Scatter plots of ``y`` against ``x``, one panel per value of ``col``.
+
+    A drop-in for ``sns.relplot(data, x=..., y=..., hue=..., size=...,
+    col=..., col_wrap=...)`` when there are too many facets for one Axes
+    each. Every page is a single Axes; panels are cells in it.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        Long-form table, one row per object.
+    x, y : str
+        Columns plotted on the panel axes.
+    col : str
+        Column whose values define the panels, e.g. ``"file_name"``.
+    hue : str, optional
+        Categorical column mapped to color.
+    size : str, optional
+        Numeric column mapped to marker area.
+    col_wrap : int
+        Number of panels per row.
+    panels_per_page : int
+        Largest number of panels on one figure; further panels go to
+        further figures.
+    height : float
+        Height of one panel in inches.
+    sizes : tuple of float
+        Smallest and largest marker area when ``size`` is given.
+    palette : str, sequence or dict, optional
+        Matplotlib colormap name, list of colors or ``{level: color}``.
+    alpha : float
+        Marker opacity.
+
+    Returns
+    -------
+    list of matplotlib.figure.Figure
+        One figure per page.
+    """
+    return list(
+        facet_pages(
+            data, x, y, col, hue=hue, size=size, col_wrap=col_wrap,
+            panels_per_page=panels_per_page, height=height, sizes=sizes,
+            palette=palette, alpha=alpha,
+        )
+    )
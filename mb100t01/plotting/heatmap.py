@@ -0,0 +1,245 @@
+"""Heatmap drawn as a single image, with optional seriation and downsampling.
+
+``sns.heatmap`` creates one patch per cell, which is fine for the
+island x species pivot table but very slow for the 1000 x 1000 feature
+correlation matrices we compute on regionprops tables. :func:`image_heatmap`
+draws the whole matrix with one ``imshow`` call, can reorder rows and
+columns by hierarchical clustering, and averages blocks of cells when the
+matrix has more cells than the figure has pixels.
+
+Example
+-------
+>>> corr = df.corr(numeric_only=True)
+>>> ax = image_heatmap(corr, cluster=True, cmap="RdBu_r", center=0)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import warnings
+from collections import OrderedDict
+from typing import Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+# linkage matrices keyed by (matrix hash, method, metric); clustering a
+# 1000 x 1000 matrix takes seconds, redrawing it with other colors should not
+_LINKAGE_CACHE: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+_LINKAGE_CACHE_SIZE = 32
+
+
+def _matrix_hash(values: np.ndarray) -> str:
+    values = np.ascontiguousarray(values, dtype=float)
+    digest = hashlib.blake2b(values.tobytes(), digest_size=16)
+    digest.update(str(values.shape).encode())
+    return digest.hexdigest()
+
+
+def _cached_linkage(values: np.ndarray, method: str, metric: str) -> np.ndarray:
+    from scipy.cluster import hierarchy
+
+    key = (_matrix_hash(values), method, metric)
+    if key in _LINKAGE_CACHE:
+        _LINKAGE_CACHE.move_to_end(key)
+        return _LINKAGE_CACHE[key]
+    # clustering cannot handle missing values, e.g. correlations of constant columns
+    finite = np.where(np.isfinite(values), values, 0.0)
+    linkage = hierarchy.linkage(finite, method=method, metric=metric, optimal_ordering=False)
+    _LINKAGE_CACHE[key] = linkage
+    if len(_LINKAGE_CACHE) > _LINKAGE_CACHE_SIZE:
+        _LINKAGE_CACHE.popitem(last=False)
+    return linkage
+
+
+def clear_linkage_cache() -> None:
+    """Forget all cached linkage matrices."""
+    _LINKAGE_CACHE.clear()
+
+
+def seriate(
+    data: Union[pd.DataFrame, np.ndarray],
+    method: str = "average",
+    metric: str = "euclidean",
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return row and column orders that group similar rows and columns.
+
+    The orders are the leaves of a hierarchical clustering of the rows and
+    of the columns. Linkages are cached per matrix content, so seriating
+    the same matrix again is cheap. A symmetric matrix, such as a
+    correlation matrix, is clustered once and the same order is used for
+    both axes.
+    """
+    from scipy.cluster import hierarchy
+
+    values = np.asarray(data, dtype=float)
+    if values.shape[0] < 2:
+        row_order = np.arange(values.shape[0])
+    else:
+        row_order = hierarchy.leaves_list(_cached_linkage(values, method, metric))
+    symmetric = values.shape[0] == values.shape[1] and np.allclose(
+        values, values.T, equal_nan=True
+    )
+    if symmetric:
+        col_order = row_order
+    elif values.shape[1] < 2:
+        col_order = np.arange(values.shape[1])
+    else:
+        col_order = hierarchy.leaves_list(_cached_linkage(values.T, method, metric))
+    return row_order, col_order
+
+
+def _block_reduce(values: np.ndarray, axis: int, size: int) -> np.ndarray:
+    """Average consecutive groups of ``size`` entries along ``axis``, ignoring NaN."""
+    if size <= 1:
+        return values
+    n = values.shape[axis]
+    n_blocks = -(-n // size)
+    pad = [(0, 0), (0, 0)]
+    pad[axis] = (0, n_blocks * size - n)
+    padded = np.pad(values, pad, constant_values=np.nan)
+    shape = list(padded.shape)
+    shape[axis : axis + 1] = [n_blocks, size]
+    with warnings.catch_warnings():
+        # all-NaN blocks stay NaN and are drawn as missing
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return np.nanmean(padded.reshape(shape), axis=axis + 1)
+
+
+def _tick_positions(n_cells: int, max_ticks: int) -> np.ndarray:
+    """Pick at most ``max_ticks`` evenly spaced original rows to label."""
+    if n_cells <= max_ticks:
+        return np.arange(n_cells)
+    return np.unique(np.linspace(0, n_cells - 1, max_ticks).round().astype(int))
+
+
+def image_heatmap(
+    data: Union[pd.DataFrame, np.ndarray],
+    cluster: bool = False,
+    method: str = "average",
+    metric: str = "euclidean",
+    max_pixels: Optional[int] = None,
+    vmin: Optional[float] = None,
+    vmax: Optional[float] = None,
+    center: Optional[float] = None,
+    cmap=None,
+    linewidths: float = 0,
+    linecolor: str = "white",
+    max_ticks: Optional[int] = None,
+    cbar: bool = True,
+    ax=None,
+):
+    """Plot a matrix as a color-encoded image.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame or numpy.ndarray
+        2D data. Index and column labels of a DataFrame become tick labels.
+    cluster : bool
+        Reorder rows and columns with :func:`seriate` before drawing.
+    method, metric : str
+        Linkage method and distance metric passed to
+        ``scipy.cluster.hierarchy.linkage``.
+    max_pixels : int, optional
+        Largest number of image rows or columns to draw. Larger matrices are
+        averaged in square-ish blocks. Defaults to the pixel size of the
+        axes.
+    vmin, vmax, center : float, optional
+        Color limits; ``center`` makes the limits symmetric around it, as
+        in ``sns.heatmap``.
+    cmap : str or Colormap, optional
+        Colormap, ``"viridis"`` by default.
+    linewidths : float
+        Width of the lines between cells. Lines are drawn as two line
+        collections and only when no block averaging happens.
+    linecolor : str
+        Color of those lines.
+    max_ticks : int, optional
+        Largest number of tick labels per axis. Labels are placed at the
+        positions of the selected rows and columns. By default as many as
+        fit next to each other in the tick label font size.
+    cbar : bool
+        Draw a colorbar.
+    ax : matplotlib.axes.Axes, optional
+        Axes to draw into; the current axes by default.
+
+    Returns
+    -------
+    matplotlib.axes.Axes
+    """
+    from matplotlib import pyplot as plt
+
+    if isinstance(data, pd.DataFrame):
+        values = data.to_numpy(dtype=float)
+        row_labels = np.asarray(data.index.astype(str))
+        col_labels = np.asarray(data.columns.astype(str))
+    else:
+        values = np.asarray(data, dtype=float)
+        row_labels = np.arange(values.shape[0]).astype(str)
+        col_labels = np.arange(values.shape[1]).astype(str)
+
+    if cluster:
+        row_order, col_order = seriate(values, method=method, metric=metric)
+        values = values[np.ix_(row_order, col_order)]
+        row_labels = row_labels[row_order]
+        col_labels = col_labels[col_order]
+
+    if ax is None:
+        ax = plt.gca()
+    bbox = ax.get_window_extent()
+    if max_pixels is None:
+        max_pixels = max(int(min(bbox.width, bbox.height)), 1)
+    n_rows, n_cols = values.shape
+    row_block = max(1, -(-n_rows // max_pixels))
+    col_block = max(1, -(-n_cols // max_pixels))
+    image = _block_reduce(_block_reduce(values, 0, row_block), 1, col_block)
+
+    if vmin is None:
+        vmin = np.nanmin(values) if np.isfinite(values).any() else 0.0
+    if vmax is None:
+        vmax = np.nanmax(values) if np.isfinite(values).any() else 1.0
+    if center is not None:
+        spread = max(abs(vmax - center), abs(center - vmin))
+        vmin, vmax = center - spread, center + spread
+
+    # the extent keeps data coordinates in original cells, so ticks and
+    # annotations address rows and columns regardless of block averaging;
+    # the last blocks are padded, so the image covers whole blocks and the
+    # limits cut the padding off
+    mesh = ax.imshow(
+        image,
+        cmap=cmap,
+        vmin=vmin,
+        vmax=vmax,
+        aspect="auto",
+        interpolation="nearest",
+        extent=(0, image.shape[1] * col_block, image.shape[0] * row_block, 0),
+    )
+    ax.set_xlim(0, n_cols)
+    ax.set_ylim(n_rows, 0)
+    if linewidths and row_block == 1 and col_block == 1:
+        ax.hlines(np.arange(1, n_rows), 0, n_cols, colors=linecolor, linewidths=linewidths)
+        ax.vlines(np.arange(1, n_cols), 0, n_rows, colors=linecolor, linewidths=linewidths)
+
+    if max_ticks is None:
+        label_height = plt.rcParams["ytick.labelsize"]
+        if isinstance(label_height, str):
+            label_height = plt.rcParams["font.size"]
+        label_pixels = 1.5 * label_height * ax.figure.dpi / 72
+        max_ticks = max(int(min(bbox.width, bbox.height) / label_pixels), 1)
+    rows = _tick_positions(n_rows, max_ticks)
+    cols = _tick_positions(n_cols, max_ticks)
+    ax.set_yticks(rows + 0.5)
+    ax.set_yticklabels(row_labels[rows])
+    ax.set_xticks(cols + 0.5)
+    ax.set_xticklabels(col_labels[cols], rotation=90)
+    if isinstance(data, pd.DataFrame):
+        if data.index.name is not None:
+            ax.set_ylabel(data.index.name)
+        if data.columns.name is not None:
+            ax.set_xlabel(data.columns.name)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    if cbar:
+        ax.figure.colorbar(mesh, ax=ax)
+    return ax
@@ -0,0 +1,325 @@
+"""Pairplot built from precomputed 2D histograms.
+
+``sns.pairplot`` draws one marker per row for every pair of columns, which
+means ``k * k * n`` artists for ``k`` columns and ``n`` rows. For the
+``blobs_statistics.csv`` columns or a full regionprops table this takes
+minutes. :func:`hist_pairplot` instead bins every column once, accumulates
+all pairwise 2D histograms (and the diagonal 1D histograms) in a single
+chunked pass, and draws each panel as one image.
+
+Example
+-------
+>>> penguins_cleaned = sns.load_dataset("penguins").dropna()
+>>> fig, axes = hist_pairplot(penguins_cleaned, hue="species", height=3)
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, List, Mapping, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass
+class PairHistograms:
+    """Pairwise histograms of a set of columns, split by hue.
+
+    Attributes
+    ----------
+    variables : list of str
+        Column names, in plotting order.
+    edges : dict
+        Bin edges per column. The same edges are used for the column on
+        the diagonal and in every pair it takes part in.
+    hue_levels : list
+        Hue levels in the order of the first axis of the count arrays.
+        ``[None]`` when no hue was given.
+    diagonal : numpy.ndarray
+        Array of shape ``(n_hue, k, bins)`` with the 1D counts.
+    pairs : dict
+        Maps ``(i, j)`` with ``i < j`` to an array of shape
+        ``(n_hue, bins_i, bins_j)``, rows binned by variable ``i`` and
+        columns by variable ``j``.
+    """
+
+    variables: List[str]
+    edges: Dict[str, np.ndarray]
+    hue_levels: list
+    diagonal: np.ndarray
+    pairs: Dict[tuple, np.ndarray]
+
+    def counts(self, row: int, col: int) -> np.ndarray:
+        """Return counts with ``row`` binned on the first and ``col`` on the second axis."""
+        if row == col:
+            raise ValueError("Use `diagonal` for the 1D histograms.")
+        if row < col:
+            return self.pairs[(row, col)]
+        return self.pairs[(col, row)].transpose(0, 2, 1)
+
+
+def column_bin_edges(
+    data: pd.DataFrame,
+    variables: Sequence[str],
+    bins: int = 64,
+) -> Dict[str, np.ndarray]:
+    """Compute equally spaced bin edges spanning the finite range of each column.
+
+    The result can be passed back to :func:`pairwise_histograms` or
+    :func:`hist_pairplot` to keep the binning fixed across several plots,
+    for example when comparing plates.
+    """
+    edges = {}
+    for name in variables:
+        values = data[name].to_numpy(dtype=float)
+        finite = values[np.isfinite(values)]
+        if finite.size == 0:
+            low, high = 0.0, 1.0
+        else:
+            low, high = float(finite.min()), float(finite.max())
+        if low == high:
+            low, high = low - 0.5, high + 0.5
+        edges[name] = np.linspace(low, high, bins + 1)
+    return edges
+
+
+def _digitize(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Return bin indices for ``values``; values outside the edges or NaN get -1."""
+    n_bins = len(edges) - 1
+    index = np.searchsorted(edges, values, side="right") - 1
+    # the right-most edge belongs to the last bin, as in numpy.histogram
+    index[values == edges[-1]] = n_bins - 1
+    index[(index < 0) | (index >= n_bins) | ~np.isfinite(values)] = -1
+    return index
+
+
+def pairwise_histograms(
+    data: pd.DataFrame,
+    variables: Optional[Sequence[str]] = None,
+    hue: Optional[str] = None,
+    bins: int = 64,
+    edges: Optional[Mapping[str, np.ndarray]] = None,
+    chunksize: int = 250_000,
+) -> PairHistograms:
+    """Accumulate all pairwise 2D histograms and diagonal 1D histograms.
+
+    Rows are processed in chunks of ``chunksize``. Each column of a chunk
+    is binned once and the bin indices are reused for every pair the
+    column takes part in; all hue groups are counted by the same
+    ``numpy.bincount`` call, so the data is traversed a single time.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        Table with the numeric columns to plot.
+    variables : sequence of str, optional
+        Columns to use. Defaults to all numeric columns.
+    hue : str, optional
+        Column used to split the counts into groups.
+    bins : int
+        Number of bins per column, used when ``edges`` is not given.
+    edges : mapping, optional
+        Precomputed bin edges per column, see :func:`column_bin_edges`.
+    chunksize : int
+        Number of rows processed at a time.
+    """
+    if variables is None:
+        variables = [
+            name for name in data.select_dtypes(include="number").columns if name != hue
+        ]
+    variables = list(variables)
+    if edges is None:
+        edges = column_bin_edges(data, variables, bins=bins)
+    else:
+        edges = {name: np.asarray(edges[name], dtype=float) for name in variables}
+    n_bins = [len(edges[name]) - 1 for name in variables]
+
+    if hue is None:
+        hue_codes = np.zeros(len(data), dtype=np.intp)
+        hue_levels: list = [None]
+    else:
+        hue_codes, uniques = pd.factorize(data[hue], sort=True)
+        hue_levels = list(uniques)
+    n_hue = len(hue_levels)
+
+    k = len(variables)
+    diagonal = np.zeros((n_hue, k, max(n_bins, default=0)), dtype=np.int64)
+    pairs = {
+        (i, j): np.zeros((n_hue, n_bins[i], n_bins[j]), dtype=np.int64)
+        for i in range(k)
+        for j in range(i + 1, k)
+    }
+
+    for start in range(0, len(data), chunksize):
+        stop = start + chunksize
+        chunk_hue = hue_codes[start:stop]
+        indices = [
+            _digitize(data[name].iloc[start:stop].to_numpy(dtype=float), edges[name])
+            for name in variables
+        ]
+        for i in range(k):
+            valid = (indices[i] >= 0) & (chunk_hue >= 0)
+            flat = chunk_hue[valid] * n_bins[i] + indices[i][valid]
+            diagonal[:, i, : n_bins[i]] += np.bincount(
+                flat, minlength=n_hue * n_bins[i]
+            ).reshape(n_hue, n_bins[i])
+            for j in range(i + 1, k):
+                both = valid & (indices[j] >= 0)
+                flat = (
+                    chunk_hue[both] * n_bins[i] + indices[i][both]
+                ) * n_bins[j] + indices[j][both]
+                pairs[(i, j)] += np.bincount(
+                    flat, minlength=n_hue * n_bins[i] * n_bins[j]
+                ).reshape(n_hue, n_bins[i], n_bins[j])
+
+    return PairHistograms(
+        variables=variables,
+        edges=dict(edges),
+        hue_levels=hue_levels,
+        diagonal=diagonal,
+        pairs=pairs,
+    )
+
+
+def _hue_colors(levels: list, palette) -> np.ndarray:
+    from matplotlib import colors as mcolors
+    from matplotlib import pyplot as plt
+
+    if palette is None:
+        if levels == [None]:
+            return np.array([mcolors.to_rgb("C0")])
+        palette = plt.get_cmap("tab10").colors
+    if isinstance(palette, str):
+        cmap = plt.get_cmap(palette)
+        palette = [cmap(x) for x in np.linspace(0, 1, max(len(levels), 2))]
+    if isinstance(palette, Mapping):
+        palette = [palette[level] for level in levels]
+    return np.array([mcolors.to_rgb(palette[i % len(palette)]) for i in range(len(levels))])
+
+
+def _blend(counts: np.ndarray, colors: np.ndarray, log: bool) -> np.ndarray:
+    """Turn per-hue counts of shape ``(n_hue, ny, nx)`` into an RGBA image.
+
+    The color of a bin is the count-weighted mean of the hue colors and its
+    opacity follows the total count, so overlapping groups stay visible.
+    """
+    total = counts.sum(axis=0).astype(float)
+    rgb = np.tensordot(counts.astype(float), colors, axes=(0, 0))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rgb = np.where(total[..., None] > 0, rgb / total[..., None], 1.0)
+    density = np.log1p(total) if log else total
+    peak = density.max()
+    alpha = density / peak if peak > 0 else density
+    return np.dstack([rgb, alpha])
+
+
+def hist_pairplot(
+    data: Union[pd.DataFrame, PairHistograms],
+    vars: Optional[Sequence[str]] = None,
+    hue: Optional[str] = None,
+    bins: int = 64,
+    edges: Optional[Mapping[str, np.ndarray]] = None,
+    height: float = 2.5,
+    palette=None,
+    log: bool = True,
+    chunksize: int = 250_000,
+):
+    """Draw a pairplot where every off-diagonal panel is a 2D histogram image.
+
+    The call mirrors ``sns.pairplot(data, vars=..., hue=..., height=...)``.
+    The cost of drawing no longer depends on the number of rows: the grid
+    holds ``k * k`` images and ``k * n_hue`` step lines regardless of
+    table size.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame or PairHistograms
+        The table to plot, or histograms computed earlier with
+        :func:`pairwise_histograms`.
+    vars : sequence of str, optional
+        Columns to plot. Defaults to all numeric columns.
+    hue : str, optional
+        Column to color the groups by.
+    bins : int
+        Number of bins per column.
+    edges : mapping, optional
+        Precomputed bin edges per column, see :func:`column_bin_edges`.
+    height : float
+        Height (and width) of one panel in inches.
+    palette : str, sequence or dict, optional
+        Matplotlib colormap name, list of colors or ``{level: color}``.
+    log : bool
+        Scale the opacity by ``log(1 + count)`` so sparse regions show up.
+    chunksize : int
+        Rows per chunk while counting.
+
+    Returns
+    -------
+    fig : matplotlib.figure.Figure
+    axes : numpy.ndarray of matplotlib.axes.Axes
+    """
+    from matplotlib import pyplot as plt
+    from matplotlib.lines import Line2D
+
+    if isinstance(data, PairHistograms):
+        hists = data
+    else:
+        hists = pairwise_histograms(
+            data, variables=vars, hue=hue, bins=bins, edges=edges, chunksize=chunksize
+        )
+    names = hists.variables
+    k = len(names)
+    colors = _hue_colors(hists.hue_levels, palette)
+
+    fig, axes = plt.subplots(
+        k, k, figsize=(height * k, height * k), sharex="col", squeeze=False
+    )
+    for row in range(k):
+        y_edges = hists.edges[names[row]]
+        for col in range(k):
+            ax = axes[row, col]
+            x_edges = hists.edges[names[col]]
+            if row == col:
+                # the diagonal keeps the shared x axis but needs its own y scale
+                diag = ax.twinx()
+                n = len(x_edges) - 1
+                for level, color in enumerate(colors):
+                    diag.stairs(hists.diagonal[level, col, :n], x_edges, color=color)
+                diag.set_yticks([])
+                diag.set_ylim(bottom=0)
+                ax.set_ylim(y_edges[0], y_edges[-1])
+                continue
+            # counts are indexed [hue, y, x]; imshow puts the first axis on y
+            image = _blend(hists.counts(row, col), colors, log)
+            ax.imshow(
+                image,
+                origin="lower",
+                extent=(x_edges[0], x_edges[-1], y_edges[0], y_edges[-1]),
+                aspect="auto",
+                interpolation="nearest",
+            )
+            ax.set_ylim(y_edges[0], y_edges[-1])
+    for row in range(k):
+        for col in range(k):
+            ax = axes[row, col]
+            if col == 0:
+                ax.set_ylabel(names[row])
+            else:
+                ax.tick_params(labelleft=False)
+            if row == k - 1:
+                ax.set_xlabel(names[col])
+
+    if hists.hue_levels != [None]:
+        handles = [Line2D([], [], color=color) for color in colors]
+        fig.legend(
+            handles,
+            [str(level) for level in hists.hue_levels],
+            title=hue,
+            loc="center right",
+            frameon=False,
+        )
+        fig.tight_layout(rect=(0, 0, 0.9, 1))
+    else:
+        fig.tight_layout()
+    return fig, axes
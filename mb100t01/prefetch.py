@@ -0,0 +1,287 @@
+"""Read the next images or tables in the background while the current one is processed.
+
+Loops like ``for path in sorted(glob("data/BBBC007_batch/*.tif")):
+image = imread(path); ...`` leave the CPU idle while each file is read
+and decoded, and the disk idle while the image is processed; on network
+storage a batch takes the sum of both. :func:`prefetch` runs the loads
+ahead of the loop on an asyncio event loop: up to ``workers`` files are
+read and decoded at once in threads, and at most ``depth`` items are
+loaded or being loaded ahead of the loop, so memory stays bounded when
+loading is faster than processing. Items come back in input order, from a plain ``for`` loop or
+an ``async for`` loop, which also works inside Jupyter's running event
+loop::
+
+    from mb100t01.prefetch import prefetch
+
+    images = prefetch(sorted(Path("data/BBBC007_batch").glob("*.tif")))
+    for path, image in images:
+        ...
+    print(images.report)     # time spent waiting for data against computing
+
+    async for path, table in prefetch(urls, load=fetch_csv):   # async def loaders run on the loop
+        ...
+
+With loading hidden behind computation, a batch takes about the larger
+of the two times instead of their sum; :attr:`Prefetcher.report` shows
+how much of the loading was hidden. ``python -m mb100t01.prefetch
+<directory>`` compares a plain loop with a prefetched one.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import inspect
+import io
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator, Optional, Sequence, Tuple
+
+
+def _parse(name: str, data: Any):
+    """Decode a file or downloaded bytes by the file name's suffix."""
+    suffix = Path(name.split("?")[0]).suffix.lower()
+    if suffix in (".tif", ".tiff"):
+        import tifffile
+
+        return tifffile.imread(data)
+    if suffix in (".csv", ".tsv", ".txt"):
+        import pandas as pd
+
+        return pd.read_csv(data, sep="\t" if suffix == ".tsv" else ",")
+    if suffix == ".npy":
+        import numpy as np
+
+        return np.load(data)
+    from skimage.io import imread
+
+    return imread(data)
+
+
+def load_file(item) -> Any:
+    """Default loader: a path or an ``http(s)://`` URL, decoded by suffix.
+
+    TIFFs are read with ``tifffile``, CSVs with ``pandas.read_csv``,
+    ``.npy`` files with ``numpy.load`` and other images with
+    ``skimage.io.imread``.
+    """
+    name = str(item)
+    if name.startswith(("http://", "https://")):
+        from urllib.request import urlopen
+
+        with urlopen(name) as response:
+            return _parse(name, io.BytesIO(response.read()))
+    return _parse(name, name)
+
+
+@dataclass
+class PrefetchReport:
+    """Where the time of a prefetched loop went.
+
+    Attributes
+    ----------
+    items : int
+        Items delivered.
+    wall : float
+        Seconds from the first request to the end of the loop.
+    wait : float
+        Seconds the loop waited for data that was not loaded yet.
+    compute : float
+        Seconds the loop spent on the items between requests.
+    load : float
+        Seconds spent loading, summed over the loader threads.
+    """
+
+    items: int = 0
+    wall: float = 0.0
+    wait: float = 0.0
+    compute: float = 0.0
+    load: float = 0.0
+
+    @property
+    def hidden(self) -> float:
+        """Fraction of the loading time the loop did not wait for."""
+        return 1 - min(self.wait / self.load, 1) if self.load else 1.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.items} items in {self.wall:.2f} s: computing {self.compute:.2f} s, "
+            f"waiting for data {self.wait:.2f} s; loading took {self.load:.2f} s, "
+            f"{self.hidden:.0%} of it hidden"
+        )
+
+
+class Prefetcher:
+    """Iterable of ``(item, loaded)`` pairs, loaded ahead of the consumer.
+
+    Parameters
+    ----------
+    items : iterable
+        Paths, URLs or anything ``load`` accepts; consumed lazily.
+    load : callable, optional
+        Function or ``async def`` coroutine function loading one item;
+        defaults to :func:`load_file`. Plain functions run in threads.
+    depth : int
+        Items loaded or being loaded ahead of the consumer at most.
+    workers : int
+        Loads running at the same time at most.
+
+    Attributes
+    ----------
+    report : PrefetchReport
+        Timings of the latest iteration, updated as it runs.
+    """
+
+    def __init__(self, items: Iterable, load: Optional[Callable] = None, depth: int = 4, workers: int = 4):
+        if depth < 1 or workers < 1:
+            raise ValueError("depth and workers must be at least 1")
+        self.items = items
+        self.load = load or load_file
+        self.depth = depth
+        self.workers = workers
+        self.report = PrefetchReport()
+
+    async def _load(self, item, semaphore: asyncio.Semaphore, executor: ThreadPoolExecutor):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if inspect.iscoroutinefunction(self.load):
+                    return await self.load(item)
+                return await asyncio.get_running_loop().run_in_executor(executor, self.load, item)
+            finally:
+                self.report.load += time.perf_counter() - start
+
+    async def _stream(self) -> AsyncIterator[Tuple[Any, Any]]:
+        report = self.report = PrefetchReport()
+        semaphore = asyncio.Semaphore(self.workers)
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="prefetch")
+        # a load starts only when fewer than depth items are loaded or loading
+        # ahead of the consumer; handing one out frees its place
+        ahead = asyncio.Semaphore(self.depth)
+        # started loads in input order
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+        tasks = set()
+
+        async def produce() -> None:
+            try:
+                for item in self.items:
+                    await ahead.acquire()
+                    task = asyncio.ensure_future(self._load(item, semaphore, executor))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    await queue.put((item, task))
+            except Exception as error:
+                await queue.put((done, error))
+            else:
+                await queue.put((done, None))
+
+        producer = asyncio.ensure_future(produce())
+        start = time.perf_counter()
+        try:
+            while True:
+                requested = time.perf_counter()
+                item, task = await queue.get()
+                if item is done:
+                    if task is not None:
+                        raise task  # what the items iterable raised
+                    break
+                loaded = await task
+                ahead.release()
+                report.wait += time.perf_counter() - requested
+                report.items += 1
+                handed_out = time.perf_counter()
+                yield item, loaded
+                report.compute += time.perf_counter() - handed_out
+        finally:
+            report.wall = time.perf_counter() - start
+            # after an error or a break, drop the loads still ahead
+            producer.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(producer, *tasks, return_exceptions=True)
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def __aiter__(self) -> AsyncIterator[Tuple[Any, Any]]:
+        return self._stream().__aiter__()
+
+    def __iter__(self) -> Iterator[Tuple[Any, Any]]:
+        # a private event loop in a thread, so this also works where a loop
+        # is already running, as in Jupyter
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, name="prefetch-loop", daemon=True)
+        thread.start()
+        stream = self._stream()
+        try:
+            while True:
+                try:
+                    yield asyncio.run_coroutine_threadsafe(stream.__anext__(), loop).result()
+                except StopAsyncIteration:
+                    return
+        finally:
+            asyncio.run_coroutine_threadsafe(stream.aclose(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+
+def prefetch(items: Iterable, load: Optional[Callable] = None, depth: int = 4, workers: int = 4) -> Prefetcher:
+    """Iterate over ``(item, load(item))`` with the next loads running in the background.
+
+    See :class:`Prefetcher` for the parameters.
+    """
+    return Prefetcher(items, load, depth, workers)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m mb100t01.prefetch",
+        description="Time reading a directory of images in a plain loop and with prefetching.",
+    )
+    parser.add_argument("directory", help="directory of images or tables")
+    parser.add_argument("--pattern", default="*.tif*", help="file name pattern")
+    parser.add_argument("--compute", type=float, default=0.0,
+                        help="seconds of simulated processing per file, e.g. 0.05")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds of simulated storage latency per file, as on network mounts")
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("-j", "--workers", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    files = sorted(Path(args.directory).glob(args.pattern))
+    if not files:
+        parser.error(f"no files match {args.pattern} in {args.directory}")
+
+    def load(path):
+        time.sleep(args.latency)
+        return load_file(path)
+
+    def process(data) -> None:
+        # busy work, as processing holds the CPU
+        end = time.perf_counter() + args.compute
+        while time.perf_counter() < end:
+            pass
+
+    start = time.perf_counter()
+    loading = 0.0
+    for path in files:
+        begin = time.perf_counter()
+        data = load(path)
+        loading += time.perf_counter() - begin
+        process(data)
+    plain = time.perf_counter() - start
+    print(f"plain loop:  {len(files)} items in {plain:.2f} s, {loading:.2f} s of it loading")
+
+    prefetched = Prefetcher(files, load, args.depth, args.workers)
+    for _, data in prefetched:
+        process(data)
+    print(f"prefetched:  {prefetched.report}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
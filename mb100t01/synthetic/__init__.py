@@ -0,0 +1,6 @@
+"""Synthetic tables and images for testing the workflows at scale.
+
+:mod:`mb100t01.synthetic.tables` models the feature tables in ``data/``;
+:mod:`mb100t01.synthetic.nuclei` renders BBBC007-like images with label
+masks. Both run as scripts with ``python -m``.
+"""
@@ -0,0 +1,351 @@
+"""Synthetic feature tables learned from the course's CSV files.
+
+``data/`` holds 111 BBBC007 objects, 390 ImageJ rows and 61 blobs, far
+too few to show how the notebook workflows scale. :class:`TableModel`
+learns, within each group of the grouping column (``file_name`` or
+``Type``),
+
+* the marginal distribution of every numeric column, as its sorted
+  values, sampled by interpolating between them, and
+* the rank correlations between the numeric columns, reproduced with a
+  Gaussian copula,
+
+and samples any number of rows from that. Integer columns stay integers
+and values stay within the observed range of their group. Missing values
+(``Results.csv`` has some) occur at each column's observed rate,
+independently of the other columns.
+
+:func:`write_table` streams a large table to disk in chunks generated by
+a process pool. Chunk ``i`` always uses the random stream derived from
+``(seed, i)``, so the output does not depend on the number of workers.
+Files are partitioned by group like a Hive dataset, e.g.
+``out/Type=A/part-00000.csv``::
+
+    python -m mb100t01.synthetic.tables Results 100000000 synthetic_results -j 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = Path(__file__).resolve().parent.parent.parent / "data"
+
+# file name and the read_csv arguments the notebooks use
+TABLES: Dict[str, dict] = {
+    "BBBC007_analysis": {"file": "BBBC007_analysis.csv", "read_csv": {}},
+    "Results": {"file": "Results.csv", "read_csv": {"index_col": 0, "delimiter": ";"}},
+    "blobs_statistics": {"file": "blobs_statistics.csv", "read_csv": {"index_col": 0}},
+}
+
+# the column each table is grouped by in the notebooks
+GROUP_COLUMNS = {"BBBC007_analysis": "file_name", "Results": "Type"}
+
+
+def load_reference(name: str) -> pd.DataFrame:
+    """Read the original table ``name`` from ``data/``."""
+    table = TABLES[name]
+    return pd.read_csv(DATA_DIR / table["file"], **table["read_csv"])
+
+
+def _normal_scores(values: np.ndarray) -> np.ndarray:
+    """Map each column to standard normal quantiles of its ranks, keeping NaNs."""
+    from scipy.special import ndtri
+    from scipy.stats import rankdata
+
+    scores = np.full(values.shape, np.nan)
+    for index in range(values.shape[1]):
+        valid = ~np.isnan(values[:, index])
+        ranks = rankdata(values[valid, index])
+        scores[valid, index] = ndtri(ranks / (valid.sum() + 1))
+    return scores
+
+
+def _nearest_correlation(matrix: np.ndarray) -> np.ndarray:
+    """Make ``matrix`` a valid correlation matrix by clipping its eigenvalues."""
+    matrix = np.nan_to_num(matrix)
+    np.fill_diagonal(matrix, 1.0)
+    eigenvalues, eigenvectors = np.linalg.eigh(matrix)
+    matrix = (eigenvectors * np.clip(eigenvalues, 1e-6, None)) @ eigenvectors.T
+    scale = np.sqrt(np.diag(matrix))
+    return matrix / np.outer(scale, scale)
+
+
+@dataclass
+class GroupModel:
+    """Distribution of the rows sharing one value of the grouping column.
+
+    Attributes
+    ----------
+    value : object
+        The group's value of the grouping column, ``None`` without one.
+    weight : float
+        Fraction of the reference rows in this group.
+    quantiles : list of numpy.ndarray
+        Sorted non-missing values of every numeric column.
+    missing : numpy.ndarray
+        Fraction of missing values of every numeric column.
+    cholesky : numpy.ndarray
+        Cholesky factor of the copula correlation matrix.
+    categories : dict
+        For other categorical columns, their values and frequencies.
+    """
+
+    value: object
+    weight: float
+    quantiles: List[np.ndarray]
+    missing: np.ndarray
+    cholesky: np.ndarray
+    categories: Dict[str, Tuple[np.ndarray, np.ndarray]]
+
+    def sample(self, n_rows: int, rng: np.random.Generator) -> np.ndarray:
+        from scipy.special import ndtr
+
+        normal = rng.standard_normal((n_rows, self.cholesky.shape[0])) @ self.cholesky.T
+        uniform = ndtr(normal)
+        columns = []
+        for index, values in enumerate(self.quantiles):
+            if len(values):
+                column = np.interp(uniform[:, index], np.linspace(0.0, 1.0, len(values)), values)
+            else:
+                column = np.full(n_rows, np.nan)
+            if self.missing[index]:
+                column[rng.random(n_rows) < self.missing[index]] = np.nan
+            columns.append(column)
+        return np.column_stack(columns) if columns else np.empty((n_rows, 0))
+
+
+@dataclass
+class TableModel:
+    """Per-group marginals and copula correlations of a feature table.
+
+    Use :meth:`fit` or :meth:`from_reference` to create one.
+    """
+
+    columns: List[str]
+    numeric: List[str]
+    dtypes: Dict[str, np.dtype]
+    group_column: Optional[str]
+    groups: List[GroupModel]
+    index_name: Optional[str] = None
+    write_index: bool = False
+
+    @classmethod
+    def fit(
+        cls, table: pd.DataFrame, group_column: Optional[str] = None, write_index: bool = False
+    ) -> "TableModel":
+        """Learn the model from ``table``; see the module docstring."""
+        numeric = [column for column in table.columns
+                   if column != group_column and table[column].dtype.kind in "iuf"]
+        categorical = [column for column in table.columns
+                       if column != group_column and column not in numeric]
+        if group_column is None:
+            partitions = [(None, table)]
+        else:
+            partitions = list(table.groupby(group_column, sort=True))
+        groups = []
+        for value, part in partitions:
+            values = part[numeric].to_numpy(dtype=float)
+            if len(values) > 2 and numeric:
+                # pairwise complete observations; constant columns give NaN
+                correlation = pd.DataFrame(_normal_scores(values)).corr().to_numpy()
+            else:
+                correlation = np.eye(len(numeric))
+            categories = {}
+            for column in categorical:
+                counts = part[column].value_counts(normalize=True)
+                categories[column] = (counts.index.to_numpy(), counts.to_numpy())
+            groups.append(GroupModel(
+                value=value,
+                weight=len(part) / len(table),
+                quantiles=[np.sort(column[~np.isnan(column)]) for column in values.T],
+                missing=np.isnan(values).mean(axis=0) if len(values) else np.zeros(len(numeric)),
+                cholesky=np.linalg.cholesky(_nearest_correlation(correlation)),
+                categories=categories,
+            ))
+        return cls(
+            columns=list(table.columns),
+            numeric=numeric,
+            dtypes={column: table[column].dtype for column in numeric},
+            group_column=group_column,
+            groups=groups,
+            index_name=table.index.name,
+            write_index=write_index,
+        )
+
+    @classmethod
+    def from_reference(cls, name: str) -> "TableModel":
+        """Fit the model of one of the :data:`TABLES` in ``data/``."""
+        return cls.fit(
+            load_reference(name),
+            group_column=GROUP_COLUMNS.get(name),
+            write_index=TABLES[name]["read_csv"].get("index_col") == 0,
+        )
+
+    def group_sizes(self, n_rows: int, rng: np.random.Generator) -> np.ndarray:
+        return rng.multinomial(n_rows, [group.weight for group in self.groups])
+
+    def sample_group(
+        self, group: GroupModel, n_rows: int, rng: np.random.Generator, start: int = 0
+    ) -> pd.DataFrame:
+        """Return ``n_rows`` rows of ``group``, indexed from ``start``."""
+        values = group.sample(n_rows, rng)
+        data = {}
+        for index, column in enumerate(self.numeric):
+            column_values = values[:, index]
+            if self.dtypes[column].kind in "iu":
+                column_values = np.rint(column_values)
+            data[column] = column_values.astype(self.dtypes[column])
+        for column, (choices, probabilities) in group.categories.items():
+            data[column] = choices[rng.choice(len(choices), size=n_rows, p=probabilities)]
+        if self.group_column is not None:
+            data[self.group_column] = np.full(n_rows, group.value, dtype=object)
+        index = pd.RangeIndex(start, start + n_rows, name=self.index_name)
+        return pd.DataFrame(data, index=index)[self.columns]
+
+    def sample(
+        self, n_rows: int, seed: Union[int, np.random.SeedSequence, np.random.Generator] = 0
+    ) -> pd.DataFrame:
+        """Return ``n_rows`` rows with the groups in their reference proportions."""
+        rng = np.random.default_rng(seed)
+        sizes = self.group_sizes(n_rows, rng)
+        parts = [self.sample_group(group, size, rng) for group, size in zip(self.groups, sizes)]
+        table = pd.concat(parts)
+        # shuffle so groups are interleaved as in the measured tables
+        table = table.iloc[rng.permutation(n_rows)]
+        table.index = pd.RangeIndex(n_rows, name=self.index_name)
+        return table
+
+
+def _partition_name(model: TableModel, group: GroupModel) -> str:
+    if model.group_column is None:
+        return ""
+    return f"{model.group_column}={group.value}"
+
+
+def _write_chunk(
+    model: TableModel,
+    path: str,
+    chunk: int,
+    n_rows: int,
+    start: int,
+    seed: int,
+    file_format: str,
+    csv_kwargs: dict,
+) -> List[str]:
+    """Generate and write chunk ``chunk``; runs in a worker process."""
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(chunk,)))
+    written = []
+    offset = start
+    for group, size in zip(model.groups, model.group_sizes(n_rows, rng)):
+        if not size:
+            continue
+        part = model.sample_group(group, size, rng, start=offset)
+        offset += size
+        directory = Path(path) / _partition_name(model, group)
+        directory.mkdir(parents=True, exist_ok=True)
+        target = directory / f"part-{chunk:05d}.{file_format}"
+        temporary = target.with_name(target.name + ".tmp")
+        if file_format == "csv":
+            part.to_csv(temporary, index=model.write_index, **csv_kwargs)
+        else:
+            part.to_parquet(temporary, index=model.write_index)
+        os.replace(temporary, target)
+        written.append(str(target))
+    return written
+
+
+def write_table(
+    model: TableModel,
+    n_rows: int,
+    path: Union[str, Path],
+    file_format: str = "csv",
+    chunk_rows: int = 1_000_000,
+    workers: Optional[int] = None,
+    seed: int = 0,
+    csv_kwargs: Optional[dict] = None,
+) -> List[Path]:
+    """Write ``n_rows`` sampled rows under ``path``, one file per chunk and group.
+
+    Parameters
+    ----------
+    model : TableModel
+        The model to sample from.
+    n_rows : int
+        Total number of rows.
+    path : str or pathlib.Path
+        Output directory; groups go to ``<group_column>=<value>``
+        subdirectories.
+    file_format : {"csv", "parquet"}
+        Parquet needs ``pyarrow`` or ``fastparquet``.
+    chunk_rows : int
+        Rows generated by one task. Memory use per worker is a small
+        multiple of one chunk.
+    workers : int, optional
+        Size of the process pool; defaults to the number of CPUs.
+    seed : int
+        Seed of the whole table; chunks derive their own streams from it.
+    csv_kwargs : dict, optional
+        Extra arguments of ``DataFrame.to_csv``, e.g. ``{"sep": ";"}``.
+
+    Returns
+    -------
+    list of pathlib.Path
+        The files written, in chunk order.
+    """
+    if file_format not in ("csv", "parquet"):
+        raise ValueError(f"file_format must be 'csv' or 'parquet', not {file_format!r}")
+    starts = list(range(0, n_rows, chunk_rows))
+    workers = workers or os.cpu_count() or 1
+    arguments = [
+        (model, str(path), chunk, min(chunk_rows, n_rows - start), start, seed,
+         file_format, csv_kwargs or {})
+        for chunk, start in enumerate(starts)
+    ]
+    if workers == 1:
+        results = [_write_chunk(*args) for args in arguments]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_write_chunk, *zip(*arguments)))
+    return [Path(file) for files in results for file in files]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m mb100t01.synthetic.tables",
+        description="Write a large synthetic table learned from one of the CSV files in data/.",
+    )
+    parser.add_argument("table", choices=sorted(TABLES), help="reference table")
+    parser.add_argument("rows", type=float, help="number of rows, e.g. 1e8")
+    parser.add_argument("output", help="output directory")
+    parser.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    parser.add_argument("--chunk-rows", type=int, default=1_000_000, help="rows per task")
+    parser.add_argument("-j", "--workers", type=int, help="number of worker processes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    model = TableModel.from_reference(args.table)
+    delimiter = TABLES[args.table]["read_csv"].get("delimiter", ",")
+    start = time.perf_counter()
+    files = write_table(
+        model, int(args.rows), args.output, file_format=args.format,
+        chunk_rows=args.chunk_rows, workers=args.workers, seed=args.seed,
+        csv_kwargs={"sep": delimiter},
+    )
+    seconds = time.perf_counter() - start
+    print(f"{int(args.rows)} rows in {len(files)} files, {seconds:.1f}s "
+          f"({args.rows / seconds * 3600:.2e} rows/hour)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
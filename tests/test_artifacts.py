@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from mb100t01.columnar import ArtifactStore
+
+
+@pytest.fixture
+def penguins():
+    rng = np.random.default_rng(0)
+    n = 200
+    frame = pd.DataFrame({
+        "species": rng.choice(["Adelie", "Gentoo", "Chinstrap"], n),
+        "bill_length_mm": rng.normal(44, 5, n),
+        "body_mass_g": rng.integers(2700, 6300, n).astype(float),
+    })
+    frame.loc[:4, "bill_length_mm"] = np.nan
+    return frame
+
+
+def subset(df, species):
+    return df[df["species"] == species]
+
+
+def test_computed_once(tmp_path, penguins):
+    artifacts = ArtifactStore(tmp_path)
+    calls = []
+    record = calls.append  # callables are not part of the lineage
+
+    def clean(df):
+        record(df)
+        return df.dropna()
+
+    first = artifacts.get("cleaned", clean, penguins)
+    second = artifacts.get("cleaned", clean, penguins)
+    assert len(calls) == 1
+    pdt.assert_frame_equal(first, penguins.dropna())
+    pdt.assert_frame_equal(second, first)
+    assert not first["bill_length_mm"].to_numpy().flags.writeable
+    with pytest.raises(ValueError):
+        first.iloc[0, 1] = 0.0
+
+
+def test_upstream_change(tmp_path, penguins):
+    artifacts = ArtifactStore(tmp_path)
+    cleaned = artifacts.get("cleaned", lambda df: df.dropna(), penguins)
+    artifacts.get("adelie", subset, cleaned, species="Adelie")
+    key = artifacts.lineage("adelie")["key"]
+    changed = penguins.copy()
+    changed.loc[10, "body_mass_g"] = 1.0
+    cleaned = artifacts.get("cleaned", lambda df: df.dropna(), changed)
+    adelie_again = artifacts.get("adelie", subset, cleaned, species="Adelie")
+    pdt.assert_frame_equal(adelie_again, subset(changed.dropna(), "Adelie"))
+    assert artifacts.lineage("adelie")["key"] != key
+
+
+def test_variable_change(tmp_path, penguins):
+    artifacts = ArtifactStore(tmp_path)
+    threshold = 40
+
+    def long_bills(df):
+        return df[df["bill_length_mm"] > threshold]
+
+    assert len(artifacts.get("long", long_bills, penguins)) == (penguins["bill_length_mm"] > 40).sum()
+    threshold = 50
+    assert len(artifacts.get("long", long_bills, penguins)) == (penguins["bill_length_mm"] > 50).sum()
+
+
+@pytest.mark.parametrize("edit", [
+    lambda df: df.__setitem__("body_mass_g", df["body_mass_g"] * 2),
+    lambda df: df.__setitem__("extra", 1.0),
+    lambda df: df.loc.__setitem__((df.index[0], "species"), "Gentoo"),
+    lambda df: df.iloc.__setitem__((0, 0), "Gentoo"),
+    lambda df: df.drop(columns="bill_length_mm", inplace=True),
+    lambda df: df.sort_values("body_mass_g", inplace=True),
+])
+def test_edited_table_is_hashed_by_content(tmp_path, penguins, edit):
+    artifacts = ArtifactStore(tmp_path)
+    cleaned = artifacts.get("cleaned", lambda df: df.dropna(), penguins)
+    key = artifacts.key(subset, cleaned, species="Gentoo")
+    edit(cleaned)
+    assert artifacts.key(subset, cleaned, species="Gentoo") != key
+    pdt.assert_frame_equal(artifacts.get("gentoo", subset, cleaned, species="Gentoo"), subset(cleaned, "Gentoo"))
+
+
+def test_unchanged_table_keeps_its_lineage(tmp_path, penguins):
+    artifacts = ArtifactStore(tmp_path)
+    cleaned = artifacts.get("cleaned", lambda df: df.dropna(), penguins)
+    key = artifacts.key(subset, cleaned, species="Gentoo")
+    cleaned.groupby("species")["body_mass_g"].mean()
+    assert artifacts.key(subset, cleaned, species="Gentoo") == key
+    assert artifacts.key(subset, cleaned.copy(), species="Gentoo") != key
+
+
+def test_series(tmp_path, penguins):
+    artifacts = ArtifactStore(tmp_path)
+    masses = artifacts.get("masses", lambda df: df.groupby("species")["body_mass_g"].mean(), penguins)
+    pdt.assert_series_equal(masses, penguins.groupby("species")["body_mass_g"].mean(), check_index_type=False)
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from mb100t01.columnar import GroupPartial, groupby_agg, write_store
+
+
+@pytest.fixture
+def titanic():
+    rng = np.random.default_rng(0)
+    n = 2000
+    frame = pd.DataFrame({
+        "sex": rng.choice(["male", "female"], n),
+        "pclass": rng.integers(1, 4, n),
+        "age": rng.normal(30, 14, n),
+        "fare": rng.lognormal(3, 1, n),
+        "adult_male": rng.random(n) < 0.4,
+        "alone": rng.random(n) < 0.6,
+    })
+    frame.loc[rng.choice(n, 300, replace=False), "age"] = np.nan
+    return frame
+
+
+def sources(table, tmp_path):
+    return {
+        "frame": table,
+        "chunks": [table.iloc[start:start + 300] for start in range(0, len(table), 300)],
+        "store": write_store(table, tmp_path / "store", chunk_rows=256),
+    }
+
+
+@pytest.mark.parametrize("source", ["frame", "chunks", "store"])
+def test_mean_with_bool_and_missing_values(tmp_path, titanic, source):
+    data = sources(titanic, tmp_path)[source]
+    result = groupby_agg(data, "sex", "mean", chunk_rows=256, workers=1)
+    expected = titanic.groupby("sex").mean(numeric_only=True)
+    assert list(result.columns) == list(expected.columns)
+    pdt.assert_frame_equal(result, expected, check_dtype=False, check_index_type=False)
+
+
+@pytest.mark.parametrize("partitions", [1, 3])
+def test_merged_partials_match_pandas(titanic, partitions):
+    functions = ["count", "sum", "mean", "var", "std", "min", "max", "size"]
+    result = groupby_agg(titanic, ["sex", "pclass"], {"age": functions, "fare": functions},
+                         chunk_rows=97, workers=1, partitions=partitions)
+    expected = titanic.groupby(["sex", "pclass"]).agg({"age": functions, "fare": functions})
+    pdt.assert_frame_equal(result, expected, check_dtype=False, rtol=1e-9)
+
+
+def test_variance_of_groups_with_few_values():
+    frame = pd.DataFrame({"g": ["a", "a", "b", "c", "c", "c"], "x": [1.0, np.nan, 2.0, np.nan, np.nan, np.nan]})
+    chunks = [frame.iloc[[0]], frame.iloc[[1, 2]], frame.iloc[3:]]
+    result = groupby_agg(chunks, "g", ["count", "mean", "var", "std", "sum"], workers=1)
+    expected = frame.groupby("g").agg({"x": ["count", "mean", "var", "std", "sum"]})
+    pdt.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_merge_is_order_independent(titanic):
+    needs = {"age": {"count", "mean", "m2", "min", "max"}}
+    parts = [GroupPartial.of(titanic.iloc[start:start + 150], ["sex"], needs, 1.02)
+             for start in range(0, len(titanic), 150)]
+    forward = GroupPartial.merge(parts).stats["age"].sort_index()
+    backward = GroupPartial.merge([GroupPartial.merge(parts[::-2]), GroupPartial.merge(parts[-2::-2])])
+    pdt.assert_frame_equal(backward.stats["age"].sort_index(), forward, rtol=1e-12)
+    grouped = titanic.groupby("sex")["age"]
+    np.testing.assert_allclose(forward["m2"] / forward["count"], grouped.var(ddof=0))
+
+
+def test_quantiles_within_accuracy(titanic):
+    result = groupby_agg(titanic, "sex", {"fare": ["median", "q0.9"]}, chunk_rows=300, workers=1)
+    expected = titanic.groupby("sex")["fare"].quantile([0.5, 0.9], interpolation="lower").unstack()
+    np.testing.assert_allclose(result.to_numpy(), expected.to_numpy(), rtol=0.011)
@@ -0,0 +1,80 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from mb100t01.columnar import ColumnStore, col, count, query, ranges, select, write_store
+
+
+@pytest.fixture
+def table():
+    rng = np.random.default_rng(0)
+    n = 1000
+    frame = pd.DataFrame({
+        # sorted, so most chunks are skipped or taken whole by their statistics
+        "frame": np.repeat(np.arange(10), n // 10),
+        "area": rng.integers(50, 500, n),
+        "intensity": rng.normal(100, 20, n),
+        "Type": rng.choice(["A", "B", "C"], n),
+    })
+    frame.loc[rng.choice(n, 50, replace=False), "intensity"] = np.nan
+    return frame
+
+
+def test_round_trip(tmp_path, table):
+    store = write_store(table, tmp_path / "store", chunk_rows=64)
+    pdt.assert_frame_equal(ColumnStore(tmp_path / "store").to_pandas(), table, check_dtype=False)
+    assert store.n_chunks == 16
+
+
+def test_chunked_input(tmp_path, table):
+    chunks = (table.iloc[start:start + 300] for start in range(0, len(table), 300))
+    store = write_store(chunks, tmp_path / "store", chunk_rows=64)
+    pdt.assert_frame_equal(store.to_pandas(), table, check_dtype=False)
+
+
+@pytest.mark.parametrize("predicate, mask", [
+    (col("frame") == 3, lambda t: t["frame"] == 3),
+    (col("frame").between(2, 4), lambda t: t["frame"].between(2, 4)),
+    ((col("frame") >= 8) & (col("area") > 300), lambda t: (t["frame"] >= 8) & (t["area"] > 300)),
+    ((col("frame") < 1) | (col("Type") == "B"), lambda t: (t["frame"] < 1) | (t["Type"] == "B")),
+    (~(col("frame") > 2), lambda t: ~(t["frame"] > 2)),
+    (col("intensity") > 120, lambda t: t["intensity"] > 120),
+    (col("intensity").isna(), lambda t: t["intensity"].isna()),
+    (col("Type").isin(["A", "C"]), lambda t: t["Type"].isin(["A", "C"])),
+    (col("frame") > 100, lambda t: t["frame"] > 100),
+])
+def test_query_matches_pandas(tmp_path, table, predicate, mask):
+    store = write_store(table, tmp_path / "store", chunk_rows=64)
+    expected = table[mask(table)]
+    rows = select(store, predicate)
+    np.testing.assert_array_equal(rows, np.flatnonzero(mask(table)))
+    assert count(store, predicate) == len(expected)
+    runs = ranges(store, predicate)
+    np.testing.assert_array_equal(np.concatenate([np.arange(*run) for run in runs] or [[]]), rows)
+    pdt.assert_frame_equal(query(store, predicate), expected, check_dtype=False)
+
+
+def test_statistics_skip_chunks(tmp_path, table):
+    store = write_store(table, tmp_path / "store", chunk_rows=100)
+    minima, maxima, nulls = store.statistics("frame")
+    np.testing.assert_array_equal(minima, np.arange(10))
+    np.testing.assert_array_equal(maxima, np.arange(10))
+    assert not nulls.any()
+    bound = (col("frame") == 3)._bind(store)
+    np.testing.assert_array_equal(np.flatnonzero(bound.maybe), [3])
+    assert bound.always[3]
+
+
+def test_fractional_values_in_integer_column(tmp_path):
+    chunks = pd.read_csv(io.StringIO("x\n1\n1\n1\n1\n1\n1.5\n1.5\n1.5\n1.5\n1.5"), chunksize=5)
+    with pytest.raises(ValueError, match="read it as float"):
+        write_store(chunks, tmp_path / "store")
+
+
+def test_whole_floats_in_integer_column(tmp_path):
+    chunks = [pd.DataFrame({"x": [1, 2]}), pd.DataFrame({"x": [3.0, 4.0]})]
+    store = write_store(chunks, tmp_path / "store")
+    np.testing.assert_array_equal(store.column("x"), [1, 2, 3, 4])